@@ -0,0 +1,7 @@
+"""Benchmarks for Bytevm.
+
+Each module can be run on its own, from the top of the source tree::
+
+    python -m benchmarks.bench_dispatch
+
+"""
@@ -0,0 +1,255 @@
+"""Report how well the method caches do, and why fields have none.
+
+Runs a record-processing loop, which reads and writes fields of its
+records and calls their methods, some of them inherited, then lists the
+method loads of the loop with their hits, misses and where the attribute
+was found for each type.
+
+Then times single loads and stores of fields, as the VM does them, with
+getattr and setattr, and as a VM with a cache for each LOAD_ATTR and
+STORE_ATTR would: one that remembers, per type, whether the field lives
+in the instance's __dict__, in a slot or on the class, and goes straight
+there.  Each time is less the cost of calling a handler that does
+nothing, and the cache's hit rate is shown with it.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.caches import (
+    CLASS, INSTANCE, SLOT, AttrCache, attribute_kind, cache_stats,
+)
+from bytevm.program import get_program
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+class Record(object):
+    def __init__(self, price, qty):
+        self.price = price
+        self.qty = qty
+        self.seen = False
+    def total(self):
+        return self.price * self.qty
+
+class Discounted(Record):
+    rate = 2
+    def discount(self):
+        return self.price // self.rate
+
+class Special(Discounted):
+    pass
+
+def work(records, n):
+    revenue = 0
+    for i in range(n):
+        for r in records:
+            revenue += r.total()
+            if r.qty > 1:
+                revenue -= r.discount()
+            r.seen = True
+    return revenue
+
+records = [Special(p, p %% 3) for p in range(10)]
+work(records, %d)
+"""
+
+
+def attribute_caches(program):
+    """List the (index, name, cache) of the method loads of `program`."""
+    return [
+        (index, program.instruction(index)[1][0], cache)
+        for index, cache in cache_stats(program, AttrCache)
+    ]
+
+
+class FieldCache(AttrCache):
+    """An AttrCache that keeps where a field lives, for CachingVM.
+
+    Maps each type to the kind of the field and what was found on the
+    type for it: the descriptor of a slot, or the value of a class
+    attribute.
+
+    """
+    __slots__ = []
+
+    def miss(self, cls, name):
+        self.misses += 1
+        kind = attribute_kind(cls, name)
+        if cls.__setattr__ is not object.__setattr__:
+            kind = None
+        found = None
+        for klass in cls.__mro__:
+            if name in klass.__dict__:
+                found = klass.__dict__[name]
+                break
+        entry = (kind, found)
+        if len(self.kinds) < self.limit:
+            self.kinds[cls] = entry
+        else:
+            self.megamorphic = True
+        return entry
+
+
+class CachingVM(VirtualMachine):
+    """A VM whose LOAD_ATTR and STORE_ATTR take a FieldCache."""
+    def byte_LOAD_ATTR(self, attr, cache):
+        stack = self.frame.stack
+        obj = stack[-1]
+        cls = type(obj)
+        entry = cache.kinds.get(cls)
+        if entry is None:
+            entry = cache.miss(cls, attr)
+        else:
+            cache.hits += 1
+        kind, found = entry
+        if kind is INSTANCE:
+            try:
+                stack[-1] = obj.__dict__[attr]
+                return
+            except KeyError:
+                pass
+        elif kind is SLOT:
+            stack[-1] = found.__get__(obj, cls)
+            return
+        elif kind is CLASS and attr not in getattr(obj, '__dict__', ()):
+            stack[-1] = found
+            return
+        VirtualMachine.byte_LOAD_ATTR(self, attr)
+
+    def byte_STORE_ATTR(self, name, cache):
+        stack = self.frame.stack
+        obj = stack[-1]
+        cls = type(obj)
+        entry = cache.kinds.get(cls)
+        if entry is None:
+            entry = cache.miss(cls, name)
+        else:
+            cache.hits += 1
+        kind, found = entry
+        if kind is INSTANCE or kind is CLASS:
+            stack.pop()
+            obj.__dict__[name] = stack.pop()
+        elif kind is SLOT:
+            stack.pop()
+            found.__set__(obj, stack.pop())
+        else:
+            VirtualMachine.byte_STORE_ATTR(self, name)
+
+
+class Field(object):
+    def __init__(self):
+        self.value = 1
+
+
+class Slotted(object):
+    __slots__ = ['value']
+
+    def __init__(self):
+        self.value = 1
+
+
+class Constant(object):
+    value = 1
+
+
+class Frame(object):
+    """Just enough of a frame for a LOAD_ATTR or a STORE_ATTR."""
+    def __init__(self):
+        self.stack = []
+
+
+def time_handler(handler, args, prepare, number):
+    start = time.time()
+    for _ in range(number):
+        prepare()
+        handler(*args)
+    return time.time() - start
+
+
+def measure_field(vm_class, opname, obj, number=100000, repeat=7):
+    """Time `opname` of `obj`'s field with a `vm_class`, in nanoseconds.
+
+    Returns the time, and the cache used, if any.
+
+    """
+    vm = vm_class()
+    vm.frame = frame = Frame()
+    stack = frame.stack
+    handler = getattr(vm, 'byte_' + opname)
+    cache = FieldCache() if vm_class is CachingVM else None
+    args = ('value', cache) if cache is not None else ('value',)
+    if opname == 'LOAD_ATTR':
+        stack.append(obj)
+
+        def prepare():
+            stack[-1] = obj
+
+        def nothing(*args):
+            pass
+    else:
+        def prepare():
+            stack.append(2)
+            stack.append(obj)
+
+        def nothing(*args):
+            del stack[:]
+
+    best = calling = None
+    for _ in range(repeat):
+        elapsed = time_handler(handler, args, prepare, number)
+        if best is None or elapsed < best:
+            best = elapsed
+        elapsed = time_handler(nothing, args, prepare, number)
+        if calling is None or elapsed < calling:
+            calling = elapsed
+    return (best - calling) / number * 1e9, cache
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 5000
+    best = None
+    for _ in range(3):
+        vm = VirtualMachine()
+        f_globals = {'__builtins__': __builtins__}
+        code = compile(SOURCE % n, "<bench_attributes>", "exec")
+        start = time.time()
+        vm.run_code(code, f_globals=f_globals)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print("%d iterations: %.1f ms" % (n, best * 1e3))
+
+    program = get_program(f_globals['work'].func_code)
+    for index, name, cache in attribute_caches(program):
+        accesses = cache.hits + cache.misses
+        print("line %3d: %-10s %7d hits %3d misses (%5.1f%%)  %s" % (
+            program.line_number(index + 1), name, cache.hits, cache.misses,
+            100.0 * cache.hits / accesses if accesses else 0.0,
+            ", ".join(sorted(
+                kind if isinstance(kind, str) else 'method'
+                for kind in cache.kinds.values()
+            )),
+        ))
+
+    print()
+    print("%-21s %8s %8s %9s" % ("field", "getattr", "cached", "hit rate"))
+    for opname, label, obj in [
+        ('LOAD_ATTR', 'load from __dict__', Field()),
+        ('LOAD_ATTR', 'load from slot', Slotted()),
+        ('LOAD_ATTR', 'load from class', Constant()),
+        ('STORE_ATTR', 'store to __dict__', Field()),
+        ('STORE_ATTR', 'store to slot', Slotted()),
+    ]:
+        plain, _ = measure_field(VirtualMachine, opname, obj)
+        cached, cache = measure_field(CachingVM, opname, obj)
+        print("%-21s %5.0f ns %5.0f ns %8.1f%%" % (
+            label, plain, cached,
+            100.0 * cache.hits / (cache.hits + cache.misses),
+        ))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,49 @@
+"""Measure native code calling back into the VM.
+
+Sorts a million items with an interpreted key function, once calling the
+key through the general path, which binds the arguments and sets a frame
+up from scratch, and once through the Function's entry point.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+def key(x):
+    return -x
+
+data = list(range(%d))
+result = sorted(data, key=key)
+"""
+
+
+class GeneralPathVM(VirtualMachine):
+    """A VM whose Functions are always called by the general path."""
+    def make_entry(self, func):
+        return func._call
+
+
+def measure(vm_class, code):
+    """Return the time to run `code`, in milliseconds."""
+    vm = vm_class()
+    start = time.time()
+    vm.run_code(code)
+    return (time.time() - start) * 1e3
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000000
+    code = compile(SOURCE % n, "<bench_callbacks>", "exec")
+    for label, vm_class in [("general path", GeneralPathVM),
+                            ("entry point", VirtualMachine)]:
+        print("%-13s sorted %d items in %8.1f ms" % (
+            label, n, measure(vm_class, code)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
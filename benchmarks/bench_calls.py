@@ -0,0 +1,59 @@
+"""Report how well the call-site caches do.
+
+Runs a loop calling an interpreted function, a method, builtins and a
+site that sees many kinds of callable, then lists every call site of the
+loop with its hits, misses and the kinds of call it has cached.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.caches import CallSite, cache_stats
+from bytevm.program import get_program
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+class C(object):
+    def method(self, x):
+        return x
+
+def function(x):
+    return x
+
+def work(n):
+    c = C()
+    callables = [function, abs, c.method, float, str, bool]
+    for i in range(n):
+        function(i)
+        len("abc")
+        c.method(i)
+        callables[i %% len(callables)](i)
+
+work(%d)
+"""
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 5000
+    vm = VirtualMachine()
+    f_globals = {'__builtins__': __builtins__}
+    start = time.time()
+    vm.run_code(compile(SOURCE % n, "<bench_calls>", "exec"), f_globals=f_globals)
+    print("%d iterations: %.1f ms" % (n, (time.time() - start) * 1e3))
+
+    program = get_program(f_globals['work'].func_code)
+    for index, site in cache_stats(program, CallSite):
+        calls = site.hits + site.misses
+        print("line %3d: %6d hits %6d misses (%5.1f%%)%s  %s" % (
+            program.line_number(index + 1), site.hits, site.misses,
+            100.0 * site.hits / calls,
+            " megamorphic" if site.megamorphic else "",
+            ", ".join(sorted(site.kinds.values())),
+        ))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,87 @@
+"""Measure the per-instruction overhead of opcode dispatch.
+
+The same loop is run on a VM using the opcode-indexed dispatch table and on
+one that emulates the old dispatch by instruction name, which tested the
+name for each operator family and then looked up a byte_* method.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.program import opname
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+def work(n):
+    total = 0
+    i = 0
+    while i < n:
+        total += i * 2 - (i & 3)
+        i += 1
+    return total
+
+work(%d)
+"""
+
+
+def name_handler(byteName):
+    def handler(self, *arguments):
+        if byteName.startswith('UNARY_'):
+            return self.unaryOperator(byteName[6:])
+        elif byteName.startswith('BINARY_'):
+            return self.binaryOperator(byteName[7:])
+        elif byteName.startswith('INPLACE_'):
+            return self.inplaceOperator(byteName[8:])
+        elif 'SLICE+' in byteName:
+            return self.sliceOperator(byteName)
+        return getattr(self, 'byte_%s' % byteName)(*arguments)
+    return handler
+
+
+class NameDispatchVM(VirtualMachine):
+    """A VM that dispatches on instruction names, as Bytevm used to."""
+    @classmethod
+    def dispatch_table(cls):
+        return [name_handler(byteName) for byteName in opname]
+
+
+def count_instructions(code):
+    """Count the instructions executed by running `code`."""
+    steps = VirtualMachine.steps
+    VirtualMachine(trace=True).run_code(code)
+    return VirtualMachine.steps - steps
+
+
+def measure(make_vm, code, repeat=5):
+    """Return the best time per executed instruction, in nanoseconds.
+
+    `make_vm` is called to make a fresh VM for each run.
+
+    """
+    steps = count_instructions(code)
+    best = None
+    for _ in range(repeat):
+        vm = make_vm()
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / steps * 1e9
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    code = compile(SOURCE % n, "<bench_dispatch>", "exec")
+    before = measure(NameDispatchVM, code)
+    after = measure(VirtualMachine, code)
+    print("dispatch by name:   %7.1f ns/instruction" % before)
+    print("dispatch by opcode: %7.1f ns/instruction" % after)
+    print("speedup:            %7.2fx" % (before / after))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,86 @@
+"""Measure the effect of reusing retired frames.
+
+Runs deep recursion and a call-heavy loop with and without the frame
+pool, and reports the time taken, the number of Frame objects allocated,
+and the number of garbage collections during the run.
+
+"""
+
+from __future__ import print_function
+
+import gc
+import sys
+import time
+
+from bytevm import pyobj
+from bytevm.pyvm2 import VirtualMachine
+
+PROGRAMS = [
+    ("deep recursion", """\
+def depth(n):
+    if n == 0:
+        return 0
+    return depth(n - 1) + 1
+
+for i in range(%(n)d // 100):
+    depth(90)
+"""),
+    ("call-heavy loop", """\
+def add(a, b):
+    return a + b
+
+total = 0
+for i in range(%(n)d):
+    total = add(total, i)
+"""),
+]
+
+
+class CountingFrame(pyobj.Frame):
+    made = 0
+
+    def __init__(self, *args):
+        CountingFrame.made += 1
+        super(CountingFrame, self).__init__(*args)
+
+
+def collections():
+    return sum(stats['collections'] for stats in gc.get_stats())
+
+
+def measure(code, pooled, repeat=3):
+    """Return the best time in ms, with the frames made and the collections
+    during that run."""
+    best = None
+    for _ in range(repeat):
+        vm = VirtualMachine()
+        if not pooled:
+            vm.max_pooled_frames = 0
+        gc.collect()
+        CountingFrame.made = 0
+        before = collections()
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, CountingFrame.made, collections() - before)
+    return best[0] * 1e3, best[1], best[2]
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 5000
+    # The VM module refers to Frame by name, so count the ones it makes.
+    from bytevm import pyvm2
+    pyvm2.Frame = CountingFrame
+    for name, source in PROGRAMS:
+        code = compile(source % {'n': n}, "<bench_frames>", "exec")
+        print(name)
+        for pooled in [False, True]:
+            ms, made, gcs = measure(code, pooled)
+            print("  %-20s %8.1f ms, %6d frames made, %4d collections" % (
+                "with frame pool:" if pooled else "without frame pool:",
+                ms, made, gcs))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
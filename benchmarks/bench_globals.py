@@ -0,0 +1,137 @@
+"""Measure loads of global and builtin names.
+
+Runs a loop that calls builtins and a module-level helper on the VM, whose
+name loads look in the globals and then the builtins every time, and on
+one whose loads keep a hint of which dict the name was found in last, in
+an inline cache made the first time each load runs.  The loop does much
+besides loading names, so the time each VM takes to load a global and a
+builtin is measured on its own too, less the cost of calling a handler
+that does nothing but push.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from six.moves import builtins
+
+from bytevm.caches import inline_cache
+from bytevm.pyvm2 import NULL, VirtualMachine
+
+SOURCE = """\
+def helper(x):
+    return x
+
+def work(n):
+    data = [1, 2, 3]
+    total = 0
+    for i in range(n):
+        total += len(data) + abs(i) + helper(i)
+    return total
+
+work(%d)
+"""
+
+
+class Hint(object):
+    """Whether a load found its name in the builtins last time."""
+    __slots__ = ['builtin']
+
+    def __init__(self):
+        self.builtin = False
+
+
+class HintedVM(VirtualMachine):
+    """A VM whose name loads look first where the name was found last."""
+    def byte_LOAD_GLOBAL(self, name):
+        f = self.frame
+        f_globals = f.f_globals
+        caches = f.program.caches
+        hint = caches.get(f.f_lasti - 1) if caches else None
+        if hint is None:
+            hint = inline_cache(f.program, f.f_lasti - 1, Hint)
+        if hint.builtin and name not in f_globals:
+            val = f.f_builtins[name]
+        elif name in f_globals:
+            hint.builtin = False
+            val = f_globals[name]
+        else:
+            val = f.f_builtins.get(name, NULL)
+            if val is NULL:
+                raise NameError("name '%s' is not defined" % name)
+            hint.builtin = True
+        f.stack.append(val)
+
+
+def measure(vm_class, code, repeat=5):
+    """Return the best time to run `code`, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        vm = vm_class()
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3
+
+
+class Program(object):
+    """Just enough of a program for an inline cache."""
+    def __init__(self):
+        self.caches = None
+
+
+class Frame(object):
+    """Just enough of a frame for a LOAD_GLOBAL."""
+    def __init__(self):
+        self.f_globals = {'helper': None}
+        self.f_builtins = builtins.__dict__
+        self.program = Program()
+        self.f_lasti = 1
+        self.stack = []
+
+
+def time_loads(load, name, pop, number):
+    start = time.time()
+    for _ in range(number):
+        load(name)
+        pop()
+    return time.time() - start
+
+
+def measure_load(vm_class, name, number=200000, repeat=7):
+    """Return the best time a LOAD_GLOBAL of `name` takes, in nanoseconds."""
+    vm = vm_class()
+    vm.frame = frame = Frame()
+    vm.byte_LOAD_GLOBAL(name)
+    frame.stack.pop()
+
+    def push(name):
+        frame.stack.append(name)
+
+    best = calling = None
+    for _ in range(repeat):
+        elapsed = time_loads(vm.byte_LOAD_GLOBAL, name, frame.stack.pop, number)
+        if best is None or elapsed < best:
+            best = elapsed
+        elapsed = time_loads(push, name, frame.stack.pop, number)
+        if calling is None or elapsed < calling:
+            calling = elapsed
+    return (best - calling) / number * 1e9
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    code = compile(SOURCE % n, "<bench_globals>", "exec")
+    for label, vm_class in [("probing", VirtualMachine), ("hinted", HintedVM)]:
+        print("%-8s %8.1f ms %6.0f ns a global %6.0f ns a builtin" % (
+            label, measure(vm_class, code),
+            measure_load(vm_class, 'helper'), measure_load(vm_class, 'len'),
+        ))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,75 @@
+"""Measure inlining hot calls to small functions.
+
+Runs a loop calling small functions and a getter method, with and without
+inlining, and lists the decisions the inliner took.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+    def get_x(self):
+        return self.x
+
+def add(a, b):
+    return a + b
+
+def square(x):
+    return x * x
+
+def scale(p, k):
+    return Point(p.x * k, p.y * k)
+
+def work(n):
+    p = Point(3, 4)
+    total = 0
+    for i in range(n):
+        total = add(total, square(p.get_x()))
+        q = scale(p, 2)
+    return total
+
+work(%d)
+"""
+
+
+def measure(inlining, source, repeat=3):
+    """Return the best time to run `source`, in milliseconds, and the VM.
+
+    The source is compiled afresh each time, as the inliner patches the
+    programs of the code it runs, which are shared by every VM.
+
+    """
+    best = None
+    for _ in range(repeat):
+        code = compile(source, "<bench_inlining>", "exec")
+        vm = VirtualMachine(inlining=inlining)
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3, vm
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    for inlining in [False, True]:
+        elapsed, vm = measure(inlining, SOURCE % n)
+        label = "inlining:" if inlining else "calling:"
+        print("%-10s %8.1f ms" % (label, elapsed))
+    for decision in vm.inlining_decisions:
+        print("  line %3d: %-8s %s" % (
+            decision.line, decision.callee, decision.outcome))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,69 @@
+"""Measure the memory taken by decoded programs.
+
+A large module is imported through the VM, and every code object in it is
+decoded both into a Program and into the list of dis.Instruction tuples
+that frames used to hold.  The memory retained by each is measured with
+tracemalloc.
+
+"""
+
+from __future__ import print_function
+
+import dis
+import sys
+import tracemalloc
+import types
+
+import six
+
+from bytevm.program import Program
+from bytevm.pyvm2 import VirtualMachine
+
+
+def code_objects(code):
+    """Yield `code` and all the code objects nested in it."""
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            for nested in code_objects(const):
+                yield nested
+
+
+def module_code(vm, name):
+    """Import module `name` through `vm`, and return its code objects."""
+    module = vm.import_python_module(
+        name, {'__builtins__': six.moves.builtins}, {}, None, 0
+    )
+    return list(code_objects(vm.load_source(module.__file__)))
+
+
+def retained(decode, codes):
+    """Return the bytes retained by the results of `decode` on `codes`."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        results = [decode(code) for code in codes]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del results
+    return after - before
+
+
+def main(argv):
+    name = argv[1] if len(argv) > 1 else 'inspect'
+    codes = module_code(VirtualMachine(), name)
+    instructions = sum(len(Program(code)) for code in codes)
+    old = retained(lambda code: list(dis.get_instructions(code)), codes)
+    new = retained(Program, codes)
+    print("%s: %d code objects, %d instructions" % (
+        name, len(codes), instructions))
+    print("dis.Instruction lists: %9d bytes, %6.1f per code object" % (
+        old, old / len(codes)))
+    print("Programs:              %9d bytes, %6.1f per code object" % (
+        new, new / len(codes)))
+    print("reduction:             %9.1fx" % (old / new))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
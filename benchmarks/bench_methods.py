@@ -0,0 +1,80 @@
+"""Measure method calls made with LOAD_METHOD and CALL_METHOD.
+
+Runs an object-heavy loop on the VM, which calls methods without binding
+them, and on one whose LOAD_METHOD always binds a Method, as LOAD_ATTR
+does.  Reports the time taken and the number of bound Methods made.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm import pyobj
+from bytevm.pyvm2 import NULL, VirtualMachine
+
+SOURCE = """\
+class Vector(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+    def add(self, other):
+        self.x += other.x
+        self.y += other.y
+        return self
+    def norm(self):
+        return self.x * self.x + self.y * self.y
+
+def work(n):
+    v = Vector(0, 0)
+    step = Vector(1, 2)
+    total = 0
+    for i in range(n):
+        total += v.add(step).norm()
+    return total
+
+work(%d)
+"""
+
+
+class BindingVM(VirtualMachine):
+    """A VM that binds every method it calls, as Bytevm used to."""
+    def byte_LOAD_METHOD(self, name):
+        self.byte_LOAD_ATTR(name)
+        self.frame.stack.insert(-1, NULL)
+
+
+class CountingMethod(pyobj.Method):
+    __slots__ = []
+    made = 0
+
+    def __init__(self, *args):
+        CountingMethod.made += 1
+        super(CountingMethod, self).__init__(*args)
+
+
+def measure(vm_class, code):
+    """Return the time to run `code`, in milliseconds, and Methods made."""
+    Method, pyobj.Method = pyobj.Method, CountingMethod
+    CountingMethod.made = 0
+    try:
+        start = time.time()
+        vm_class().run_code(code)
+        elapsed = time.time() - start
+    finally:
+        pyobj.Method = Method
+    return elapsed * 1e3, CountingMethod.made
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 5000
+    code = compile(SOURCE % n, "<bench_methods>", "exec")
+    for label, vm_class in [("binding methods", BindingVM),
+                            ("LOAD_METHOD", VirtualMachine)]:
+        elapsed, made = measure(vm_class, code)
+        print("%-16s %8.1f ms, %6d bound methods made" % (label, elapsed, made))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
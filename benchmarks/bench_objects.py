@@ -0,0 +1,83 @@
+"""Report the memory taken by the VM's runtime objects.
+
+Each kind of object is allocated many times under tracemalloc, and the
+memory retained is reported per object.  For frames this includes their
+value stack, block stack and fast locals.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import tracemalloc
+
+import six
+
+from bytevm import pyobj
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+def fn(a, b):
+    c = a + b
+    return c
+
+class C(object):
+    def method(self):
+        return self
+"""
+
+
+def bytes_each(make, count=2000):
+    """Return the average bytes retained by each of `count` calls to `make`."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [make(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    # The list holding the objects isn't part of them.
+    overhead = sys.getsizeof(objects)
+    del objects
+    return (after - before - overhead) / count
+
+
+def main(argv):
+    vm = VirtualMachine()
+    f_globals = {'__builtins__': six.moves.builtins}
+    vm.run_code(compile(SOURCE, "<bench_objects>", "exec"), f_globals=f_globals)
+    fn = f_globals['fn']
+    cls = f_globals['C']
+    instance = cls()
+    method = cls.__dict__['method']
+
+    def make_frame(i):
+        return vm.make_frame(fn.func_code, {'a': 1, 'b': 2}, f_globals, {})
+
+    def make_generator(i):
+        return pyobj.Generator(None, vm)
+
+    def make_traceback(i):
+        return pyobj.traceback(frame, 10)
+
+    def make_function(i):
+        return pyobj.Function(None, fn.func_code, f_globals, (2,), None, None, vm)
+
+    frame = make_frame(0)
+    # Functions take their locals from the frame making them.
+    vm.push_frame(frame)
+    reports = [
+        ("Function", make_function),
+        ("Frame", make_frame),
+        ("Method", lambda i: pyobj.Method(instance, cls, method)),
+        ("Block", lambda i: pyobj.Block('loop', 10, 2)),
+        ("Cell", lambda i: pyobj.Cell(None)),
+        ("Generator", make_generator),
+        ("traceback", make_traceback),
+    ]
+    for name, make in reports:
+        print("%-10s %7.1f bytes" % (name, bytes_each(make)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
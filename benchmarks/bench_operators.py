@@ -0,0 +1,74 @@
+"""Measure a numeric inner loop.
+
+Runs the loop on a VM whose operators go through the family methods, as
+they all used to; on the VM, whose handlers apply the operators directly;
+on the VM quickening the runs of instructions that load operands and
+apply an operator into one; and on the VM using superinstructions, which
+quickens them too.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+def work(n):
+    total = 0
+    x = 0.5
+    for i in range(n):
+        if i %% 3 == 0:
+            total += i * i
+        else:
+            total -= i
+        x = x * 1.0001 + 0.5
+    return total, x
+
+work(%d)
+"""
+
+
+class FamilyVM(VirtualMachine):
+    """A VM whose operators are all run by their family's method."""
+    def unaryOperator(self, op):
+        return super(FamilyVM, self).unaryOperator(op)
+
+    def binaryOperator(self, op):
+        return super(FamilyVM, self).binaryOperator(op)
+
+    def inplaceOperator(self, op):
+        return super(FamilyVM, self).inplaceOperator(op)
+
+
+def measure(vm_class, options, code, repeat=5):
+    """Return the best time to run `code`, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        vm = vm_class(**options)
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    code = compile(SOURCE % n, "<bench_operators>", "exec")
+    family = measure(FamilyVM, {}, code)
+    print("%-19s %8.1f ms" % ("family methods:", family))
+    for label, options in [
+        ("direct handlers:", {}),
+        ("quickened runs:", {'quicken': True}),
+        ("superinstructions:", {'superinstructions': True}),
+    ]:
+        elapsed = measure(VirtualMachine, options, code)
+        print("%-19s %8.1f ms  %5.2fx" % (label, elapsed, family / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
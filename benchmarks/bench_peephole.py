@@ -0,0 +1,62 @@
+"""Measure the peephole optimizer.
+
+Runs a loop whose body does constant operations the host's compiler
+leaves behind, with and without the optimizer, and prints its report.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.peephole import format_report, report
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+def rule(n):
+    line = '-' * (n %% 3) + '=' * 40
+    wide = not 1 > 2
+    return line, wide
+
+def step(x):
+    y = x + 1
+    return y
+
+def work(n):
+    i = 0
+    while i < n:
+        rule(i)
+        i = step(i)
+    return i
+
+work(%d)
+"""
+
+
+def measure(peephole, code, repeat=3):
+    """Return the best time to run `code`, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        vm = VirtualMachine(peephole=peephole)
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    code = compile(SOURCE % n, "<bench_peephole>", "exec")
+    for peephole in [False, True]:
+        elapsed = measure(peephole, code)
+        label = "optimized:" if peephole else "plain:"
+        print("%-11s %8.1f ms" % (label, elapsed))
+    for line in format_report(report(code)):
+        print("  " + line)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,61 @@
+"""Measure warm starts from specialization profiles.
+
+Runs a short-lived program cold, as a fresh process would, then recording
+a profile, and then warm, specializing the programs from the profile
+before they run.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+
+from bytevm.profiles import Profile
+from bytevm.pyvm2 import VirtualMachine
+
+from .bench_inlining import SOURCE
+
+
+def measure(source, path=None, record=False, repeat=5):
+    """Return the best time to run `source`, in milliseconds.
+
+    The source is compiled afresh each time, as a new process would.  If
+    `path` is given, the profile kept there specializes the programs, and
+    if `record` is true, what the run learns is saved to it.
+
+    """
+    best = None
+    for _ in range(repeat):
+        code = compile(source, "<bench_profiles>", "exec")
+        profile = Profile.load(path) if path else None
+        start = time.time()
+        if profile is not None:
+            profile.apply(code)
+        VirtualMachine(inlining=True).run_code(code)
+        elapsed = time.time() - start
+        if record:
+            profile.record(code)
+            profile.save()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 40
+    source = SOURCE % n
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        print("%-10s %8.2f ms" % ("cold:", measure(source)))
+        measure(source, path, record=True, repeat=1)
+        print("%-10s %8.2f ms" % ("warm:", measure(source, path)))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,73 @@
+"""Compare nested and stackless execution of interpreted calls.
+
+Reports the time of a call-heavy recursion in both modes, and the deepest
+recursion each mode manages under the host's default recursion limit.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+fib(%d)
+"""
+
+DEPTH = """\
+def depth(n):
+    if n == 0:
+        return 0
+    return depth(n - 1) + 1
+
+depth(%d)
+"""
+
+
+def measure(stackless, code, repeat=3):
+    """Return the best time to run `code`, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        vm = VirtualMachine(stackless=stackless)
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3
+
+
+def deepest(stackless, limit):
+    """Find the deepest recursion that runs, up to `limit`."""
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        vm = VirtualMachine(stackless=stackless, recursion_limit=limit + 10)
+        try:
+            vm.run_code(compile(DEPTH % mid, "<bench_stackless>", "exec"))
+        except RecursionError:
+            high = mid - 1
+        else:
+            low = mid
+    return low
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 16
+    code = compile(SOURCE % n, "<bench_stackless>", "exec")
+    limit = 10 * sys.getrecursionlimit()
+    for stackless in [False, True]:
+        label = "stackless:" if stackless else "nested:"
+        print("%-11s fib(%d) in %7.1f ms, deepest recursion %d" % (
+            label, n, measure(stackless, code), deepest(stackless, limit)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,58 @@
+"""Compare running with and without superinstructions.
+
+Superinstructions execute two instructions per dispatch, so the time per
+dispatched instruction isn't comparable; this reports the time of the
+whole run instead.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+def is_small(x, limit):
+    return x < limit
+
+def work(n):
+    total = 0
+    i = 0
+    while i < n:
+        if is_small(i, 100):
+            total = total + i
+        j = i
+        i = j + 1
+    return total
+
+work(%d)
+"""
+
+
+def measure(superinstructions, code, repeat=5):
+    """Return the best time to run `code`, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        vm = VirtualMachine(superinstructions=superinstructions)
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 3000
+    code = compile(SOURCE % n, "<bench_superinstructions>", "exec")
+    plain = measure(False, code)
+    fused = measure(True, code)
+    print("plain instructions: %8.1f ms" % plain)
+    print("superinstructions:  %8.1f ms" % fused)
+    print("speedup:            %8.2fx" % (plain / fused))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
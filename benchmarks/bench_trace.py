@@ -0,0 +1,71 @@
+"""Compare the lean run loop with the tracing one on the test programs.
+
+The programs are collected from the test suite by running its tests with
+an assert_ok that only compiles and records them.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import textwrap
+import time
+import unittest
+
+import six
+
+from bytevm.pyvm2 import VirtualMachine
+from tests import vmtest
+
+TEST_MODULES = [
+    'tests.test_basic', 'tests.test_exceptions', 'tests.test_functions',
+    'tests.test_with',
+]
+
+
+def collect_programs():
+    """Return the code objects of the programs the test suite runs."""
+    programs = []
+
+    def record(self, code, raises=None):
+        code = compile(textwrap.dedent(code), "<%s>" % self.id(), "exec", 0, 1)
+        programs.append(code)
+
+    real_assert_ok = vmtest.VmTestCase.assert_ok
+    vmtest.VmTestCase.assert_ok = record
+    try:
+        suite = unittest.defaultTestLoader.loadTestsFromNames(TEST_MODULES)
+        suite.run(unittest.TestResult())
+    finally:
+        vmtest.VmTestCase.assert_ok = real_assert_ok
+    return programs
+
+
+def run_all(programs, trace):
+    real_stdout = sys.stdout
+    sys.stdout = six.StringIO()
+    try:
+        start = time.time()
+        for code in programs:
+            try:
+                VirtualMachine(trace=trace).run_code(code)
+            except Exception:
+                pass
+        return time.time() - start
+    finally:
+        sys.stdout = real_stdout
+
+
+def main(argv):
+    repeat = int(argv[1]) if len(argv) > 1 else 20
+    programs = collect_programs()
+    lean = min(run_all(programs, False) for _ in range(repeat))
+    traced = min(run_all(programs, True) for _ in range(repeat))
+    print("%d test programs" % len(programs))
+    print("tracing loop: %7.1f ms" % (traced * 1e3))
+    print("lean loop:    %7.1f ms" % (lean * 1e3))
+    print("speedup:      %7.2fx" % (traced / lean))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
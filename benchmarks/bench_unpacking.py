@@ -0,0 +1,59 @@
+"""Measure eliding the containers of packing and unpacking.
+
+Runs a loop that rotates four values by multiple assignment, and calls
+through a wrapper passing on `*args` and `**kwargs`, with and without the
+peephole optimizer, which passes the values and arguments on without
+building tuples and dicts for them.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from bytevm.pyvm2 import VirtualMachine
+
+SOURCE = """\
+def target(a, b, c=0, d=0):
+    return a
+
+def wrapper(x, *args, **kwargs):
+    return target(x, *args, **kwargs)
+
+def work(n):
+    a, b, c, d = 1, 2, 3, 4
+    for i in range(n):
+        a, b, c, d = b, c, d, a
+        wrapper(a, b, c=c, d=d)
+        target(a, *(b, c), **{'d': d})
+    return a
+
+work(%d)
+"""
+
+
+def measure(peephole, code, repeat=3):
+    """Return the best time to run `code`, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        vm = VirtualMachine(peephole=peephole)
+        start = time.time()
+        vm.run_code(code)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    code = compile(SOURCE % n, "<bench_unpacking>", "exec")
+    for peephole in [False, True]:
+        elapsed = measure(peephole, code)
+        label = "optimized:" if peephole else "plain:"
+        print("%-11s %8.1f ms" % (label, elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,199 @@
+"""Binding call arguments to the locals of a function frame.
+
+Working out which argument goes to which parameter depends only on the
+function's code object, so it is done once per code object.  The Binder
+for a code object then puts the arguments of each call straight into the
+list of fast locals the frame will run with, raising the same TypeErrors
+CPython does when they don't fit.
+
+"""
+
+import inspect
+import weakref
+
+# The value of a fast local that hasn't been assigned.
+UNBOUND = object()
+
+# What calling a function makes: a frame to run, a generator, a coroutine,
+# or an asynchronous generator.
+PLAIN = 'plain'
+GENERATOR = 'generator'
+COROUTINE = 'coroutine'
+ASYNC_GENERATOR = 'async generator'
+
+CO_COROUTINE = getattr(inspect, 'CO_COROUTINE', 0)
+CO_ITERABLE_COROUTINE = getattr(inspect, 'CO_ITERABLE_COROUTINE', 0)
+CO_ASYNC_GENERATOR = getattr(inspect, 'CO_ASYNC_GENERATOR', 0)
+
+
+def frame_kind(code):
+    """What calling a function with this code object makes."""
+    flags = code.co_flags
+    if flags & inspect.CO_GENERATOR:
+        return GENERATOR
+    elif flags & (CO_COROUTINE | CO_ITERABLE_COROUTINE):
+        return COROUTINE
+    elif flags & CO_ASYNC_GENERATOR:
+        return ASYNC_GENERATOR
+    return PLAIN
+
+
+class Binder(object):
+    """Binds the arguments of calls to a code object to its fast locals.
+
+    The locals are laid out like `co_varnames`: the positional parameters,
+    the keyword-only ones, then *args and **kwargs if the code takes them,
+    then the other local variables, which start out UNBOUND.
+
+    """
+    __slots__ = [
+        'name', 'varnames', 'argcount', 'kwonlyargcount', 'varargs',
+        'varkeywords', 'simple', 'positions', 'padding', 'kind',
+    ]
+
+    def __init__(self, code):
+        self.name = code.co_name
+        self.varnames = code.co_varnames
+        self.argcount = code.co_argcount
+        self.kwonlyargcount = getattr(code, 'co_kwonlyargcount', 0)
+        self.varargs = bool(code.co_flags & inspect.CO_VARARGS)
+        self.varkeywords = bool(code.co_flags & inspect.CO_VARKEYWORDS)
+        # Only positional parameters: the common case.
+        self.simple = not (
+            self.kwonlyargcount or self.varargs or self.varkeywords
+        )
+        named = self.argcount + self.kwonlyargcount
+        # Where each parameter that can be passed by keyword goes.
+        self.positions = dict(
+            (name, index) for index, name in enumerate(self.varnames[:named])
+        )
+        # Everything after the positional parameters starts out UNBOUND.
+        self.padding = (UNBOUND,) * (code.co_nlocals - self.argcount)
+        self.kind = frame_kind(code)
+
+    def bind(self, args, kwargs, defaults, kwdefaults):
+        """Make the fast locals for a call with `args` and `kwargs`."""
+        argcount = self.argcount
+        given = len(args)
+        if self.simple and not kwargs and given == argcount:
+            fast = list(args)
+            fast.extend(self.padding)
+            return fast
+
+        # This follows the order CPython checks the arguments in, so that a
+        # call with more than one thing wrong reports the same problem.
+        fast = list(args[:argcount])
+        if given < argcount:
+            fast.extend((UNBOUND,) * (argcount - given))
+        fast.extend(self.padding)
+        index = argcount + self.kwonlyargcount
+        if self.varargs:
+            fast[index] = tuple(args[argcount:])
+            index += 1
+        if self.varkeywords:
+            extra = fast[index] = {}
+        if kwargs:
+            positions = self.positions
+            for name, value in kwargs.items():
+                index = positions.get(name)
+                if index is None:
+                    if not self.varkeywords:
+                        raise TypeError(
+                            "%s() got an unexpected keyword argument '%s'"
+                            % (self.name, name)
+                        )
+                    extra[name] = value
+                elif fast[index] is not UNBOUND:
+                    raise TypeError(
+                        "%s() got multiple values for argument '%s'"
+                        % (self.name, name)
+                    )
+                else:
+                    fast[index] = value
+
+        if given > argcount and not self.varargs:
+            raise self.too_many_positional(given, defaults, fast)
+        if given < argcount:
+            defaults = defaults or ()
+            required = argcount - len(defaults)
+            missing = [i for i in range(given, required) if fast[i] is UNBOUND]
+            if missing:
+                raise self.missing_arguments('positional', missing)
+            for i in range(max(given, required), argcount):
+                if fast[i] is UNBOUND:
+                    fast[i] = defaults[i - required]
+        if self.kwonlyargcount:
+            missing = []
+            for i in range(argcount, argcount + self.kwonlyargcount):
+                if fast[i] is UNBOUND:
+                    name = self.varnames[i]
+                    if kwdefaults and name in kwdefaults:
+                        fast[i] = kwdefaults[name]
+                    else:
+                        missing.append(i)
+            if missing:
+                raise self.missing_arguments('keyword-only', missing)
+        return fast
+
+    def too_many_positional(self, given, defaults, fast):
+        argcount = self.argcount
+        kwonly_given = len([
+            value for value in fast[argcount:argcount + self.kwonlyargcount]
+            if value is not UNBOUND
+        ])
+        defcount = len(defaults) if defaults else 0
+        if defcount:
+            plural = True
+            sig = "from %d to %d" % (argcount - defcount, argcount)
+        else:
+            plural = argcount != 1
+            sig = "%d" % argcount
+        if kwonly_given:
+            kwonly_sig = " positional argument%s (and %d keyword-only argument%s)" % (
+                "s" if given != 1 else "",
+                kwonly_given,
+                "s" if kwonly_given != 1 else "",
+            )
+        else:
+            kwonly_sig = ""
+        return TypeError(
+            "%s() takes %s positional argument%s but %d%s %s given" % (
+                self.name, sig, "s" if plural else "", given, kwonly_sig,
+                "was" if given == 1 and not kwonly_given else "were",
+            )
+        )
+
+    def missing_arguments(self, kind, missing):
+        names = [repr(self.varnames[i]) for i in missing]
+        if len(names) == 1:
+            listed = names[0]
+        elif len(names) == 2:
+            listed = "%s and %s" % tuple(names)
+        else:
+            listed = "%s, %s, and %s" % (
+                ", ".join(names[:-2]), names[-2], names[-1]
+            )
+        return TypeError(
+            "%s() missing %d required %s argument%s: %s" % (
+                self.name, len(names), kind,
+                "" if len(names) == 1 else "s", listed,
+            )
+        )
+
+
+# Keyed on the identity of the code object, like the cache of programs.
+_binders = {}
+
+
+def get_binder(code):
+    """Get the Binder for `code`, making it if it isn't cached yet."""
+    key = id(code)
+    entry = _binders.get(key)
+    if entry is None:
+        # The cache is passed in, as the module's globals may be gone by the
+        # time code objects die at interpreter exit.
+        ref = weakref.ref(
+            code, lambda ref, key=key, cache=_binders: cache.pop(key, None)
+        )
+        entry = _binders[key] = (ref, Binder(code))
+    return entry[1]
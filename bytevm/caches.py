@@ -0,0 +1,233 @@
+"""Inline caches for Bytevm.
+
+An inline cache belongs to one instruction of a decoded program, and
+remembers what the instruction found out the last times it ran, so that
+it can skip working it out again.  Caches are kept in the program's
+`caches` dict, keyed by the index of their instruction, which is one
+less than the frame's `f_lasti` while the instruction runs.
+
+"""
+
+import types
+import weakref
+
+from .pyobj import Function, Method
+
+# How a call site calls a callable: an interpreted Function, a Method
+# wrapping one, a host Python function, which the VM may interpret in its
+# place, or anything else, which is called natively.
+FUNCTION = 'function'
+METHOD = 'method'
+HOST_FUNCTION = 'host function'
+NATIVE = 'native'
+
+
+def call_kind(func):
+    """Work out how to call `func`.
+
+    Returns the kind of call, and whether every object of the same type
+    is called the same way, so the kind can be cached for the type.
+
+    """
+    cls = type(func)
+    if cls is Function:
+        return FUNCTION, True
+    elif cls is Method:
+        return METHOD, True
+    elif cls is types.FunctionType:
+        return HOST_FUNCTION, True
+    elif hasattr(func, 'im_func'):
+        # Something else acting as a method.  The attribute could belong
+        # to just this object.
+        return METHOD, False
+    return NATIVE, True
+
+
+class CallSite(object):
+    """The inline cache of a call instruction.
+
+    It maps the types of the callables called from the site to the kind of
+    call each needs.  A site that sees more than `limit` types is
+    megamorphic: it stops learning new types, and works out the kind of
+    call for each of them every time.
+
+    For the inliner, `target` is the last Function called from the site,
+    and `streak` the number of calls in a row it has had.  `inlining` is
+    None until the inliner has decided what to do with the site, and then
+    is the decision.  `profiled` is the code hash of the callee a profile
+    says was inlined at the site in an earlier run, until the site's first
+    call takes the hint up.
+
+    """
+    __slots__ = [
+        'kinds', 'hits', 'misses', 'megamorphic', 'target', 'streak',
+        'inlining', 'profiled',
+    ]
+
+    limit = 4
+
+    def __init__(self):
+        self.kinds = {}
+        self.hits = 0
+        self.misses = 0
+        self.megamorphic = False
+        self.target = None
+        self.streak = 0
+        self.inlining = None
+        self.profiled = None
+
+    def miss(self, func):
+        """Work out the kind of call `func` needs, since its type isn't known.
+
+        The VM looks known types up in `kinds` itself, and counts the hits.
+
+        """
+        self.misses += 1
+        kind, cacheable = call_kind(func)
+        if cacheable:
+            if len(self.kinds) < self.limit:
+                self.kinds[type(func)] = kind
+            else:
+                self.megamorphic = True
+        return kind
+
+    def __repr__(self):         # pragma: no cover
+        return '<CallSite %d hits, %d misses, %r>' % (
+            self.hits, self.misses, sorted(self.kinds.values())
+        )
+
+
+# Where an attribute of an object lives, going by its type: in the
+# object's own __dict__, since its type has nothing by the attribute's name;
+# on its type, as a plain value, as a slot, or as any other descriptor;
+# on the object and its bases, since the object is a class; or anywhere,
+# since the type customizes its attribute access.  An attribute that is an
+# interpreted Function on the type is a method, and is cached as the
+# Function itself; or, if the type's instances have a __dict__, which
+# might shadow it, as a tuple holding the Function, so that the loads know
+# to look there first.
+INSTANCE = 'instance'
+CLASS = 'class'
+SLOT = 'slot'
+DESCRIPTOR = 'descriptor'
+TYPE = 'type'
+GENERIC = 'generic'
+
+# An object to tell lookups that found nothing from ones that found None.
+_MISSING = object()
+
+
+def attribute_kind(cls, name):
+    """Work out where attribute `name` of instances of `cls` lives.
+
+    Returns one of the kinds above, or the Function, or a tuple holding it,
+    for a method.
+
+    """
+    if issubclass(cls, type):
+        return TYPE
+    if cls.__getattribute__ is not object.__getattribute__:
+        return GENERIC
+    for klass in cls.__mro__:
+        attr = klass.__dict__.get(name, _MISSING)
+        if attr is not _MISSING:
+            break
+    else:
+        return INSTANCE
+    if type(attr) is Function:
+        if cls.__dictoffset__:
+            return (attr,)
+        return attr
+    elif type(attr) is types.MemberDescriptorType:
+        return SLOT
+    elif hasattr(type(attr), '__get__'):
+        return DESCRIPTOR
+    return CLASS
+
+
+# The attribute caches that have learnt something, for classes_changed().
+_filled = weakref.WeakSet()
+
+
+def classes_changed():
+    """Forget everything the attribute caches learnt.
+
+    What a cache learns about a type holds only as long as the type and
+    its bases don't change.  The VM calls this whenever the code it runs
+    sets or deletes an attribute of a class; host code that changes
+    classes the VM's code uses must call it too.
+
+    """
+    for cache in list(_filled):
+        cache.kinds.clear()
+        cache.megamorphic = False
+    _filled.clear()
+
+
+class AttrCache(object):
+    """The inline cache of a LOAD_METHOD instruction.
+
+    A LOAD_METHOD gets one the first time it runs.  It maps the types of the objects the instruction has seen to
+    where the attribute lives for each, as worked out by attribute_kind(),
+    and counts the instruction's hits and misses.  Like a CallSite, it
+    stops learning types once it has seen `limit` of them.
+
+    """
+    __slots__ = ['kinds', 'hits', 'misses', 'megamorphic', '__weakref__']
+
+    limit = 4
+
+    def __init__(self):
+        self.kinds = {}
+        self.hits = 0
+        self.misses = 0
+        self.megamorphic = False
+
+    def miss(self, cls, name):
+        """Work out where `name` lives for `cls`, since it isn't known.
+
+        The VM looks known types up in `kinds` itself, and counts the hits.
+
+        """
+        self.misses += 1
+        kind = attribute_kind(cls, name)
+        if len(self.kinds) < self.limit:
+            self.kinds[cls] = kind
+            _filled.add(self)
+        else:
+            self.megamorphic = True
+        return kind
+
+    def __repr__(self):         # pragma: no cover
+        return '<AttrCache %d hits, %d misses, %r>' % (
+            self.hits, self.misses,
+            sorted(kind if isinstance(kind, str) else 'method'
+                   for kind in self.kinds.values()),
+        )
+
+
+def inline_cache(program, index, make):
+    """Get the cache of the `index`'th instruction of `program`.
+
+    If the instruction has no cache yet, one is made by calling `make`.
+
+    """
+    caches = program.caches
+    if caches is None:
+        caches = program.caches = {}
+    cache = caches.get(index)
+    if cache is None:
+        cache = caches[index] = make()
+    return cache
+
+
+def cache_stats(program, kind=None):
+    """Get the caches of `program`, as a list of (index, cache) pairs.
+
+    Only caches of class `kind` are listed, if it's given.
+
+    """
+    return sorted(
+        (index, cache) for index, cache in (program.caches or {}).items()
+        if kind is None or isinstance(cache, kind)
+    )
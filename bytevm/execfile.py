@@ -8,6 +8,8 @@ import argparse
 import logging
 import dis
 
+from .peephole import format_report, report
+from .profiles import Profile
 from .pyvm2 import VirtualMachine
 from .sys import pseudosys
 
@@ -15,8 +17,33 @@ NoSource = Exception
 
 class ExecFile:
 
+    def __init__(self, trace=False, stackless=False, recursion_limit=None,
+                 inlining=False, profile=None, peephole=False,
+                 peephole_report=False, quicken=False):
+        # Whether to run the VM's tracing loop.
+        self.trace = trace
+        # Whether to run the VM in stackless mode, and how deep its calls
+        # may go (the VM's default if None).
+        self.stackless = stackless
+        self.recursion_limit = recursion_limit
+        # Whether the VM inlines hot calls to small functions.
+        self.inlining = inlining
+        # The file to keep a specialization profile of the programs run in,
+        # so later runs start specialized, or None.
+        self.profile = profile
+        # Whether the VM runs programs through the peephole optimizer, and
+        # whether to write its report to stderr after running a file.
+        self.peephole = peephole
+        self.peephole_report = peephole_report
+        # Whether the VM quickens common runs of instructions.
+        self.quicken = quicken
+
     def exec_code_object(self, code, env):
-        vm = VirtualMachine()
+        vm = VirtualMachine(
+            trace=self.trace, stackless=self.stackless,
+            recursion_limit=self.recursion_limit, inlining=self.inlining,
+            peephole=self.peephole, quicken=self.quicken,
+        )
         vm.run_code(code, f_globals=env)
 
     def run_python_module(self, modulename, args):
@@ -109,8 +136,26 @@ class ExecFile:
             with open("%s.pyd" % filename, 'w+') as f:
                 dis.dis(code, file=f)
 
+            # Specialize the code as an earlier run learnt to, if there's a
+            # profile, and record what this run learns.
+            profile = Profile.load(self.profile) if self.profile else None
+            if profile is not None:
+                profile.apply(
+                    code, peephole=self.peephole, quicken=self.quicken,
+                )
+
             # Execute the source file.
-            self.exec_code_object(code, main_mod.__dict__)
+            try:
+                self.exec_code_object(code, main_mod.__dict__)
+            finally:
+                if profile is not None:
+                    profile.record(
+                        code, peephole=self.peephole, quicken=self.quicken,
+                    )
+                    profile.save()
+                if self.peephole and self.peephole_report:
+                    for line in format_report(report(code)):
+                        sys.stderr.write(line + "\n")
         finally:
             pass
 
@@ -129,6 +174,37 @@ class ExecFile:
             '-v', '--verbose', dest='verbose', action='store_true',
             help="trace the execution of the bytecode.",
         )
+        parser.add_argument(
+            '--stackless', dest='stackless', action='store_true',
+            help="run calls to interpreted functions without nesting.",
+        )
+        parser.add_argument(
+            '--recursion-limit', dest='recursion_limit', type=int,
+            help="the maximum depth of the interpreter's call stack.",
+        )
+        parser.add_argument(
+            '--inline', dest='inlining', action='store_true',
+            help="inline hot calls to small functions.",
+        )
+        parser.add_argument(
+            '--profile', dest='profile', metavar='FILE',
+            help="keep a specialization profile in FILE, to start "
+                 "later runs specialized.",
+        )
+        parser.add_argument(
+            '--peephole', dest='peephole', action='store_true',
+            help="run programs through the peephole optimizer.",
+        )
+        parser.add_argument(
+            '--peephole-report', dest='peephole_report', action='store_true',
+            help="with --peephole, report what the optimizer did to each "
+                 "code object.",
+        )
+        parser.add_argument(
+            '--quicken', dest='quicken', action='store_true',
+            help="quicken common runs of instructions, such as loading "
+                 "two locals and adding them.",
+        )
         parser.add_argument(
             'prog',
             help="The program to run.",
@@ -141,6 +217,14 @@ class ExecFile:
 
         level = logging.DEBUG if args.verbose else logging.WARNING
         logging.basicConfig(level=level)
+        self.trace = args.verbose
+        self.stackless = args.stackless
+        self.recursion_limit = args.recursion_limit
+        self.inlining = args.inlining
+        self.profile = args.profile
+        self.peephole = args.peephole
+        self.peephole_report = args.peephole_report
+        self.quicken = args.quicken
 
         new_argv = [args.prog] + args.args
         if args.module:
@@ -0,0 +1,146 @@
+"""Inlining small interpreted functions into their callers.
+
+When a call site keeps calling the same small Function, the call
+instruction is replaced with CALL_INLINED, which runs the callee's
+instructions on the caller's stack instead of making a frame for them.
+The callee's arguments are already on the stack, below where its body
+works, so reading a parameter copies it from there.
+
+Inlined calls are guarded: if the callee on the stack isn't the Function
+that was inlined, say because the global naming it has been rebound, or
+its code has been replaced, the call is deoptimized back to the
+instruction it replaced.
+
+"""
+
+import collections
+import dis
+import inspect
+
+from .binder import frame_kind, PLAIN
+from .program import FUSED, get_program, opmap, operand_count
+
+# The longest body that is inlined, in instructions, leaving out the
+# RETURN_VALUE ending it.
+MAX_INLINED_LENGTH = 8
+
+# Instructions an inlined body may use.  None of them call back into the
+# VM, jump, or need a frame of the callee's own.
+INLINABLE = set(
+    op for name, op in dis.opmap.items()
+    if name.startswith(('BINARY_', 'UNARY_'))
+    or name in ('LOAD_CONST', 'LOAD_FAST', 'LOAD_ATTR', 'COMPARE_OP',
+                'BUILD_TUPLE', 'BUILD_LIST')
+)
+LOAD_FAST = dis.opmap['LOAD_FAST']
+RETURN_VALUE = dis.opmap['RETURN_VALUE']
+
+# The instructions that make the calls that can be inlined.
+INLINABLE_CALLS = set(
+    opmap[name] for name in ['CALL_FUNCTION', 'CALL_METHOD'] if name in opmap
+)
+
+# The superinstructions whose second half is an inlinable call, mapped to
+# the opcode of their first half.
+FUSED_CALLS = dict(
+    (fused, first) for (first, second), fused in FUSED.items()
+    if second in INLINABLE_CALLS
+)
+
+# A decision the inliner took about a call site: its file and line, the
+# name of the function it calls, and what was done, which is 'inlined',
+# 'deoptimized', or why the call wasn't inlined.
+Decision = collections.namedtuple(
+    'Decision', ['filename', 'line', 'callee', 'outcome']
+)
+
+
+class Inlined(object):
+    """The operand of a CALL_INLINED instruction.
+
+    `body` is the callee's instructions, as (opcode, arguments) pairs,
+    where an opcode of None copies the parameter whose index is the
+    argument.  `opcode` and `arguments` are those of the call instruction
+    it replaced, for deoptimizing.
+
+    """
+    __slots__ = ['func', 'code', 'argc', 'body', 'opcode', 'arguments']
+
+    def __init__(self, func, argc, body, opcode, arguments):
+        self.func = func
+        self.code = func.func_code
+        self.argc = argc
+        self.body = body
+        self.opcode = opcode
+        self.arguments = arguments
+
+    def __repr__(self):         # pragma: no cover
+        return '<Inlined %s>' % self.func.__name__
+
+
+def inline_body(code):
+    """Get the body to inline for calls to `code`.
+
+    Returns the body, and None; or None, and why `code` can't be inlined.
+
+    """
+    if frame_kind(code) is not PLAIN:
+        return None, frame_kind(code)
+    if code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS) or \
+            getattr(code, 'co_kwonlyargcount', 0):
+        return None, 'not only positional parameters'
+    if code.co_cellvars or code.co_freevars:
+        return None, 'closure'
+    program = get_program(code)
+    if len(program) - 1 > MAX_INLINED_LENGTH:
+        return None, 'too long'
+    body = []
+    for i in range(len(program)):
+        op = program.opcodes[i]
+        arguments = program.arguments[program.operands[i]]
+        if op == RETURN_VALUE and i == len(program) - 1:
+            return tuple(body), None
+        if op not in INLINABLE:
+            return None, 'uses %s' % program.instruction(i)[0]
+        if op == LOAD_FAST:
+            if arguments[0] >= code.co_argcount:
+                return None, 'uses local variables'
+            body.append((None, arguments[0]))
+        else:
+            body.append((op, arguments))
+    return None, 'does not end by returning'
+
+
+def inline_call(program, index, func, argc):
+    """Inline the call of `func` with `argc` arguments at `program[index]`.
+
+    The call must pass the arguments by position only, and be the only
+    call the instruction makes.  Returns the decision taken.
+
+    """
+    code = func.func_code
+    if program.opcodes[index] not in INLINABLE_CALLS:
+        return 'not a positional call'
+    if argc != code.co_argcount:
+        return 'uses default arguments'
+    body, reason = inline_body(code)
+    if body is None:
+        return reason
+    inlined = Inlined(
+        func, argc, body,
+        program.opcodes[index], program.arguments[program.operands[index]],
+    )
+    fused = program.opcodes[index - 1] if index else None
+    if fused in FUSED_CALLS:
+        # The call is the second half of a superinstruction, which would
+        # step over CALL_INLINED: put its first half back on its own.
+        op = FUSED_CALLS[fused]
+        first = program.arguments[program.operands[index - 1]]
+        program.patch(index - 1, op, first[:operand_count(op)])
+    program.patch(index, opmap['CALL_INLINED'], (inlined,))
+    return 'inlined'
+
+
+def deoptimize(program, index, inlined):
+    """Put back the call that CALL_INLINED replaced at `program[index]`."""
+    program.patch(index, inlined.opcode, inlined.arguments)
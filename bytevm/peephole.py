@@ -0,0 +1,583 @@
+"""A peephole optimizer for Bytevm's decoded programs.
+
+The optimizer rewrites a copy of a Program, in rounds, until a round
+finds nothing more to do:
+
+* Operators applied to constants are folded into a constant, as are
+  conditional jumps on one.  The host's compiler folds most of these
+  already, but leaves long sequences, comparisons and `not`.
+* Jumps to unconditional jumps are threaded to where the chain ends, and
+  jumps to the next instruction are dropped.
+* Instructions no path reaches are dropped, such as those after a
+  RETURN_VALUE or a jump.
+* Redundant pairs are collapsed: a constant loaded only to be popped, or
+  a fast local stored only to be loaded back and returned.
+* Containers built only for the next instructions to take apart aren't
+  built: a tuple packed and unpacked again becomes a permutation of the
+  stack, and the tuples and dicts of arguments of CALL_FUNCTION_EX are
+  built as the list and dict the call is made with.
+
+Dropping an instruction renumbers those after it, and the jump targets,
+exception handlers included, that point at them.  Each instruction keeps
+its source line.  Instructions are only ever folded together when no
+jump lands in the middle of them, so every path through the program does
+what it did before.
+
+"""
+
+import collections
+import copy
+import dis
+import operator
+
+import six
+
+from .program import (
+    PURE_PUSHES, STACK_REACH, compact_array, find_program, get_program,
+    opmap, opname, shared_arguments, walk_code,
+)
+
+LOAD_CONST = opmap['LOAD_CONST']
+LOAD_FAST = opmap['LOAD_FAST']
+STORE_FAST = opmap['STORE_FAST']
+POP_TOP = opmap['POP_TOP']
+DUP_TOP = opmap['DUP_TOP']
+RETURN_VALUE = opmap['RETURN_VALUE']
+COMPARE_OP = opmap['COMPARE_OP']
+JUMP_ABSOLUTE = opmap['JUMP_ABSOLUTE']
+JUMP_FORWARD = opmap['JUMP_FORWARD']
+POP_JUMP_IF_FALSE = opmap['POP_JUMP_IF_FALSE']
+POP_JUMP_IF_TRUE = opmap['POP_JUMP_IF_TRUE']
+BUILD_TUPLE = opmap['BUILD_TUPLE']
+BUILD_LIST = opmap['BUILD_LIST']
+UNPACK_SEQUENCE = opmap['UNPACK_SEQUENCE']
+BUILD_TUPLE_UNPACK_WITH_CALL = opmap['BUILD_TUPLE_UNPACK_WITH_CALL']
+BUILD_MAP_UNPACK_WITH_CALL = opmap['BUILD_MAP_UNPACK_WITH_CALL']
+CALL_FUNCTION_EX = opmap['CALL_FUNCTION_EX']
+# Instructions that make a new dict of keyword arguments.
+BUILD_MAPS = set([opmap['BUILD_MAP'], opmap['BUILD_CONST_KEY_MAP']])
+
+# Instructions whose operand is the index of an instruction to jump to,
+# which includes those setting up blocks, whose operand is a handler.
+JUMPS = set(dis.hasjrel) | set(dis.hasjabs)
+# Jumps that always jump.
+UNCONDITIONAL_JUMPS = set([JUMP_ABSOLUTE, JUMP_FORWARD])
+# Jumps whose target can be threaded: the plain jumps, conditional or not.
+THREADED_JUMPS = set(
+    opmap[name] for name in [
+        'JUMP_ABSOLUTE', 'JUMP_FORWARD', 'POP_JUMP_IF_FALSE',
+        'POP_JUMP_IF_TRUE', 'JUMP_IF_FALSE_OR_POP', 'JUMP_IF_TRUE_OR_POP',
+    ]
+)
+# Instructions that never go on to the next one.
+NO_FALL_THROUGH = set(
+    opmap[name] for name in [
+        'RETURN_VALUE', 'RAISE_VARARGS', 'JUMP_ABSOLUTE', 'JUMP_FORWARD',
+        'BREAK_LOOP', 'CONTINUE_LOOP',
+    ]
+    if name in opmap
+)
+# Instructions setting up a block whose handler catches exceptions.  A
+# code object with any of them could see its locals after a return.
+EXCEPTION_BLOCKS = set(
+    opmap[name] for name in [
+        'SETUP_EXCEPT', 'SETUP_FINALLY', 'SETUP_WITH', 'SETUP_ASYNC_WITH',
+    ]
+    if name in opmap
+)
+
+# The operators that are folded, by opcode.
+UNARY_FOLDS = {
+    opmap['UNARY_POSITIVE']: operator.pos,
+    opmap['UNARY_NEGATIVE']: operator.neg,
+    opmap['UNARY_INVERT']: operator.invert,
+    opmap['UNARY_NOT']: operator.not_,
+}
+BINARY_FOLDS = dict(
+    (opmap[name], fn) for name, fn in [
+        ('BINARY_POWER', operator.pow),
+        ('BINARY_MULTIPLY', operator.mul),
+        ('BINARY_FLOOR_DIVIDE', operator.floordiv),
+        ('BINARY_TRUE_DIVIDE', operator.truediv),
+        ('BINARY_MODULO', operator.mod),
+        ('BINARY_ADD', operator.add),
+        ('BINARY_SUBTRACT', operator.sub),
+        ('BINARY_SUBSCR', operator.getitem),
+        ('BINARY_LSHIFT', operator.lshift),
+        ('BINARY_RSHIFT', operator.rshift),
+        ('BINARY_AND', operator.and_),
+        ('BINARY_XOR', operator.xor),
+        ('BINARY_OR', operator.or_),
+        ('BINARY_DIVIDE', operator.truediv if six.PY3 else operator.div),
+    ]
+    if name in opmap
+)
+COMPARE_FOLDS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda a, b: a in b,
+    'not in': lambda a, b: a not in b,
+}
+
+# The largest constants folding may make, so that folding doesn't cost
+# more time or memory than it saves: the bits in an int, and the length
+# of a string or of a tuple.
+MAX_INT_BITS = 128
+MAX_STR_LENGTH = 4096
+MAX_TUPLE_LENGTH = 256
+
+# Constants of these types can be folded, and so can tuples and frozensets
+# of them.
+FOLDABLE_TYPES = (
+    (type(None), bool, float, complex, six.text_type, six.binary_type)
+    + six.integer_types
+)
+
+
+def foldable(value):
+    """Whether `value` is a constant that operators can be folded on."""
+    if isinstance(value, (tuple, frozenset)):
+        return all(foldable(item) for item in value)
+    return isinstance(value, FOLDABLE_TYPES)
+
+
+def small_enough(value):
+    """Whether `value` is small enough to be the result of a fold."""
+    if isinstance(value, bool):
+        return True
+    elif isinstance(value, six.integer_types):
+        return value.bit_length() <= MAX_INT_BITS
+    elif isinstance(value, (six.text_type, six.binary_type)):
+        return len(value) <= MAX_STR_LENGTH
+    elif isinstance(value, (tuple, frozenset)):
+        return len(value) <= MAX_TUPLE_LENGTH
+    return True
+
+
+def cheap(op, left, right):
+    """Whether applying the binary operator `op` can't take long.
+
+    Only operators that can make results much larger than their operands
+    are checked, before they're tried.
+
+    """
+    ints = six.integer_types
+    name = dis.opname[op]
+    if name == 'BINARY_POWER':
+        if isinstance(left, ints) and isinstance(right, ints) and right >= 0:
+            return left.bit_length() * right <= MAX_INT_BITS
+        return not isinstance(left, ints) or not isinstance(right, ints)
+    elif name == 'BINARY_LSHIFT':
+        return (
+            isinstance(right, ints) and 0 <= right <= MAX_INT_BITS
+            and isinstance(left, ints)
+            and left.bit_length() + right <= MAX_INT_BITS
+        )
+    elif name == 'BINARY_MULTIPLY':
+        for seq, count in [(left, right), (right, left)]:
+            if isinstance(seq, (six.text_type, six.binary_type, tuple)) \
+                    and isinstance(count, ints):
+                return len(seq) * count <= MAX_STR_LENGTH
+        return True
+    elif name == 'BINARY_MODULO':
+        # String formatting can pad its result out to any length.
+        return not isinstance(left, (six.text_type, six.binary_type))
+    return True
+
+
+def fold(fn, *operands):
+    """Apply `fn` to constant `operands`, returning a 1-tuple of the result.
+
+    Returns None if the result mustn't be folded: if `fn` fails, or the
+    result is too large.
+
+    """
+    if not all(foldable(value) for value in operands):
+        return None
+    try:
+        result = fn(*operands)
+    except Exception:
+        return None
+    if not foldable(result) or not small_enough(result):
+        return None
+    return (result,)
+
+
+def stack_effect(op, arguments):
+    """Work out how `op`, taking `arguments`, changes the stack.
+
+    Returns its net effect on the depth of the stack, and how far down the
+    stack it reaches; or None if that isn't known.
+
+    """
+    name = opname[op]
+    if name == 'LOAD_METHOD':
+        return 1, 1
+    elif name == 'CALL_METHOD':
+        return -arguments[0] - 1, arguments[0] + 2
+    elif op >= len(dis.opname):
+        return None
+    if op < dis.HAVE_ARGUMENT:
+        effect = dis.stack_effect(op)
+    elif op in JUMPS or op in dis.hasconst or op in dis.hasname \
+            or op in dis.haslocal or op in dis.hasfree:
+        # Their operands are resolved, but their effect doesn't depend on
+        # them.
+        effect = dis.stack_effect(op, 0)
+    else:
+        effect = dis.stack_effect(op, arguments[0])
+    if op in PURE_PUSHES:
+        return effect, 0
+    return effect, max(STACK_REACH.get(name, 0), 1 - min(effect, 0))
+
+
+# What the optimizer did to a program: how many instructions each kind of
+# rewrite dropped, how many jumps were threaded, and how many containers
+# are no longer built.
+Optimizations = collections.namedtuple(
+    'Optimizations',
+    ['folded', 'threaded', 'unreachable', 'redundant', 'containers'],
+)
+
+
+class Rewriter(object):
+    """The instructions of a program being rewritten, as lists.
+
+    `targets` holds the indexes of the instructions jumps land on, which
+    rewrites that drop instructions must keep clear of.
+
+    """
+
+    def __init__(self, program):
+        self.opcodes = list(program.opcodes)
+        self.arguments = [program.arguments[i] for i in program.operands]
+        self.lines = list(program.lines)
+        self.counts = dict((name, 0) for name in Optimizations._fields)
+        self.has_exception_blocks = bool(EXCEPTION_BLOCKS & set(self.opcodes))
+        # The operands of jumps made by the rewrites, by target.
+        self.jumps = {}
+
+    def find_targets(self):
+        self.targets = set(
+            self.arguments[i][0]
+            for i, op in enumerate(self.opcodes) if op in JUMPS
+        )
+
+    def clear(self, start, stop):
+        """Whether no jump lands on instructions `start` to `stop`."""
+        return not any(i in self.targets for i in range(start, stop))
+
+    def matches(self, i, *ops):
+        """Whether the instructions from the i'th on are `ops`, and no jump
+        lands among them but on the first."""
+        end = i + len(ops)
+        return (
+            end <= len(self.opcodes)
+            and tuple(self.opcodes[i:end]) == ops
+            and self.clear(i + 1, end)
+        )
+
+    def optimize(self):
+        """Rewrite the instructions until there's nothing more to do."""
+        while True:
+            self.find_targets()
+            drop = set()
+            self.fold_constants(drop)
+            self.thread_jumps(drop)
+            self.collapse_pairs(drop)
+            self.elide_containers(drop)
+            if not drop:
+                drop = self.unreachable()
+                self.counts['unreachable'] += len(drop)
+            if not drop:
+                return
+            self.remove(drop)
+
+    def fold_constants(self, drop):
+        opcodes, arguments = self.opcodes, self.arguments
+        i = 0
+        while i < len(opcodes):
+            op = opcodes[i]
+            if op != LOAD_CONST or i in drop:
+                i += 1
+                continue
+            value = arguments[i][0]
+            folded = None
+            if i + 1 < len(opcodes) and opcodes[i + 1] in UNARY_FOLDS \
+                    and self.clear(i + 1, i + 2):
+                folded = fold(UNARY_FOLDS[opcodes[i + 1]], value), 2
+            elif i + 2 < len(opcodes) and opcodes[i + 1] == LOAD_CONST \
+                    and self.clear(i + 1, i + 3):
+                right = arguments[i + 1][0]
+                second = opcodes[i + 2]
+                if second in BINARY_FOLDS and cheap(second, value, right):
+                    folded = fold(BINARY_FOLDS[second], value, right), 3
+                elif second == COMPARE_OP:
+                    fn = COMPARE_FOLDS.get(dis.cmp_op[arguments[i + 2][0]])
+                    if fn is not None:
+                        folded = fold(fn, value, right), 3
+            elif self.matches(i, LOAD_CONST, POP_JUMP_IF_FALSE) \
+                    or self.matches(i, LOAD_CONST, POP_JUMP_IF_TRUE):
+                jumps = bool(value) == (opcodes[i + 1] == POP_JUMP_IF_TRUE)
+                if jumps:
+                    opcodes[i] = JUMP_ABSOLUTE
+                    arguments[i] = arguments[i + 1]
+                    drop.add(i + 1)
+                    self.counts['folded'] += 1
+                else:
+                    drop.update([i, i + 1])
+                    self.counts['folded'] += 2
+                i += 2
+                continue
+            if folded is not None and folded[0] is not None:
+                result, length = folded
+                arguments[i] = shared_arguments(('const', None), result)
+                drop.update(range(i + 1, i + length))
+                self.counts['folded'] += length - 1
+                # The new constant may fold with what follows, next round.
+                i += length
+            else:
+                i += 1
+
+    def thread_jumps(self, drop):
+        opcodes, arguments = self.opcodes, self.arguments
+        for i, op in enumerate(opcodes):
+            if op not in THREADED_JUMPS or i in drop:
+                continue
+            target = arguments[i][0]
+            seen = set([i])
+            while (
+                target < len(opcodes) and opcodes[target] in UNCONDITIONAL_JUMPS
+                and target not in seen
+            ):
+                seen.add(target)
+                target = arguments[target][0]
+            if target != arguments[i][0]:
+                arguments[i] = self.jump_to(target)
+                self.counts['threaded'] += 1
+            if op in UNCONDITIONAL_JUMPS and self.next_kept(i, drop) == target:
+                drop.add(i)
+                self.counts['redundant'] += 1
+
+    def jump_to(self, target):
+        """Get the operands of a jump to `target`."""
+        return self.jumps.setdefault(target, (target,))
+
+    def next_kept(self, i, drop):
+        i += 1
+        while i in drop:
+            i += 1
+        return i
+
+    def collapse_pairs(self, drop):
+        opcodes, arguments = self.opcodes, self.arguments
+        for i in range(len(opcodes)):
+            if drop.intersection(range(i, i + 3)):
+                continue
+            if self.matches(i, LOAD_CONST, POP_TOP) \
+                    or self.matches(i, DUP_TOP, POP_TOP):
+                drop.update([i, i + 1])
+                self.counts['redundant'] += 2
+            elif (
+                not self.has_exception_blocks
+                and self.matches(i, STORE_FAST, LOAD_FAST, RETURN_VALUE)
+                and arguments[i] == arguments[i + 1]
+            ):
+                # Nothing can see the local once the frame has returned.
+                drop.update([i, i + 1])
+                self.counts['redundant'] += 2
+
+    def elide_containers(self, drop):
+        opcodes, arguments = self.opcodes, self.arguments
+        for i, op in enumerate(opcodes):
+            if i in drop:
+                continue
+            if op in (BUILD_TUPLE, BUILD_LIST) \
+                    and self.matches(i, op, UNPACK_SEQUENCE) \
+                    and arguments[i] == arguments[i + 1]:
+                if arguments[i][0] < 2:
+                    drop.update([i, i + 1])
+                    self.counts['redundant'] += 2
+                else:
+                    drop.add(i)
+                    opcodes[i + 1] = opmap['REVERSE_N']
+                    self.counts['redundant'] += 1
+                self.counts['containers'] += 1
+            elif op == BUILD_TUPLE:
+                self.pass_arguments(i)
+            elif op in BUILD_MAPS:
+                # The new dict can take in the mappings merged with it.
+                j, depth = self.consumer(i)
+                if j is not None and opcodes[j] == BUILD_MAP_UNPACK_WITH_CALL \
+                        and arguments[j][0] == depth:
+                    opcodes[j] = opmap['MERGE_KWARGS']
+                    arguments[j] = shared_arguments(
+                        ('int', depth - 1), (depth - 1,),
+                    )
+                    self.counts['containers'] += 1
+
+    def pass_arguments(self, i):
+        """Build the tuple the i'th instruction builds as a list, if it's
+        the positional arguments of a CALL_FUNCTION_EX, on their own or
+        joined by BUILD_TUPLE_UNPACK_WITH_CALL with more."""
+        opcodes, arguments = self.opcodes, self.arguments
+        j, depth = self.consumer(i)
+        if j is None:
+            return
+        joined = None
+        if opcodes[j] == BUILD_TUPLE_UNPACK_WITH_CALL \
+                and arguments[j][0] == depth:
+            joined = j
+            j, depth = self.consumer(j)
+            if j is None:
+                return
+        if opcodes[j] != CALL_FUNCTION_EX \
+                or depth != 1 + (arguments[j][0] & 1):
+            return
+        opcodes[i] = opmap['BUILD_ARGS']
+        opcodes[j] = opmap['CALL_FUNCTION_ARGS']
+        self.counts['containers'] += 1
+        if joined is not None:
+            count = arguments[joined][0] - 1
+            opcodes[joined] = opmap['EXTEND_ARGS']
+            arguments[joined] = shared_arguments(('int', count), (count,))
+            self.counts['containers'] += 1
+
+    def consumer(self, i):
+        """Find the instruction that takes the value the i'th pushes.
+
+        Only straight-line code is searched.  Returns the index of the
+        instruction, and how deep in the stack the value is when it runs,
+        counting the top as 1; or (None, None) if it isn't found.
+
+        """
+        opcodes, arguments = self.opcodes, self.arguments
+        depth = 1
+        for j in range(i + 1, len(opcodes)):
+            op = opcodes[j]
+            if j in self.targets or op in JUMPS:
+                break
+            effect = stack_effect(op, arguments[j])
+            if effect is None:
+                break
+            if effect[1] >= depth:
+                return j, depth
+            if op in NO_FALL_THROUGH:
+                break
+            depth += effect[0]
+        return None, None
+
+    def unreachable(self):
+        """Find the instructions no path from the first reaches."""
+        opcodes, arguments = self.opcodes, self.arguments
+        reached = set()
+        pending = [0] if opcodes else []
+        while pending:
+            i = pending.pop()
+            while i < len(opcodes) and i not in reached:
+                reached.add(i)
+                op = opcodes[i]
+                if op in JUMPS:
+                    pending.append(arguments[i][0])
+                if op in NO_FALL_THROUGH:
+                    break
+                i += 1
+        return set(range(len(opcodes))) - reached
+
+    def remove(self, drop):
+        """Drop the instructions in `drop`, renumbering jumps to match.
+
+        A jump to a dropped instruction lands on the next one kept instead.
+
+        """
+        new_index = []
+        count = 0
+        for i in range(len(self.opcodes)):
+            new_index.append(count)
+            if i not in drop:
+                count += 1
+        new_index.append(count)
+        keep = [i for i in range(len(self.opcodes)) if i not in drop]
+        self.jumps = {}
+        self.arguments = [
+            self.jump_to(new_index[self.arguments[i][0]])
+            if self.opcodes[i] in JUMPS else self.arguments[i]
+            for i in keep
+        ]
+        self.opcodes = [self.opcodes[i] for i in keep]
+        self.lines = [self.lines[i] for i in keep]
+
+
+def optimize(program):
+    """Make an optimized copy of `program`, which must not be fused.
+
+    The copy's `optimizations` say what the optimizer did.
+
+    """
+    rewriter = Rewriter(program)
+    rewriter.optimize()
+    arguments = list(program.arguments)
+    # Operands are told apart by identity, as in a Program.
+    operand_index = dict((id(args), i) for i, args in enumerate(arguments))
+    operands = []
+    for args in rewriter.arguments:
+        index = operand_index.get(id(args))
+        if index is None:
+            index = operand_index[id(args)] = len(arguments)
+            arguments.append(args)
+        operands.append(index)
+    optimized = copy.copy(program)
+    optimized.opcodes = compact_array(rewriter.opcodes)
+    optimized.operands = compact_array(operands)
+    optimized.arguments = tuple(arguments)
+    optimized.lines = compact_array(rewriter.lines)
+    optimized.caches = None
+    optimized.optimizations = Optimizations(**rewriter.counts)
+    return optimized
+
+
+# A line of the optimizer's report on a code object: its name, file and
+# first line, its length in instructions before and after optimizing, and
+# the Optimizations made.
+Report = collections.namedtuple(
+    'Report', ['name', 'filename', 'line', 'before', 'after', 'optimizations'],
+)
+
+
+def report(code):
+    """Report what the optimizer did to `code` and the code nested in it.
+
+    Only code that has been optimized, as it is when it runs in a VM using
+    the optimizer, is reported.
+
+    """
+    reports = []
+    for nested in walk_code(code):
+        program = find_program(nested, peephole=True)
+        if program is None:
+            continue
+        reports.append(Report(
+            nested.co_name, nested.co_filename, nested.co_firstlineno,
+            len(get_program(nested)), len(program), program.optimizations,
+        ))
+    return reports
+
+
+def format_report(reports):
+    """Format `reports` as lines of text, one per code object."""
+    lines = []
+    for r in reports:
+        o = r.optimizations
+        lines.append(
+            "%s:%d %s: %d removed of %d (folded %d, unreachable %d, "
+            "redundant %d), %d jumps threaded, %d containers elided" % (
+                r.filename, r.line, r.name, r.before - r.after, r.before,
+                o.folded, o.unreachable, o.redundant, o.threaded,
+                o.containers,
+            )
+        )
+    return lines
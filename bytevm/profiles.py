@@ -0,0 +1,169 @@
+"""Specialization profiles for Bytevm.
+
+A VM learns about the code it runs as it goes: which call sites are hot
+enough to inline, and which functions they call.  A Profile keeps
+what was learnt in a file, so that a later run of the same code can start
+with its programs specialized, instead of learning it all again.
+
+Profiles are kept per code object, keyed by a hash of the code, so an
+entry is only ever applied to the code it was recorded from: if the
+source changes, its code hashes differently and the stale entry is
+ignored.  What's applied is only ever a hint, checked as the code runs:
+a call site is only inlined if it calls the function the profile names,
+and the inlined call is still guarded, as usual.
+
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import platform
+import sys
+import weakref
+
+from .caches import CallSite, inline_cache
+from .program import find_program, get_program, opmap, walk_code
+
+# The version of the file format, and the host Python profiles are
+# recorded for, which a file must match to be loaded.
+VERSION = 1
+HOST = '%s %d.%d' % (
+    (platform.python_implementation(),) + tuple(sys.version_info[:2])
+)
+
+CALL_INLINED = opmap['CALL_INLINED']
+
+# The hashes of code objects, which are costly to work out.
+_hashes = weakref.WeakKeyDictionary()
+
+
+def code_hash(code):
+    """Get a hash of `code` that is the same in every run of the same source.
+
+    Version 2 of marshal is used since later versions write shared
+    references, which depend on reference counts that vary between runs.
+
+    """
+    digest = _hashes.get(code)
+    if digest is None:
+        digest = hashlib.sha1(marshal.dumps(code, 2)).hexdigest()
+        _hashes[code] = digest
+    return digest
+
+
+class Profile(object):
+    """The specialization profiles of code objects, kept in the file `path`.
+
+    `entries` maps the hashes of code objects to what was learnt about
+    each: under 'inlined', the indexes of its inlined calls, mapped to the
+    hash of the code of the callee.  Indexes are strings, as JSON makes
+    them.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    @classmethod
+    def load(cls, path):
+        """Load the profile kept in `path`.
+
+        A missing file, or one that is unreadable or was written for
+        another format or host, gives an empty profile.
+
+        """
+        profile = cls(path)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return profile
+        if (
+            isinstance(data, dict)
+            and data.get('version') == VERSION
+            and data.get('host') == HOST
+            and isinstance(data.get('codes'), dict)
+        ):
+            profile.entries = data['codes']
+        return profile
+
+    def save(self):
+        """Write the profile to its file, replacing it in one step."""
+        data = {'version': VERSION, 'host': HOST, 'codes': self.entries}
+        temp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(data, f, sort_keys=True)
+        getattr(os, 'replace', os.rename)(temp, self.path)
+
+    def apply(self, code, superinstructions=False, peephole=False,
+              quicken=False):
+        """Specialize the programs of `code` and the code nested in it.
+
+        The programs are those of a VM using `superinstructions`, `peephole`
+        and `quicken` as given, which a VM recording the profile must match.
+        Only code with an entry in the profile is touched, and entries
+        that don't fit the code are skipped.  Returns the number of code
+        objects specialized.
+
+        """
+        applied = 0
+        for nested in walk_code(code):
+            entry = self.entries.get(code_hash(nested))
+            if not isinstance(entry, dict):
+                continue
+            try:
+                self.apply_entry(
+                    entry,
+                    get_program(nested, superinstructions, peephole, quicken),
+                )
+            except (TypeError, ValueError, AttributeError):
+                continue
+            applied += 1
+        return applied
+
+    def apply_entry(self, entry, program):
+        count = len(program.opcodes)
+        for index, callee in entry.get('inlined', {}).items():
+            index = int(index)
+            if 0 <= index < count:
+                site = inline_cache(program, index, CallSite)
+                if site.inlining is None:
+                    site.profiled = str(callee)
+
+    def record(self, code, superinstructions=False, peephole=False,
+               quicken=False):
+        """Record what was learnt about `code` and the code nested in it.
+
+        Only code that has run, or been specialized, is recorded, and its
+        entry replaces any it had.
+
+        """
+        for nested in walk_code(code):
+            program = find_program(
+                nested, superinstructions, peephole, quicken,
+            )
+            if program is None:
+                continue
+            key = code_hash(nested)
+            entry = self.record_entry(program)
+            if entry:
+                self.entries[key] = entry
+            else:
+                self.entries.pop(key, None)
+
+    def record_entry(self, program):
+        entry = {}
+        inlined = {}
+        for index, site in (program.caches or {}).items():
+            if type(site) is CallSite and site.profiled is not None:
+                # A hint that hasn't been taken up yet.
+                inlined[str(index)] = site.profiled
+        for index, op in enumerate(program.opcodes):
+            if op == CALL_INLINED:
+                callee = program.arguments[program.operands[index]][0]
+                inlined[str(index)] = code_hash(callee.code)
+        if inlined:
+            entry['inlined'] = inlined
+        return entry
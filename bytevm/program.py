@@ -0,0 +1,620 @@
+"""Decoded programs for Bytevm.
+
+Decoding a code object's bytecode is expensive compared to executing a
+single instruction, so it is done once per code object and the result is
+shared by every frame running that code.
+
+"""
+
+import array
+import copy
+import dis
+import sys
+import types
+import weakref
+
+import six
+
+if six.PY3:
+    byteint = lambda b: b
+else:
+    byteint = ord
+
+# Since 3.6 every instruction is two bytes long ("wordcode").
+WORDCODE = sys.version_info >= (3, 6)
+
+# Pairs of instructions that can be fused into one superinstruction.  Both
+# instructions of a pair take an argument, and the first never jumps.
+# The operands of a superinstruction are those of the first instruction,
+# then those of the second.
+SUPERINSTRUCTIONS = [
+    (first, second) for first, second in [
+        ('LOAD_FAST', 'LOAD_FAST'),
+        ('LOAD_FAST', 'LOAD_CONST'),
+        ('STORE_FAST', 'LOAD_FAST'),
+        ('COMPARE_OP', 'POP_JUMP_IF_FALSE'),
+        ('LOAD_GLOBAL', 'CALL_FUNCTION'),
+    ]
+    if first in dis.opmap and second in dis.opmap
+]
+
+# Superinstructions are numbered after the host's opcodes, and named after
+# the pair they fuse, as in LOAD_FAST__LOAD_CONST.
+opname = list(dis.opname) + [
+    '%s__%s' % pair for pair in SUPERINSTRUCTIONS
+]
+FUSED = dict(
+    ((dis.opmap[first], dis.opmap[second]), len(dis.opname) + i)
+    for i, (first, second) in enumerate(SUPERINSTRUCTIONS)
+)
+
+# Instructions the VM handles that the host's compiler may not emit.  The
+# ones the host lacks are numbered after the superinstructions, and
+# decoding puts them in place of the instructions they stand for.
+# LOAD_METHOD and CALL_METHOD call a method without making a bound method
+# (new in 3.7); finding the method calls needs dis.stack_effect (new in
+# 3.4).
+EXTRA_OPCODES = [
+    name for name in ['LOAD_METHOD', 'CALL_METHOD']
+    if name not in dis.opmap and hasattr(dis, 'stack_effect')
+]
+# CALL_INLINED is the VM's own, put in place of calls to small functions
+# by the inliner.
+EXTRA_OPCODES.append('CALL_INLINED')
+# So are the instructions the peephole optimizer puts in place of ones that
+# build a container only for the next ones to take apart: REVERSE_N for
+# BUILD_TUPLE and UNPACK_SEQUENCE; and for the containers of arguments
+# passed to CALL_FUNCTION_EX, BUILD_ARGS, EXTEND_ARGS, CALL_FUNCTION_ARGS
+# and MERGE_KWARGS.
+EXTRA_OPCODES.extend([
+    'REVERSE_N', 'BUILD_ARGS', 'EXTEND_ARGS', 'CALL_FUNCTION_ARGS',
+    'MERGE_KWARGS',
+])
+opname.extend(EXTRA_OPCODES)
+
+# Runs of instructions that load operands and apply an operator to them,
+# which quickened programs, fused ones among them, turn into one
+# instruction each, numbered last.  A run loads two fast locals, a fast
+# local and a constant, or a constant to go with the value on top of the
+# stack; then applies a binary or in-place operator, maybe storing the
+# result with STORE_FAST, or makes a comparison and jumps on it with
+# POP_JUMP_IF_FALSE.  Runs are named after what they do and the operands
+# they load, as in OPERATOR_FAST_CONST_STORE.  The operands of a quickened
+# run are those of its instructions in turn, with the opcode of the
+# operator standing in for the operands it lacks.
+RUN_SOURCES = [
+    ('FAST_FAST', ['LOAD_FAST', 'LOAD_FAST']),
+    ('FAST_CONST', ['LOAD_FAST', 'LOAD_CONST']),
+    ('CONST', ['LOAD_CONST']),
+]
+RUN_KINDS = ['OPERATOR_%s', 'OPERATOR_%s_STORE', 'COMPARE_%s_JUMP_IF_FALSE']
+QUICKENED = [
+    kind % sources for kind in RUN_KINDS for sources, _ in RUN_SOURCES
+]
+# The instruction each quickened run starts with.
+RUN_STARTS = dict(
+    (kind % sources, loads[0])
+    for kind in RUN_KINDS for sources, loads in RUN_SOURCES
+)
+opname.extend(QUICKENED)
+
+# Loops over an iterator whose every value is stored straight into a fast
+# local, which quickened programs specialize, numbered after the quickened
+# runs.  GET_RANGE_ITER stands for the GET_ITER starting the loop: given a
+# range, it pushes a counter holding the range's start, end and step as
+# plain integers, in place of an iterator.  FOR_ITER_STORE stands for the
+# FOR_ITER and the STORE_FAST after it, and steps either a counter or an
+# iterator; JUMP_FOR_ITER_STORE stands for a JUMP_ABSOLUTE back to the
+# FOR_ITER, and does the same, rather than jumping there to do it.  The
+# operands of both are those of the FOR_ITER and the STORE_FAST, then the
+# index of the loop body.
+LOOPS = ['GET_RANGE_ITER', 'FOR_ITER_STORE', 'JUMP_FOR_ITER_STORE']
+opname.extend(LOOPS)
+
+# Adds whose result is stored straight into a fast local or a name, which
+# quickened programs specialize where no quickened run takes them, numbered
+# last; runs adding a string constant are left to them.  ADD_STORE_FAST
+# and ADD_STORE_NAME stand for a BINARY_ADD or an INPLACE_ADD and the
+# store after it, and take the opcode of the add, then the operands of the
+# store.  Concatenating strings, they drop the variable's reference to the
+# string being added to, so the host can append to it in place rather
+# than copy it.
+ADD_STORES = ['ADD_STORE_FAST', 'ADD_STORE_NAME']
+opname.extend(ADD_STORES)
+opmap = dict((name, op) for op, name in enumerate(opname) if op >= len(dis.opname))
+opmap.update(dis.opmap)
+
+# The operators quickened runs can apply.
+OPERATORS = set(
+    op for name, op in dis.opmap.items()
+    if name.startswith(('BINARY_', 'INPLACE_'))
+)
+# The ones that concatenate strings.
+ADDS = frozenset([dis.opmap['BINARY_ADD'], dis.opmap['INPLACE_ADD']])
+# The adds and stores that quickened programs specialize together.
+STORED_ADDS = dict(
+    ((add, dis.opmap[store]), opmap['ADD_' + store])
+    for add in ADDS for store in ['STORE_FAST', 'STORE_NAME']
+)
+
+def quickened_run(opcodes, arguments, operands, i):
+    """Match a run of instructions to quicken, starting at the i'th.
+
+    Returns the opcode of the quickened run, its operands, and its length;
+    or None if there's no run to quicken there.
+
+    """
+    for sources, loads in RUN_SOURCES:
+        start = i + len(loads)
+        if [opname[op] for op in opcodes[i:start]] == loads:
+            break
+    else:
+        return None
+    operator = opcodes[start] if start < len(opcodes) else None
+    tail = opcodes[start + 1] if start + 1 < len(opcodes) else None
+    if operator in OPERATORS:
+        if (operator, tail) in STORED_ADDS and loads[-1] == 'LOAD_CONST' \
+                and type(arguments[operands[start - 1]][0]) is str:
+            # Left to ADD_STORE_FAST or ADD_STORE_NAME, as it concatenates.
+            return None
+        if tail == dis.opmap['STORE_FAST']:
+            name, length = 'OPERATOR_%s_STORE' % sources, len(loads) + 2
+        else:
+            name, length = 'OPERATOR_%s' % sources, len(loads) + 1
+    elif operator == dis.opmap['COMPARE_OP'] and \
+            tail == dis.opmap['POP_JUMP_IF_FALSE']:
+        name, length = 'COMPARE_%s_JUMP_IF_FALSE' % sources, len(loads) + 2
+    else:
+        return None
+    run = []
+    for j in range(i, i + length):
+        run.extend(arguments[operands[j]] or (opcodes[j],))
+    return opmap[name], tuple(run), length
+
+
+def counting_loops(opcodes, arguments, operands):
+    """Specialize the loops that store each value straight into a fast local.
+
+    Changes `opcodes`, `operands` and `arguments` in place, and returns the
+    indices of the FOR_ITERs specialized.
+
+    """
+    GET_ITER, FOR_ITER, STORE_FAST, JUMP_ABSOLUTE = [
+        dis.opmap[name]
+        for name in ['GET_ITER', 'FOR_ITER', 'STORE_FAST', 'JUMP_ABSOLUTE']
+    ]
+    heads = {}
+    for i, op in enumerate(opcodes[:-1]):
+        if op == FOR_ITER and opcodes[i + 1] == STORE_FAST:
+            heads[i] = len(arguments)
+            arguments.append(
+                arguments[operands[i]] + arguments[operands[i + 1]] + (i + 2,)
+            )
+            opcodes[i] = opmap['FOR_ITER_STORE']
+            operands[i] = heads[i]
+            if i and opcodes[i - 1] == GET_ITER:
+                opcodes[i - 1] = opmap['GET_RANGE_ITER']
+    for i, op in enumerate(opcodes):
+        if op == JUMP_ABSOLUTE:
+            head = arguments[operands[i]][0]
+            if head in heads:
+                opcodes[i] = opmap['JUMP_FOR_ITER_STORE']
+                operands[i] = heads[head]
+    return heads
+
+
+def operand_count(op):
+    """How many operands the instruction `op` is decoded with."""
+    if op < dis.HAVE_ARGUMENT:
+        return 0
+    return 1
+
+
+# How far down the stack instructions that move values around reach, for
+# find_method_calls.
+STACK_REACH = {
+    'DUP_TOP': 1, 'DUP_TOP_TWO': 2,
+    'ROT_TWO': 2, 'ROT_THREE': 3, 'ROT_FOUR': 4,
+}
+# Instructions that only push a value.
+PURE_PUSHES = set(
+    dis.opmap[name] for name in [
+        'LOAD_CONST', 'LOAD_NAME', 'LOAD_GLOBAL', 'LOAD_FAST', 'LOAD_DEREF',
+        'LOAD_CLOSURE', 'LOAD_CLASSDEREF',
+    ]
+    if name in dis.opmap
+)
+
+
+def decode(code):
+    """Yield (offset, next_offset, opcode, oparg) for each instruction in `code`.
+
+    EXTENDED_ARG prefixes are folded into the instruction they extend, and
+    the offset reported is that of the first prefix, since that is where
+    jumps to the instruction land.
+
+    """
+    co_code = code.co_code
+    end = len(co_code)
+    i = 0
+    start = None
+    ext = 0
+    while i < end:
+        if start is None:
+            start = i
+        op = byteint(co_code[i])
+        if WORDCODE:
+            if op >= dis.HAVE_ARGUMENT:
+                oparg = byteint(co_code[i+1]) | ext
+            else:
+                oparg = None
+            i += 2
+        elif op >= dis.HAVE_ARGUMENT:
+            oparg = byteint(co_code[i+1]) + (byteint(co_code[i+2]) << 8) + ext
+            i += 3
+        else:
+            oparg = None
+            i += 1
+        if op == dis.EXTENDED_ARG:
+            ext = oparg << (8 if WORDCODE else 16)
+            continue
+        yield start, i, op, oparg
+        start = None
+        ext = 0
+
+
+def find_method_calls(raw):
+    """Find the method calls among decoded instructions, for LOAD_METHOD.
+
+    `raw` is a list of (offset, next_offset, opcode, oparg), as yielded by
+    decode().  A LOAD_ATTR is a method call if the attribute it loads is
+    called by a CALL_FUNCTION with only positional arguments, and nothing
+    in between reaches down the stack as far as the attribute.  Calls whose
+    arguments contain jumps are left alone.
+
+    Returns a dict mapping the index of each instruction to rewrite to its
+    new opcode.
+
+    """
+    rewrites = {}
+    if 'LOAD_METHOD' not in EXTRA_OPCODES:
+        return rewrites
+    load_attr = dis.opmap['LOAD_ATTR']
+    call_function = dis.opmap['CALL_FUNCTION']
+    targets = set()
+    for offset, next_offset, op, oparg in raw:
+        if op in dis.hasjrel:
+            targets.add(next_offset + oparg)
+        elif op in dis.hasjabs:
+            targets.add(oparg)
+
+    # The stack positions of attributes loaded by LOAD_ATTR that might yet
+    # be called, and the indices of their instructions.  Positions are only
+    # compared within straight-line code, so the depth of the stack can be
+    # counted from anywhere.
+    pending = []
+    depth = 0
+    for index, (offset, next_offset, op, oparg) in enumerate(raw):
+        if offset in targets or op in dis.hasjrel or op in dis.hasjabs:
+            del pending[:]
+        elif op == call_function:
+            # Attributes loaded as arguments aren't called here.
+            callee = depth - oparg - 1
+            while pending and pending[-1][0] > callee:
+                pending.pop()
+            if pending and pending[-1][0] == callee:
+                rewrites[pending.pop()[1]] = opmap['LOAD_METHOD']
+                rewrites[index] = opmap['CALL_METHOD']
+        if op >= dis.HAVE_ARGUMENT:
+            effect = dis.stack_effect(op, oparg)
+        else:
+            effect = dis.stack_effect(op)
+        if op in PURE_PUSHES:
+            reach = 0
+        else:
+            reach = max(STACK_REACH.get(dis.opname[op], 0), 1 - min(effect, 0))
+        depth += effect
+        while pending and pending[-1][0] >= min(depth, depth - effect - reach):
+            pending.pop()
+        if op == load_attr:
+            pending.append((depth - 1, index))
+    return rewrites
+
+
+def compact_array(values):
+    """Pack a list of non-negative ints into the smallest array holding them."""
+    largest = max(values) if values else 0
+    if largest < 1 << 8:
+        typecode = 'B'
+    elif largest < 1 << 16:
+        typecode = 'H'
+    else:
+        typecode = 'i'
+    return array.array(typecode, values)
+
+
+# Operand tuples that can be shared by all programs, keyed like the
+# `operand_index` of a Program.  Constants are only shared when equal
+# values of their type are interchangeable, and never when they might keep
+# something large alive, like a code object.
+SHAREABLE_CONSTANTS = (type(None), bool, int, str, bytes) + six.integer_types
+_shared_arguments = {}
+
+
+def shared_arguments(key, arguments):
+    """Get the shared tuple equal to `arguments`, identified by `key`."""
+    if key is not None and key[0] == 'const':
+        if type(arguments[0]) not in SHAREABLE_CONSTANTS:
+            return arguments
+        key = ('const', type(arguments[0]), arguments[0])
+    return _shared_arguments.setdefault(key, arguments)
+
+
+class Program(object):
+    """The decoded form of a code object.
+
+    Instructions are numbered consecutively from zero, and a frame's
+    `f_lasti` is an index into the arrays that encode them.  `opcodes[i]`
+    is the i'th instruction's opcode, and `operands[i]` is the index in
+    `arguments` of a tuple of its resolved operands: a constant, a name,
+    the index of a jump target, or the index of a fast local.  Instructions with the same operands
+    share one tuple, and so do programs, where they can.  `lines[i]` is
+    the source line the instruction belongs to.
+
+    A Program deliberately holds no reference to its code object, so that
+    the cache below doesn't keep code alive.
+
+    `caches` holds the inline caches of the program's instructions, once
+    any of them has one.  `optimizations` is None, unless the program was
+    made by the peephole optimizer, when it says what the optimizer did.
+
+    """
+    __slots__ = [
+        'opcodes', 'operands', 'arguments', 'lines', 'first_line', 'caches',
+        'optimizations',
+    ]
+
+    def __init__(self, code):
+        opcodes = []
+        operands = []
+        lines = []
+        arguments = []
+
+        raw = list(decode(code))
+        rewrites = find_method_calls(raw)
+        index_of = dict((offset, index) for index, (offset, _, _, _) in enumerate(raw))
+        index_of[len(code.co_code)] = len(raw)
+        line_starts = dict(dis.findlinestarts(code))
+
+        # Map (kind, oparg) to the index of the operands in `arguments`.
+        # Constants are told apart by their index in co_consts, since equal
+        # constants like 1 and 1.0 mustn't be confused.
+        operand_index = {}
+        line = code.co_firstlineno
+        for offset, next_offset, op, oparg in raw:
+            line = line_starts.get(offset, line)
+            if oparg is None:
+                key = None
+            elif op in dis.hasconst:
+                key = ('const', oparg)
+            elif op in dis.hasfree:
+                key = ('free', oparg)
+            elif op in dis.hasname:
+                key = ('name', oparg)
+            elif op in dis.hasjrel:
+                key = ('jump', index_of[next_offset + oparg])
+            elif op in dis.hasjabs:
+                key = ('jump', index_of[oparg])
+            elif op in dis.haslocal:
+                key = ('local', oparg)
+            else:
+                key = ('int', oparg)
+            op = rewrites.get(len(opcodes), op)
+            index = operand_index.get(key)
+            if index is None:
+                index = operand_index[key] = len(arguments)
+                resolved = self.resolve(code, key)
+                if key is not None and key[0] in ('free', 'name'):
+                    key = (key[0], resolved[0])
+                arguments.append(shared_arguments(key, resolved))
+            opcodes.append(op)
+            operands.append(index)
+            lines.append(line)
+        self.opcodes = compact_array(opcodes)
+        self.operands = compact_array(operands)
+        self.arguments = tuple(arguments)
+        self.lines = compact_array(lines)
+        self.first_line = code.co_firstlineno
+        self.caches = None
+        self.optimizations = None
+
+    @staticmethod
+    def resolve(code, key):
+        """Resolve the operands identified by `key` to a tuple."""
+        if key is None:
+            return ()
+        kind, oparg = key
+        if kind == 'const':
+            return (code.co_consts[oparg],)
+        elif kind == 'free':
+            cellvars = code.co_cellvars
+            if oparg < len(cellvars):
+                return (cellvars[oparg],)
+            return (code.co_freevars[oparg - len(cellvars)],)
+        elif kind == 'name':
+            return (code.co_names[oparg],)
+        return (oparg,)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def instruction(self, i):
+        """Get the name and the operands of the i'th instruction."""
+        return opname[self.opcodes[i]], self.arguments[self.operands[i]]
+
+    def quickened(self):
+        """Make a copy of this program with its common runs quickened.
+
+        Runs of instructions that can be quickened are replaced by one
+        instruction, whose operands are those of the whole run.  The rest
+        of the run is left in place, so instruction indices, jump targets
+        and the line table are unchanged: the quickened instruction steps
+        over them, and a jump can still land on them.  Adds followed by
+        stores are replaced the same way, and before any of that, loops
+        storing their values in fast locals are specialized.
+
+        """
+        return self.specialized(fuse=False)
+
+    def fused(self):
+        """Make a copy of this program using superinstructions.
+
+        The program is quickened, and where a pair of adjacent instructions
+        that are left can be fused, the first is replaced by the
+        superinstruction, whose operands are those of both.  As with runs,
+        the second is left in place.
+
+        """
+        return self.specialized(fuse=True)
+
+    def specialized(self, fuse):
+        """Make a quickened copy of this program, fusing pairs if `fuse`."""
+        opcodes = list(self.opcodes)
+        operands = list(self.operands)
+        arguments = list(self.arguments)
+        operand_index = {}
+        heads = counting_loops(opcodes, arguments, operands)
+        i = 0
+        while i < len(opcodes) - 1:
+            if i in heads:
+                # The STORE_FAST after it is only there for jumps.
+                i += 2
+                continue
+            run = quickened_run(opcodes, arguments, operands, i)
+            if run is not None:
+                op, run_arguments, length = run
+                opcodes[i] = op
+                operands[i] = len(arguments)
+                arguments.append(run_arguments)
+                i += length
+                continue
+            op = STORED_ADDS.get((opcodes[i], opcodes[i+1]))
+            if op is not None:
+                operands[i] = len(arguments)
+                arguments.append((opcodes[i],) + arguments[operands[i+1]])
+                opcodes[i] = op
+                i += 2
+                continue
+            op = FUSED.get((opcodes[i], opcodes[i+1])) if fuse else None
+            if op is None or quickened_run(opcodes, arguments, operands, i+1):
+                i += 1
+                continue
+            key = (operands[i], operands[i+1])
+            index = operand_index.get(key)
+            if index is None:
+                index = operand_index[key] = len(arguments)
+                arguments.append(arguments[key[0]] + arguments[key[1]])
+            opcodes[i] = op
+            operands[i] = index
+            i += 2
+        program = copy.copy(self)
+        program.opcodes = compact_array(opcodes)
+        program.operands = compact_array(operands)
+        program.arguments = tuple(arguments)
+        program.caches = None
+        return program
+
+    def patch(self, index, op, arguments):
+        """Replace the `index`'th instruction with `op`, taking `arguments`.
+
+        The arrays are replaced rather than changed in place, since frames
+        running the program hold on to the old ones, whose operands must
+        stay in step with the old `arguments`.
+
+        """
+        for operand, existing in enumerate(self.arguments):
+            if existing is arguments:
+                break
+        else:
+            operand = len(self.arguments)
+            self.arguments = self.arguments + (arguments,)
+        opcodes = list(self.opcodes)
+        operands = list(self.operands)
+        opcodes[index] = op
+        operands[index] = operand
+        self.opcodes = compact_array(opcodes)
+        self.operands = compact_array(operands)
+
+    def line_number(self, lasti):
+        """The source line being executed by a frame whose `f_lasti` is `lasti`."""
+        if lasti:
+            return self.lines[lasti - 1]
+        return self.first_line
+
+
+def walk_code(code):
+    """Yield `code` and the code objects nested in it, outermost first."""
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            for nested in walk_code(const):
+                yield nested
+
+
+# The cache is keyed on the identity of the code object: code objects
+# compare equal when their bytecode does, even if they come from different
+# files or have different line tables.  Each entry holds the plain program
+# and, once they're asked for, the ones that are quickened, use
+# superinstructions or have been through the peephole optimizer, keyed by
+# which they do.  Superinstructions imply quickening.
+_programs = {}
+
+
+def program_mode(superinstructions, peephole, quicken):
+    """The key of the programs of a mode in an entry of the cache."""
+    return (bool(superinstructions), bool(peephole),
+            bool(quicken or superinstructions))
+
+
+def get_program(code, superinstructions=False, peephole=False, quicken=False):
+    """Get the Program for `code`, decoding it if it isn't cached yet.
+
+    If `superinstructions` is true, the Program uses superinstructions, if
+    `quicken` is true, it has its runs quickened without them, and if
+    `peephole` is true, it has been through the peephole optimizer.
+    Entries are dropped when their code object is garbage collected.
+
+    """
+    mode = program_mode(superinstructions, peephole, quicken)
+    key = id(code)
+    entry = _programs.get(key)
+    if entry is None:
+        # The cache is passed in, as the module's globals may be gone by the
+        # time code objects die at interpreter exit.
+        ref = weakref.ref(
+            code, lambda ref, key=key, cache=_programs: cache.pop(key, None)
+        )
+        entry = _programs[key] = (ref, {})
+    programs = entry[1]
+    program = programs.get(mode)
+    if program is None:
+        if superinstructions:
+            program = get_program(code, False, peephole).fused()
+        elif quicken:
+            program = get_program(code, False, peephole).quickened()
+        elif peephole:
+            # The optimizer imports this module.
+            from .peephole import optimize
+            program = optimize(get_program(code))
+        else:
+            program = Program(code)
+        programs[mode] = program
+    return program
+
+
+def find_program(code, superinstructions=False, peephole=False, quicken=False):
+    """Get the Program for `code` if it has been decoded, or else None."""
+    entry = _programs.get(id(code))
+    if entry is None or entry[0]() is not code:
+        return None
+    return entry[1].get(program_mode(superinstructions, peephole, quicken))
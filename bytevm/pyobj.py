@@ -1,14 +1,14 @@
 """Implementations of Python fundamental objects for Bytevm."""
 
-import collections
 import inspect
-import re
 import types
-import dis
 
 import six
 import sys
 
+from .binder import GENERATOR, PLAIN, UNBOUND, get_binder
+from .program import get_program
+
 PY3, PY2 = six.PY3, not six.PY3
 
 def brk(t=True):
@@ -27,7 +27,10 @@ def make_cell(value):
         return fn.func_closure[0]
 
 class traceback(object):
+    __slots__ = ['tb_frame', 'tb_lasti', 'tb_lineno', 'tb_next']
+
     def __init__(self, frame, lasti = 0, line=0, nxt=None):
+        frame.pin()
         self.tb_frame = frame
         self.tb_lasti = lasti
         self.tb_lineno = line
@@ -35,11 +38,12 @@ class traceback(object):
 
 class Function(object):
     __slots__ = [
-        'func_code', 'func_name', 'func_defaults', 'func_globals',
-        'func_locals', 'func_dict', 'func_closure',
+        'func_code', 'func_name', 'func_defaults', 'func_kwdefaults',
+        'func_globals', 'func_locals', 'func_dict', 'func_closure',
         '__name__', '__dict__', '__doc__',
-        '__code__', '__defaults__','__globals__', '__locals__', '__closure__',
-        '_vm', '_func',
+        '__code__', '__defaults__', '__kwdefaults__', '__globals__',
+        '__locals__', '__closure__', '__qname__',
+        '_vm', '_host_func', '_binder', '_entry',
     ]
 
     def __init__(self, name, code, globs, defaults, kwdefaults, closure, vm):
@@ -47,21 +51,39 @@ class Function(object):
         self.func_code = self.__code__ = code
         self.func_name = name or code.co_name
         self.func_defaults = self.__defaults__ = defaults \
-                if sys.version_info >= (3, 6) else tuple(defaults)
+                if sys.version_info >= (3, 6) or defaults is None \
+                else tuple(defaults)
+        self.func_kwdefaults = self.__kwdefaults__ = kwdefaults
         self.func_globals = self.__globals__ = globs
-        self.func_locals = self.__locals__ = self._vm.frame.f_locals
-        self.__dict__ = {}
+        # Functions made in function bodies don't force a locals dict.
+        self.func_locals = self.__locals__ = self._vm.frame._locals
         self.func_closure = self.__closure__ = closure
         self.__doc__ = code.co_consts[0] if code.co_consts else None
-
-        # Sometimes, we need a real Python function.  This is for that.
-
-        kw = {}
-        if defaults: kw['argdefs'] = self.func_defaults
-        if closure: kw['closure'] = tuple(make_cell(0) for _ in closure)
-        self._func = types.FunctionType(code, globs, **kw)
-        self.__name__ = self._func.__name__
+        self.__name__ = code.co_name
         self.__qname__ = self.func_name
+        self._binder = get_binder(code)
+        self._host_func = None
+        self._entry = None
+
+    @property
+    def _func(self):
+        """A real Python function with our code, for host code that needs one.
+
+        It's made the first time it's asked for, since most functions are
+        only ever called by the VM.
+
+        """
+        if self._host_func is None:
+            kw = {}
+            if self.func_defaults:
+                kw['argdefs'] = self.func_defaults
+            if self.func_closure:
+                kw['closure'] = tuple(make_cell(0) for _ in self.func_closure)
+            func = types.FunctionType(self.func_code, self.func_globals, **kw)
+            if self.func_kwdefaults:
+                func.__kwdefaults__ = self.func_kwdefaults
+            self._host_func = func
+        return self._host_func
 
     def __repr__(self):         # pragma: no cover
         return '<Function %s at 0x%08x>' % (
@@ -76,45 +98,43 @@ class Function(object):
         else:
             return self
 
-    def __call__(self, *args, **kwargs):
-        if re.search(r'<(?:listcomp|setcomp|dictcomp|genexpr)>$', self.func_name):
-            # D'oh! http://bugs.python.org/issue19611 Py2 doesn't know how to
-            # inspect set comprehensions, dict comprehensions, or generator
-            # expressions properly.  They are always functions of one argument,
-            # so just do the right thing.  Py3.4 also would fail without this
-            # hack, for list comprehensions too. (Haven't checked for other 3.x.)
-            assert len(args) == 1 and not kwargs, "Surprising comprehension!"
-            callargs = {".0": args[0]}
-        else:
-            callargs = inspect.getcallargs(self._func, *args, **kwargs)
-        frame = self._vm.make_frame(
-            self.func_code, callargs, self.func_globals, {}, self.func_closure
+    def make_frame(self, args, kwargs):
+        """Make a frame to run a call with `args` and `kwargs`."""
+        fast_locals = self._binder.bind(
+            args, kwargs, self.func_defaults, self.func_kwdefaults
         )
-        # Perhaps deal with inspect.CO_COROUTINE here instead of async def
-        if self.func_code.co_flags & inspect.CO_GENERATOR:
+        return self._vm.make_frame(
+            self.func_code, f_globals=self.func_globals,
+            f_closure=self.func_closure, fast_locals=fast_locals,
+        )
+
+    def __call__(self, *args, **kwargs):
+        # Host code calls the function through its entry point, made by the
+        # VM the first time it's called.
+        entry = self._entry
+        if entry is None:
+            entry = self._entry = self._vm.make_entry(self)
+        return entry(args, kwargs)
+
+    def _call(self, args, kwargs):
+        """Call the function with `args` and `kwargs`, by the general path."""
+        binder = self._binder
+        frame = self.make_frame(args, kwargs)
+        if binder.kind is PLAIN:
+            return self._vm.run_frame(frame)
+        # https://www.python.org/dev/peps/pep-0492/
+        # Native coroutines, generator-based coroutines made by
+        # types.coroutine(), and async generators all run as coroutines.
+        if binder.kind is GENERATOR:
             gen = Generator(frame, self._vm)
-            frame.generator = gen
-            retval = gen
-        elif self.func_code.co_flags & inspect.CO_COROUTINE:
-            # https://www.python.org/dev/peps/pep-0492/
-            # CO_COROUTINE is used to mark native coroutines (defined with new syntax).
-            gen = CoRoutine(frame, self._vm)
-            frame.generator = gen
-            retval = gen
-        elif self.func_code.co_flags & inspect.CO_ITERABLE_COROUTINE:
-            # CO_ITERABLE_COROUTINE is used to make generator-based coroutines compatible with native coroutines (set by types.coroutine() function).
-            gen = CoRoutine(frame, self._vm)
-            frame.generator = gen
-            retval = gen
-        elif self.func_code.co_flags & inspect.CO_ASYNC_GENERATOR:
-            gen = CoRoutine(frame, self._vm)
-            frame.generator = gen
-            retval = gen
         else:
-            retval = self._vm.run_frame(frame)
-        return retval
+            gen = CoRoutine(frame, self._vm)
+        frame.generator = gen
+        return gen
 
 class Method(object):
+    __slots__ = ['im_self', 'im_class', 'im_func']
+
     def __init__(self, obj, _class, func):
         self.im_self = obj
         self.im_class = _class
@@ -153,6 +173,8 @@ class Cell(object):
            actual value.
 
     """
+    __slots__ = ['cell_contents']
+
     def __init__(self, value):
         self.cell_contents = value
 
@@ -163,18 +185,71 @@ class Cell(object):
         self.cell_contents = value
 
 
-Block = collections.namedtuple("Block", "type, handler, level")
+class Block(object):
+    """An entry on a frame's block stack, made by the SETUP_* instructions."""
+    __slots__ = ['type', 'handler', 'level']
+
+    def __init__(self, type, handler, level):
+        self.type = type
+        self.handler = handler
+        self.level = level
+
+    def __repr__(self):
+        return 'Block(type=%r, handler=%r, level=%r)' % (
+            self.type, self.handler, self.level
+        )
 
 
 class Frame(object):
-    def __init__(self, f_code, f_globals, f_locals, f_closure, f_back):
+    """A frame executing a code object.
+
+    Function bodies (code with CO_OPTIMIZED set) keep their local variables
+    in `fast_locals`, a list indexed like `co_varnames`, and the f_locals
+    mapping given when the frame is made only provides their initial
+    values, unless the caller has bound them into a list already.  Reading
+    `f_locals` from such a frame builds a new dict of the
+    assigned variables.  Module and class bodies keep their variables in
+    the `f_locals` mapping itself, and have no `fast_locals`.
+
+    A frame can be pinned, to say that something other than the VM's call
+    stack refers to it, so it mustn't be recycled for another call.
+
+    """
+    __slots__ = [
+        'f_code', 'f_globals', '_locals', 'f_back', 'f_builtins', 'f_lineno',
+        'f_lasti', 'program', 'fast_locals', 'cells', 'stack', 'block_stack',
+        'generator', 'pinned',
+    ]
+
+    def __init__(self, f_code, f_globals, f_locals, f_closure, f_back,
+                 program=None, fast_locals=None):
+        self.stack = []
+        self.block_stack = []
+        self.pinned = False
+        self.reset(f_code, f_globals, f_locals, f_closure, f_back, program,
+                   fast_locals)
+
+    def reset(self, f_code, f_globals, f_locals, f_closure, f_back,
+              program=None, fast_locals=None):
+        """Set the frame up to run `f_code` from the start.
+
+        The value and block stacks must already be empty.
+
+        """
         self.f_code = f_code
-        if sys.version_info >= (3, 4):
-            self.opcodes = list(dis.get_instructions(self.f_code))
+        self.program = program if program is not None else get_program(f_code)
         self.f_globals = f_globals
-        self.f_locals = f_locals
+        if f_code.co_flags & inspect.CO_OPTIMIZED:
+            if fast_locals is None:
+                fast_locals = [
+                    f_locals.get(name, UNBOUND) for name in f_code.co_varnames
+                ]
+            self.fast_locals = fast_locals
+            self._locals = None
+        else:
+            self.fast_locals = None
+            self._locals = f_locals
         self.f_back = f_back
-        self.stack = []
         if f_back:
             self.f_builtins = f_back.f_builtins
         else:
@@ -187,19 +262,47 @@ class Frame(object):
 
         self.f_lineno = f_code.co_firstlineno
         self.f_lasti = 0
-        self._line = 0
 
         self.cells = {} if f_code.co_cellvars or f_code.co_freevars else None
-        for var in f_code.co_cellvars:
-            # Make a cell for the variable in our locals, or None.
-            self.cells[var] = Cell(self.f_locals.get(var))
+        if f_code.co_cellvars:
+            f_locals = self.f_locals
+            for var in f_code.co_cellvars:
+                # Make a cell for the variable in our locals, or None.
+                self.cells[var] = Cell(f_locals.get(var))
         if f_code.co_freevars:
             assert len(f_code.co_freevars) == len(f_closure)
             self.cells.update(zip(f_code.co_freevars, f_closure))
 
-        self.block_stack = []
         self.generator = None
 
+    def clear(self):
+        """Drop everything the frame refers to, so it can be kept for reuse."""
+        del self.stack[:]
+        del self.block_stack[:]
+        self.f_globals = self._locals = self.fast_locals = None
+        self.f_back = self.f_builtins = self.cells = None
+
+    def pin(self):
+        """Keep this frame, and the frames that called it, from being reused."""
+        frame = self
+        while frame is not None and not frame.pinned:
+            frame.pinned = True
+            frame = frame.f_back
+
+    @property
+    def f_locals(self):
+        if self.fast_locals is None:
+            return self._locals
+        return dict(
+            (name, value)
+            for name, value in zip(self.f_code.co_varnames, self.fast_locals)
+            if value is not UNBOUND
+        )
+
+    @f_locals.setter
+    def f_locals(self, f_locals):
+        self._locals = f_locals
+
     def __repr__(self):         # pragma: no cover
         return '<Frame at 0x%08x: %r @ %d>' % (
             id(self), self.f_code.co_filename, self.f_lineno
@@ -207,27 +310,14 @@ class Frame(object):
 
     def line_number(self):
         """Get the current line number the frame is executing."""
-        if sys.version_info > (3, 6):
-            return self._line
-        # We don't keep f_lineno up to date, so calculate it based on the
-        # instruction address and the line number table.
-        lnotab = self.f_code.co_lnotab
-        byte_increments = six.iterbytes(lnotab[0::2])
-        line_increments = six.iterbytes(lnotab[1::2])
-
-        byte_num = 0
-        line_num = self.f_code.co_firstlineno
-
-        for byte_incr, line_incr in zip(byte_increments, line_increments):
-            byte_num += byte_incr
-            if byte_num > self.f_lasti:
-                break
-            line_num += line_incr
-
-        return line_num
+        # We don't keep f_lineno up to date, so look it up in the line
+        # table of the decoded program.
+        return self.program.line_number(self.f_lasti)
 
 
 class Generator(object):
+    __slots__ = ['gi_frame', 'vm', 'started', 'finished']
+
     def __init__(self, g_frame, vm):
         self.gi_frame = g_frame
         self.vm = vm
@@ -262,5 +352,7 @@ class Generator(object):
         self.vm.do_raise(typ, val, tb)
 
 class CoRoutine(Generator):
+    __slots__ = []
+
     def __await__(self):
         return self
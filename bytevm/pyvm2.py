@@ -10,6 +10,7 @@ import logging
 import operator
 import sys
 import types
+import weakref
 from .sys import pseudosys
 
 import os.path
@@ -25,36 +26,251 @@ from six.moves import reprlib
 PY3, PY2 = six.PY3, not six.PY3
 
 from .pyobj import Frame, Block, Method, Function, Generator, Cell, traceback
+from .pyobj import UNBOUND
+from .binder import PLAIN
+from .caches import (
+    AttrCache, CallSite, FUNCTION, HOST_FUNCTION, METHOD, classes_changed,
+    inline_cache,
+)
+from .inliner import Decision, deoptimize, inline_call
+from .profiles import code_hash
+from .program import (
+    ADD_STORES, ADDS, EXTRA_OPCODES, LOOPS, QUICKENED, RUN_STARTS,
+    SUPERINSTRUCTIONS, get_program, opmap, opname, operand_count,
+)
 
 log = logging.getLogger(__name__)
 
 import pudb
 brk = pudb.set_trace
 
-if six.PY3:
-    byteint = lambda b: b
-else:
-    byteint = ord
-
 # Create a repr that won't overflow.
 repr_obj = reprlib.Repr()
 repr_obj.maxother = 120
 repper = repr_obj.repr
 
 
+# Code with these flags makes frames that outlive a call.
+NOT_POOLED_FLAGS = (
+    getattr(inspect, 'CO_GENERATOR', 0) |
+    getattr(inspect, 'CO_COROUTINE', 0) |
+    getattr(inspect, 'CO_ITERABLE_COROUTINE', 0) |
+    getattr(inspect, 'CO_ASYNC_GENERATOR', 0)
+)
+
+# Raised when the VM's call stack is too deep.  Before 3.5 Python raised a
+# plain RuntimeError.
+RecursionError = getattr(six.moves.builtins, 'RecursionError', RuntimeError)
+
+# LOAD_METHOD pushes this below an attribute that isn't a method to call
+# with its object, as CPython pushes NULL.
+NULL = object()
+
+# The type of the ranges that counting loops step through as plain
+# integers.  Python 2's xrange doesn't tell its start and step.
+RANGE = range if PY3 else None
+
+# Besides setattr and delattr, interpreted code can change a class by
+# calling type's own __setattr__ and __delattr__ on it.
+TYPE_SETATTR = type.__setattr__
+TYPE_DELATTR = type.__delattr__
+
+CALL_METHOD = opmap['CALL_METHOD']
+STORE_FAST = dis.opmap['STORE_FAST']
+STORE_NAME = dis.opmap['STORE_NAME']
+
+
 class VirtualMachineError(Exception):
     """For raising errors in the operation of the VM."""
     pass
 
 
+def operator_handler(method, op):
+    """Make a handler for one member of an operator family, such as
+    BINARY_ADD, that calls the family's method with the operator name."""
+    def handler(self):
+        return method(self, op)
+    return handler
+
+
+def unary_handler(fn):
+    """Make a handler for a unary operator that applies `fn` itself."""
+    def handler(self):
+        stack = self.frame.stack
+        stack[-1] = fn(stack[-1])
+    return handler
+
+
+def binary_handler(fn):
+    """Make a handler for a binary or in-place operator that applies `fn`
+    itself."""
+    def handler(self):
+        stack = self.frame.stack
+        y = stack.pop()
+        stack[-1] = fn(stack[-1], y)
+    return handler
+
+
+def add_handler(fn, opcode):
+    """Make a handler for the add `opcode` that applies `fn` itself, unless
+    it's adding strings: then it concatenates them as ADD_STORE_FAST and
+    ADD_STORE_NAME do, if the next instruction stores the result."""
+    def handler(self):
+        frame = self.frame
+        stack = frame.stack
+        y = stack.pop()
+        if type(y) is not str or type(stack[-1]) is not str:
+            stack[-1] = fn(stack[-1], y)
+            return
+        x = stack.pop()
+        program = frame.program
+        index = frame.f_lasti
+        # The add may be in the body of an inlined call instead, and the
+        # next instruction not take its result.
+        op = program.opcodes[index] if program.opcodes[index - 1] == opcode \
+            else None
+        if op == STORE_FAST:
+            target = program.arguments[program.operands[index]][0]
+            if frame.fast_locals[target] is x:
+                frame.fast_locals[target] = UNBOUND
+        elif op == STORE_NAME:
+            target = program.arguments[program.operands[index]][0]
+            f_locals = frame._locals
+            if type(f_locals) is dict and f_locals.get(target) is x:
+                f_locals[target] = None
+        x += y
+        stack.append(x)
+    return handler
+
+
+def superinstruction_handler(first, second, count):
+    """Make a handler for a superinstruction that runs the handlers of the
+    two instructions it fuses, each with its own operands.  The first
+    instruction takes `count` of them."""
+    def handler(self, *arguments):
+        why = first(self, *arguments[:count])
+        if why:
+            return why
+        self.frame.f_lasti += 1
+        return second(self, *arguments[count:])
+    return handler
+
+
+def defining_class(cls, name):
+    """Find the class in `cls`'s MRO that defines the attribute `name`."""
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass
+    return None
+
+
+def first_instruction_handler(first):
+    """Make a handler for a quickened run that only runs its first
+    instruction, which loads its first operand, leaving the rest of the run
+    to run one by one."""
+    def handler(self, operand, *arguments):
+        return first(self, operand)
+    return handler
+
+
+def loop_head_handler(for_iter):
+    """Make a handler for FOR_ITER_STORE that only runs the FOR_ITER it
+    stands for, leaving the STORE_FAST after it to run on its own."""
+    def handler(self, jump, index, body):
+        return for_iter(self, jump)
+    return handler
+
+
+def loop_jump_handler(jump_absolute):
+    """Make a handler for JUMP_FOR_ITER_STORE that only jumps back to the
+    FOR_ITER of its loop, which comes right before the STORE_FAST before
+    the loop's body."""
+    def handler(self, jump, index, body):
+        return jump_absolute(self, body - 2)
+    return handler
+
+
+def add_store_handler(table):
+    """Make a handler for ADD_STORE_FAST or ADD_STORE_NAME that only runs
+    the add it stands for, with its handler in `table`, leaving the store
+    to run on its own."""
+    def handler(self, op, target):
+        return table[op](self)
+    return handler
+
+
+def unknown_opcode_handler(byteName):
+    def handler(self, *arguments):
+        raise VirtualMachineError("unknown bytecode type: %s" % byteName)
+    return handler
+
+
+# The methods the handlers of quickened runs stand in for.
+QUICKENED_PARTS = [
+    'byte_LOAD_FAST', 'byte_LOAD_CONST', 'byte_STORE_FAST', 'byte_COMPARE_OP',
+    'byte_POP_JUMP_IF_FALSE', 'byte_POP_JUMP_IF_TRUE', 'binaryOperator',
+    'inplaceOperator',
+]
+
+# The methods the handlers of specialized loops stand in for.
+LOOP_PARTS = [
+    'byte_GET_ITER', 'byte_FOR_ITER', 'byte_STORE_FAST', 'byte_JUMP_ABSOLUTE',
+]
+
+# The methods the handlers of adds followed by stores stand in for.
+ADD_STORE_PARTS = [
+    'byte_STORE_FAST', 'byte_STORE_NAME', 'binaryOperator', 'inplaceOperator',
+]
+
+
 class VirtualMachine(object):
     steps = 0
-    def __init__(self):
+    # How many retired frames to keep for reuse, for each code object.
+    max_pooled_frames = 128
+    # How deep the VM's call stack may get.
+    recursion_limit = 1000
+    # How many calls in a row to the same Function make a call site hot
+    # enough to inline.
+    inline_threshold = 16
+
+    def __init__(self, superinstructions=False, trace=False, stackless=False,
+                 recursion_limit=None, inlining=False, peephole=False,
+                 quicken=False):
+        # Whether frames run programs that fuse common pairs of
+        # instructions into superinstructions, programs the peephole
+        # optimizer has been over, and programs whose common runs of
+        # instructions are quickened, as they are with superinstructions.
+        self.superinstructions = superinstructions
+        self.peephole = peephole
+        self.quicken = quicken
+        # Whether to run the tracing loop, which counts steps and logs the
+        # execution, rather than the lean one.
+        self.trace = trace
+        # Whether calls to interpreted functions run in the loop of their
+        # caller, rather than nesting a host call to run_frame.
+        self.stackless = stackless
+        if recursion_limit is not None:
+            self.recursion_limit = recursion_limit
+        # Whether hot calls to small functions are inlined, and the
+        # Decisions the inliner has taken.
+        self.inlining = inlining
+        self.inlining_decisions = []
+        # The handlers for each opcode, bound to this VM.
+        self.handlers = [
+            types.MethodType(fn, self) for fn in self.dispatch_table()
+        ]
         # the number of steps this VM executed
         # The call stack of frames.
         self.frames = []
         # The current frame.
         self.frame = None
+        # Retired function frames, for make_frame to reuse.  They are keyed
+        # by the id of their code, which hashes faster than the code, and
+        # stays valid because the pooled frames keep their f_code.
+        self.frame_pool = {}
+        # The Functions interpreting host functions called from the VM,
+        # so repeated calls don't wrap them again.
+        self.host_functions = weakref.WeakKeyDictionary()
         self.return_value = None
         self.last_exception = None
 
@@ -85,8 +301,9 @@ class VirtualMachine(object):
 
         """
         if n:
-            ret = self.frame.stack[-n:]
-            self.frame.stack[-n:] = []
+            stack = self.frame.stack
+            ret = stack[-n:]
+            del stack[-n:]
             return ret
         else:
             return []
@@ -107,8 +324,18 @@ class VirtualMachine(object):
     def pop_block(self):
         return self.frame.block_stack.pop()
 
-    def make_frame(self, code, callargs={}, f_globals=None, f_locals=None, f_closure=None):
-        log.info("make_frame: code=%r, callargs=%s" % (code, repper(callargs)))
+    def make_frame(self, code, callargs={}, f_globals=None, f_locals=None,
+                   f_closure=None, fast_locals=None):
+        """Make a frame to run `code`.
+
+        The frame's locals come from `callargs`, or, for a function frame
+        whose arguments have been bound already, the `fast_locals` list.
+
+        """
+        if self.trace:
+            log.info("make_frame: code=%r, callargs=%s" % (
+                code, repper(callargs if fast_locals is None else fast_locals)
+            ))
         if f_globals is not None:
             f_globals = f_globals
             if f_locals is None:
@@ -123,20 +350,55 @@ class VirtualMachine(object):
                 '__doc__': None,
                 '__package__': None,
             }
-        f_locals.update(callargs)
-        frame = Frame(code, f_globals, f_locals, f_closure, self.frame)
+        if fast_locals is None:
+            if code.co_flags & inspect.CO_OPTIMIZED and not f_locals:
+                # Function frames only read their initial locals from this.
+                f_locals = callargs
+            else:
+                f_locals.update(callargs)
+        program = get_program(
+            code, self.superinstructions, self.peephole, self.quicken,
+        )
+        pool = self.frame_pool.get(id(code))
+        if pool:
+            frame = pool.pop()
+            frame.reset(code, f_globals, f_locals, f_closure, self.frame,
+                        program, fast_locals)
+        else:
+            frame = Frame(code, f_globals, f_locals, f_closure, self.frame,
+                          program, fast_locals)
         return frame
 
     def push_frame(self, frame):
+        if len(self.frames) >= self.recursion_limit:
+            raise RecursionError("maximum recursion depth exceeded")
         self.frames.append(frame)
         self.frame = frame
 
     def pop_frame(self):
-        self.frames.pop()
+        frame = self.frames.pop()
         if self.frames:
             self.frame = self.frames[-1]
         else:
             self.frame = None
+        self.retire_frame(frame)
+
+    def retire_frame(self, frame):
+        """Keep `frame` for reuse by make_frame, if nothing else needs it.
+
+        Only plain function frames are kept: generators and coroutines
+        outlive their calls, module and class bodies share their locals,
+        and pinned frames are referred to by tracebacks.
+
+        """
+        if frame.pinned or frame.generator or frame.fast_locals is None:
+            return
+        if frame.f_code.co_flags & NOT_POOLED_FLAGS:
+            return
+        pool = self.frame_pool.setdefault(id(frame.f_code), [])
+        if len(pool) < self.max_pooled_frames:
+            frame.clear()
+            pool.append(frame)
 
     def print_frames(self):
         """Print the call stack, for debugging."""
@@ -195,69 +457,17 @@ class VirtualMachine(object):
 
 
     def parse_byte_and_args(self):
-        """ Parse 1 - 3 bytes of bytecode into
-        an instruction and optionally arguments.
-        In Python3.6 the format is 2 bytes per instruction."""
+        """ Fetch the next instruction of the frame's decoded program,
+        returning its opcode, its resolved arguments and its index.
+        Only the tracing loop uses this."""
         f = self.frame
         self.fn = f.f_code.co_filename
         self.cn = f.f_code.co_name
+        program = f.program
         opoffset = f.f_lasti
-        if sys.version_info >= (3, 6):
-            currentOp = f.opcodes[opoffset]
-            if currentOp.starts_line:
-                f._line = currentOp.starts_line
-
-            byteCode = currentOp.opcode
-            byteName = currentOp.opname
-        else:
-            byteCode = byteint(f.f_code.co_code[opoffset])
-            byteName = dis.opname[byteCode]
-        f.f_lasti += 1
-        arg = None
-        arguments = []
-        if sys.version_info >= (3, 6) and byteCode == dis.EXTENDED_ARG:
-            # Prefixes any opcode which has an argument too big to fit into the
-            # default two bytes. ext holds two additional bytes which, taken
-            # together with the subsequent opcode’s argument, comprise a
-            # four-byte argument, ext being the two most-significant bytes.
-            # We simply ignore the EXTENDED_ARG because that calculation
-            # is already done by dis, and stored in next currentOp.
-            # Lib/dis.py:_unpack_opargs
-            return self.parse_byte_and_args()
-        if byteCode >= dis.HAVE_ARGUMENT:
-            if sys.version_info >= (3, 6):
-                intArg = currentOp.arg
-            else:
-                arg = f.f_code.co_code[f.f_lasti:f.f_lasti+2]
-                f.f_lasti += 2
-                intArg = byteint(arg[0]) + (byteint(arg[1]) << 8)
-            if byteCode in dis.hasconst:
-                arg = f.f_code.co_consts[intArg]
-            elif byteCode in dis.hasfree:
-                if intArg < len(f.f_code.co_cellvars):
-                    arg = f.f_code.co_cellvars[intArg]
-                else:
-                    var_idx = intArg - len(f.f_code.co_cellvars)
-                    arg = f.f_code.co_freevars[var_idx]
-            elif byteCode in dis.hasname:
-                arg = f.f_code.co_names[intArg]
-            elif byteCode in dis.hasjrel:
-                if sys.version_info >= (3, 6):
-                    arg = f.f_lasti + intArg//2
-                else:
-                    arg = f.f_lasti + intArg
-            elif byteCode in dis.hasjabs:
-                if sys.version_info >= (3, 6):
-                    arg = intArg//2
-                else:
-                    arg = intArg
-            elif byteCode in dis.haslocal:
-                arg = f.f_code.co_varnames[intArg]
-            else:
-                arg = intArg
-            arguments = [arg]
-
-        return byteName, arguments, opoffset
+        f.f_lasti = opoffset + 1
+        arguments = program.arguments[program.operands[opoffset]]
+        return program.opcodes[opoffset], arguments, opoffset
 
     def log(self, byteName, arguments, opoffset):
         """ Log arguments, block stack, and data stack for each opcode."""
@@ -272,34 +482,217 @@ class VirtualMachine(object):
         log.info("  %sblks: %s" % (indent, block_stack_rep))
         log.info("%s<%s>%s" % (indent, self.steps, op))
 
-    def dispatch(self, byteName, arguments):
-        """ Dispatch by bytename to the corresponding methods.
-        Exceptions are caught and set on the virtual machine."""
-        why = None
-        try:
-            if byteName.startswith('UNARY_'):
-                self.unaryOperator(byteName[6:])
-            elif byteName.startswith('BINARY_'):
-                self.binaryOperator(byteName[7:])
-            elif byteName.startswith('INPLACE_'):
-                self.inplaceOperator(byteName[8:])
-            elif 'SLICE+' in byteName:
-                self.sliceOperator(byteName)
-            else:
-                # dispatch
-                bytecode_fn = getattr(self, 'byte_%s' % byteName, None)
-                if not bytecode_fn:            # pragma: no cover
-                    raise VirtualMachineError(
-                        "unknown bytecode type: %s" % byteName
+    @classmethod
+    def dispatch_table(cls):
+        """Get the handlers of this VM class, as a list indexed by opcode.
+
+        The table is built the first time it's asked for, and kept on the
+        class, so subclasses that override byte_* methods get their own.
+        Operator families like BINARY_* share one method and a table of
+        operator functions.  Each member gets a handler that applies its
+        function straight from the table, unless a subclass has overridden
+        the family's method, when it gets a small handler that passes the
+        operator name along to the method.  The adds' handlers concatenate
+        strings for the stores after them, as long as the stores aren't
+        overridden either.
+
+        Superinstructions follow the host's opcodes.  A class can handle one
+        with a byte_FIRST__SECOND method; otherwise, or if a subclass has
+        overridden the handler of either half, the two halves' handlers are
+        run in turn.  The extra opcodes the VM uses in place of ones the host
+        lacks come next, then the quickened runs of instructions, the
+        specialized loops, and the adds followed by stores last.  A
+        subclass that overrides any of the instructions one of those is
+        made of gets handlers that leave them to run one by one.
+
+        """
+        table = cls.__dict__.get('_dispatch_table')
+        if table is None:
+            unbound = six.get_unbound_function
+            families = [
+                ('UNARY_', 'unaryOperator', cls.UNARY_OPERATORS, unary_handler),
+                ('BINARY_', 'binaryOperator', cls.BINARY_OPERATORS, binary_handler),
+                ('INPLACE_', 'inplaceOperator', cls.INPLACE_OPERATORS, binary_handler),
+            ]
+            # Adds peek at the stores after them, unless they're overridden.
+            plain_stores = all(
+                unbound(getattr(cls, name)) is unbound(getattr(VirtualMachine, name))
+                for name in ['byte_STORE_FAST', 'byte_STORE_NAME']
+            )
+            table = []
+            for byteName in dis.opname:
+                for prefix, name, operators, make_handler in families:
+                    if byteName.startswith(prefix):
+                        op = byteName[len(prefix):]
+                        method = unbound(getattr(cls, name))
+                        if operators.get(op) is not None and \
+                                method is unbound(getattr(VirtualMachine, name)):
+                            if op == 'ADD' and plain_stores:
+                                fn = add_handler(
+                                    operators[op], dis.opmap[byteName],
+                                )
+                            else:
+                                fn = make_handler(operators[op])
+                        else:
+                            fn = operator_handler(method, op)
+                        break
+                else:
+                    if 'SLICE+' in byteName:
+                        fn = operator_handler(unbound(cls.sliceOperator), byteName)
+                    else:
+                        fn = getattr(cls, 'byte_%s' % byteName, None)
+                        if fn is None:
+                            fn = unknown_opcode_handler(byteName)
+                        else:
+                            fn = unbound(fn)
+                table.append(fn)
+            for first, second in SUPERINSTRUCTIONS:
+                halves = ['byte_' + first, 'byte_' + second]
+                name = 'byte_%s__%s' % (first, second)
+                owner = defining_class(cls, name)
+                if owner is not None and all(
+                    unbound(getattr(owner, half)) is unbound(getattr(cls, half))
+                    for half in halves
+                ):
+                    fn = unbound(getattr(cls, name))
+                else:
+                    fn = superinstruction_handler(
+                        table[dis.opmap[first]], table[dis.opmap[second]],
+                        operand_count(dis.opmap[first]),
                     )
-                why = bytecode_fn(*arguments)
+                table.append(fn)
+            for byteName in EXTRA_OPCODES:
+                table.append(unbound(getattr(cls, 'byte_%s' % byteName)))
+            if all(
+                unbound(getattr(cls, name)) is unbound(getattr(VirtualMachine, name))
+                for name in QUICKENED_PARTS
+            ):
+                for byteName in QUICKENED:
+                    table.append(unbound(getattr(cls, 'byte_%s' % byteName)))
+            else:
+                for byteName in QUICKENED:
+                    table.append(first_instruction_handler(
+                        table[dis.opmap[RUN_STARTS[byteName]]]
+                    ))
+            if all(
+                unbound(getattr(cls, name)) is unbound(getattr(VirtualMachine, name))
+                for name in LOOP_PARTS
+            ):
+                for byteName in LOOPS:
+                    table.append(unbound(getattr(cls, 'byte_%s' % byteName)))
+            else:
+                table.append(table[dis.opmap['GET_ITER']])
+                table.append(loop_head_handler(table[dis.opmap['FOR_ITER']]))
+                table.append(
+                    loop_jump_handler(table[dis.opmap['JUMP_ABSOLUTE']])
+                )
+            if all(
+                unbound(getattr(cls, name)) is unbound(getattr(VirtualMachine, name))
+                for name in ADD_STORE_PARTS
+            ):
+                for byteName in ADD_STORES:
+                    table.append(unbound(getattr(cls, 'byte_%s' % byteName)))
+            else:
+                table.extend([add_store_handler(table)] * len(ADD_STORES))
+            # The functions of the binary and in-place operators, by opcode,
+            # for quickened runs.
+            cls._operator_functions = [None] * len(dis.opname)
+            for prefix, operators in [('BINARY_', cls.BINARY_OPERATORS),
+                                      ('INPLACE_', cls.INPLACE_OPERATORS)]:
+                for name, fn in operators.items():
+                    if prefix + name in dis.opmap:
+                        cls._operator_functions[dis.opmap[prefix + name]] = fn
+            cls._dispatch_table = table
+        return table
+
+    def run_instructions(self, frame):
+        """Execute `frame`'s instructions until it stops running.
+
+        This is the lean loop, which does nothing but dispatch.  Returns
+        why the frame stopped: 'return', 'yield' or 'exception', or 'call'
+        if it has called an interpreted function without nesting.  An
+        instruction that has patched the program returns 'reload', for the
+        loop to pick up the new instructions.
+
+        """
+        handlers = self.handlers
+        program = frame.program
+        opcodes = program.opcodes
+        operands = program.operands
+        arguments = program.arguments
+        while True:
+            opoffset = frame.f_lasti
+            frame.f_lasti = opoffset + 1
+            try:
+                why = handlers[opcodes[opoffset]](*arguments[operands[opoffset]])
+            except:
+                # deal with exceptions encountered while executing the op.
+                self.last_exception = sys.exc_info()[:2] + (None,)
+                why = 'exception'
+            if why:
+                if why == 'call':
+                    return why
+                if why == 'reload':
+                    program = frame.program
+                    opcodes = program.opcodes
+                    operands = program.operands
+                    arguments = program.arguments
+                    continue
+                why = self.unwind(frame, why)
+                if why:
+                    return why
+
+    def trace_instructions(self, frame):
+        """Execute `frame`'s instructions until it stops running.
+
+        Like run_instructions, but counts the steps taken, and logs each
+        instruction along with the stacks when INFO logging is enabled.
+
+        """
+        handlers = self.handlers
+        while True:
+            VirtualMachine.steps += 1
+            opcode, arguments, opoffset = self.parse_byte_and_args()
+            if log.isEnabledFor(logging.INFO):
+                self.log(opname[opcode], arguments, opoffset)
+
+            try:
+                why = handlers[opcode](*arguments)
+            except:
+                # deal with exceptions encountered while executing the op.
+                self.last_exception = sys.exc_info()[:2] + (None,)
+                #log.exception("Caught exception during execution")
+                why = 'exception'
+            if why == 'exception':
+                # TODO: ceval calls PyTraceBack_Here, not sure what that does.
+                pass
+            elif why == 'call':
+                return why
+            elif why == 'reload':
+                # The program is read afresh for every instruction anyway.
+                continue
+
+            if why:
+                why = self.unwind(frame, why)
+                if why:
+                    return why
+
+    def unwind(self, frame, why):
+        """Handle an instruction's `why`, by unwinding `frame`'s block stack.
 
-        except:
-            # deal with exceptions encountered while executing the op.
-            self.last_exception = sys.exc_info()[:2] + (None,)
-            #log.exception("Caught exception during execution")
+        Returns the `why` left once the blocks have had their say, which is
+        None if the frame should carry on running.
+
+        """
+        # When unwinding the block stack, we need to keep track of why we
+        # are doing it.
+        if why == 'reraise':
             why = 'exception'
 
+        if why != 'yield':
+            while why and frame.block_stack:
+                # Deal with any block management we need to do.
+                why = self.manage_block_stack(why)
         return why
 
     def manage_block_stack(self, why):
@@ -373,53 +766,145 @@ class VirtualMachine(object):
 
         """
         self.push_frame(frame)
-        while True:
-            VirtualMachine.steps += 1
-            byteName, arguments, opoffset = self.parse_byte_and_args()
-            if log.isEnabledFor(logging.INFO):
-                self.log(byteName, arguments, opoffset)
-
-            # When unwinding the block stack, we need to keep track of why we
-            # are doing it.
-            why = self.dispatch(byteName, arguments)
-            if why == 'exception':
-                # TODO: ceval calls PyTraceBack_Here, not sure what that does.
-                pass
-
-            if why == 'reraise':
-                why = 'exception'
-
-            if why != 'yield':
-                while why and frame.block_stack:
-                    # Deal with any block management we need to do.
-                    why = self.manage_block_stack(why)
-
-            if why:
-                break
+        if self.stackless:
+            why = self.run_frames(frame)
+        elif self.trace:
+            why = self.trace_instructions(frame)
+        else:
+            why = self.run_instructions(frame)
 
         # TODO: handle generator exception state
 
         self.pop_frame()
 
         if why == 'exception':
-            if self.last_exception:
-                et, val, tb = self.last_exception
-                raise val
-            else:
-                raise Exception('%s %s %s' % (byteName, arguments, opoffset))
+            raise self.frame_exception(frame)
 
         return self.return_value
 
+    def frame_exception(self, frame):
+        """Get the exception that stopped `frame`, to raise to its caller."""
+        if self.last_exception:
+            et, val, tb = self.last_exception
+            return val
+        opoffset = frame.f_lasti - 1
+        byteName, arguments = frame.program.instruction(opoffset)
+        return Exception('%s %s %s' % (byteName, arguments, opoffset))
+
+    def make_entry(self, func):
+        """Make the entry point through which host code calls `func`.
+
+        Native code calling back into the VM, like sorted() calling a key
+        function, and the VM itself unless it's stackless, call Functions
+        through their entry point.  For a plain function with only
+        positional parameters and no cells, a call passing exactly those
+        puts its arguments straight into a pooled frame, skipping the
+        binding and the general set-up make_frame does.  Anything else
+        takes the general path.
+
+        """
+        general = func._call
+        code = func.func_code
+        binder = func._binder
+        if (
+            self.trace or not binder.simple or binder.kind is not PLAIN
+            or code.co_cellvars or code.co_freevars
+        ):
+            return general
+        argcount = binder.argcount
+        padding = binder.padding
+        f_globals = func.func_globals
+        program = get_program(
+            code, self.superinstructions, self.peephole, self.quicken,
+        )
+        key = id(code)
+        frame_pool = self.frame_pool
+        frames = self.frames
+
+        def entry(args, kwargs):
+            caller = self.frame
+            if (
+                kwargs or len(args) != argcount or caller is None
+                or func.func_code is not code
+            ):
+                return general(args, kwargs)
+            fast_locals = list(args)
+            fast_locals.extend(padding)
+            pool = frame_pool.get(key)
+            if pool:
+                # A pooled frame of this code only needs what clear() dropped.
+                frame = pool.pop()
+                frame.f_globals = f_globals
+                frame.f_builtins = caller.f_builtins
+                frame.f_back = caller
+                frame.fast_locals = fast_locals
+                frame.program = program
+                frame.f_lasti = 0
+            else:
+                frame = Frame(code, f_globals, None, None, caller, program,
+                              fast_locals)
+            self.push_frame(frame)
+            if self.stackless:
+                why = self.run_frames(frame)
+            else:
+                why = self.run_instructions(frame)
+            frames.pop()
+            self.frame = caller
+            if not frame.pinned:
+                if pool is None:
+                    pool = frame_pool.setdefault(key, [])
+                if len(pool) < self.max_pooled_frames:
+                    frame.clear()
+                    pool.append(frame)
+            if why == 'exception':
+                raise self.frame_exception(frame)
+            return self.return_value
+
+        return entry
+
+    def run_frames(self, frame):
+        """Run `frame`, which is on top of the call stack, until it stops.
+
+        This is the stackless loop.  Calls to interpreted functions push
+        their frame and carry on in this loop, and when a frame stops, its
+        caller resumes here too, so the host's stack doesn't grow with the
+        VM's.  Only calls from native code, such as callbacks, start another
+        loop.  Returns why `frame` stopped, leaving it on the call stack.
+
+        """
+        run = self.trace_instructions if self.trace else self.run_instructions
+        while True:
+            current = self.frame
+            why = run(current)
+            while why != 'call':
+                if current is frame:
+                    return why
+                self.pop_frame()
+                caller = self.frame
+                if why == 'return':
+                    caller.stack.append(self.return_value)
+                    break
+                # The exception is raised by the caller's call instruction.
+                why = self.unwind(caller, why)
+                if not why:
+                    break
+                current = caller
+
     ## Stack manipulation
 
+    # The hottest handlers work on the frame's stack directly, and leave
+    # results in place of their operands, rather than popping values into
+    # a list and pushing the result.
+
     def byte_LOAD_CONST(self, const):
-        self.push(const)
+        self.frame.stack.append(const)
 
     def byte_POP_TOP(self):
-        self.pop()
+        self.frame.stack.pop()
 
     def byte_DUP_TOP(self):
-        self.push(self.top())
+        stack = self.frame.stack
+        stack.append(stack[-1])
 
     def byte_DUP_TOPX(self, count):
         items = self.popn(count)
@@ -428,73 +913,98 @@ class VirtualMachine(object):
 
     def byte_DUP_TOP_TWO(self):
         # Py3 only
-        a, b = self.popn(2)
-        self.push(a, b, a, b)
+        stack = self.frame.stack
+        stack.extend(stack[-2:])
 
     def byte_ROT_TWO(self):
-        a, b = self.popn(2)
-        self.push(b, a)
+        stack = self.frame.stack
+        stack[-1], stack[-2] = stack[-2], stack[-1]
 
     def byte_ROT_THREE(self):
-        a, b, c = self.popn(3)
-        self.push(c, a, b)
+        stack = self.frame.stack
+        stack[-1], stack[-2], stack[-3] = stack[-2], stack[-3], stack[-1]
 
     def byte_ROT_FOUR(self):
-        a, b, c, d = self.popn(4)
-        self.push(d, a, b, c)
+        stack = self.frame.stack
+        stack[-1], stack[-2], stack[-3], stack[-4] = (
+            stack[-2], stack[-3], stack[-4], stack[-1])
 
     ## Names
 
+    # Loads of global names look in the globals, then the builtins, every
+    # time, so they see any change made to either dict, by any code.  They
+    # keep no cache: a cached value can only be checked by looking the name
+    # up again, or by being told of every change, which host code doesn't
+    # do; and a hint of which dict to look in first saves less than finding
+    # it costs, unless every load is given one, in memory.  See
+    # benchmarks/bench_globals.py.
+
     def byte_LOAD_NAME(self, name):
         frame = self.frame
-        if name in frame.f_locals:
-            val = frame.f_locals[name]
-        elif name in frame.f_globals:
-            val = frame.f_globals[name]
+        # Only module and class bodies load names, and their locals are
+        # a mapping.
+        f_locals = frame._locals
+        f_globals = frame.f_globals
+        if f_locals is not f_globals and name in f_locals:
+            val = f_locals[name]
+        elif name in f_globals:
+            val = f_globals[name]
         elif name in frame.f_builtins:
             val = frame.f_builtins[name]
         else:
             raise NameError("name '%s' is not defined" % name)
-        self.push(val)
+        frame.stack.append(val)
 
     def byte_STORE_NAME(self, name):
-        self.frame.f_locals[name] = self.pop()
+        frame = self.frame
+        frame._locals[name] = frame.stack.pop()
 
     def byte_DELETE_NAME(self, name):
-        del self.frame.f_locals[name]
+        del self.frame._locals[name]
 
-    def byte_LOAD_FAST(self, name):
-        if name in self.frame.f_locals:
-            val = self.frame.f_locals[name]
-        else:
+    def byte_LOAD_FAST(self, index):
+        frame = self.frame
+        val = frame.fast_locals[index]
+        if val is UNBOUND:
             raise UnboundLocalError(
-                "local variable '%s' referenced before assignment" % name
+                "local variable '%s' referenced before assignment" %
+                frame.f_code.co_varnames[index]
             )
-        self.push(val)
+        frame.stack.append(val)
 
-    def byte_STORE_FAST(self, name):
-        self.frame.f_locals[name] = self.pop()
+    def byte_STORE_FAST(self, index):
+        frame = self.frame
+        frame.fast_locals[index] = frame.stack.pop()
 
-    def byte_DELETE_FAST(self, name):
-        del self.frame.f_locals[name]
+    def byte_DELETE_FAST(self, index):
+        frame = self.frame
+        if frame.fast_locals[index] is UNBOUND:
+            raise UnboundLocalError(
+                "local variable '%s' referenced before assignment" %
+                frame.f_code.co_varnames[index]
+            )
+        frame.fast_locals[index] = UNBOUND
 
     def byte_LOAD_GLOBAL(self, name):
         f = self.frame
-        if name in f.f_globals:
-            val = f.f_globals[name]
+        f_globals = f.f_globals
+        if name in f_globals:
+            val = f_globals[name]
         elif name in f.f_builtins:
             val = f.f_builtins[name]
+        elif PY2:
+            raise NameError("global name '%s' is not defined" % name)
         else:
-            if PY2:
-                raise NameError("global name '%s' is not defined" % name)
-            elif PY3:
-                raise NameError("name '%s' is not defined" % name)
-        self.push(val)
+            raise NameError("name '%s' is not defined" % name)
+        f.stack.append(val)
 
     def byte_STORE_GLOBAL(self, name):
         f = self.frame
         f.f_globals[name] = self.pop()
 
+    def byte_DELETE_GLOBAL(self, name):
+        del self.frame.f_globals[name]
+
     def byte_LOAD_DEREF(self, name):
         self.push(self.frame.cells[name].get())
 
@@ -515,12 +1025,13 @@ class VirtualMachine(object):
     }
 
     def unaryOperator(self, op):
-        x = self.pop()
-        self.push(self.UNARY_OPERATORS[op](x))
+        stack = self.frame.stack
+        stack[-1] = self.UNARY_OPERATORS[op](stack[-1])
 
     BINARY_OPERATORS = {
         'POWER':    pow,
         'MULTIPLY': operator.mul,
+        'MATRIX_MULTIPLY': getattr(operator, 'matmul', None),
         'DIVIDE':   getattr(operator, 'div', lambda x, y: None),
         'FLOOR_DIVIDE': operator.floordiv,
         'TRUE_DIVIDE':  operator.truediv,
@@ -536,38 +1047,35 @@ class VirtualMachine(object):
     }
 
     def binaryOperator(self, op):
-        x, y = self.popn(2)
-        self.push(self.BINARY_OPERATORS[op](x, y))
+        stack = self.frame.stack
+        y = stack.pop()
+        stack[-1] = self.BINARY_OPERATORS[op](stack[-1], y)
+
+    INPLACE_OPERATORS = {
+        'POWER':    operator.ipow,
+        'MULTIPLY': operator.imul,
+        'MATRIX_MULTIPLY': getattr(operator, 'imatmul', None),
+        'DIVIDE':   operator.ifloordiv,
+        'FLOOR_DIVIDE': operator.ifloordiv,
+        'TRUE_DIVIDE':  operator.itruediv,
+        'MODULO':   operator.imod,
+        'ADD':      operator.iadd,
+        'SUBTRACT': operator.isub,
+        'LSHIFT':   operator.ilshift,
+        'RSHIFT':   operator.irshift,
+        'AND':      operator.iand,
+        'XOR':      operator.ixor,
+        'OR':       operator.ior,
+    }
 
     def inplaceOperator(self, op):
-        x, y = self.popn(2)
-        if op == 'POWER':
-            x **= y
-        elif op == 'MULTIPLY':
-            x *= y
-        elif op in ['DIVIDE', 'FLOOR_DIVIDE']:
-            x //= y
-        elif op == 'TRUE_DIVIDE':
-            x /= y
-        elif op == 'MODULO':
-            x %= y
-        elif op == 'ADD':
-            x += y
-        elif op == 'SUBTRACT':
-            x -= y
-        elif op == 'LSHIFT':
-            x <<= y
-        elif op == 'RSHIFT':
-            x >>= y
-        elif op == 'AND':
-            x &= y
-        elif op == 'XOR':
-            x ^= y
-        elif op == 'OR':
-            x |= y
-        else:           # pragma: no cover
+        stack = self.frame.stack
+        y = stack.pop()
+        try:
+            fn = self.INPLACE_OPERATORS[op]
+        except KeyError:    # pragma: no cover
             raise VirtualMachineError("Unknown in-place operator: %r" % op)
-        self.push(x)
+        stack[-1] = fn(stack[-1], y)
 
     def sliceOperator(self, op):
         start = 0
@@ -605,30 +1113,119 @@ class VirtualMachine(object):
     ]
 
     def byte_COMPARE_OP(self, opnum):
-        x, y = self.popn(2)
-        self.push(self.COMPARE_OPERATORS[opnum](x, y))
+        stack = self.frame.stack
+        y = stack.pop()
+        stack[-1] = self.COMPARE_OPERATORS[opnum](stack[-1], y)
 
     ## Attributes and indexing
 
+    # LOAD_METHOD has an AttrCache, made the first time it runs, which
+    # remembers where the attribute lives for each of the last few types of
+    # object the instruction has seen, so that it doesn't look through the
+    # dicts of the type and its bases for the method every time.  LOAD_ATTR and STORE_ATTR leave it
+    # to getattr and setattr, whose lookups are cached by the host already,
+    # and cost less than checking a cache of the VM's would, as
+    # benchmarks/bench_attributes.py measures for each kind of field.  What
+    # the caches learn holds until a class changes, so setting or deleting
+    # an attribute of a class empties them all.
+
     def byte_LOAD_ATTR(self, attr):
-        obj = self.pop()
-        if type(obj) is Function and attr == '__qualname__':
-            val = getattr(obj, '__qname__')
-        else:
+        stack = self.frame.stack
+        obj = stack[-1]
+        try:
             val = getattr(obj, attr)
-        self.push(val)
+        except AttributeError:
+            if type(obj) is Function and attr == '__qualname__':
+                val = obj.__qname__
+            else:
+                raise
+        stack[-1] = val
+
+    def byte_LOAD_METHOD(self, name):
+        # Pushes the method and the object, if the attribute is a Function
+        # found on the object's type, so CALL_METHOD can call it with the
+        # object without making a bound Method.  Otherwise, pushes NULL and
+        # the attribute.
+        frame = self.frame
+        stack = frame.stack
+        obj = stack[-1]
+        cls = type(obj)
+        caches = frame.program.caches
+        cache = caches.get(frame.f_lasti - 1) if caches else None
+        if cache is None:
+            cache = inline_cache(frame.program, frame.f_lasti - 1, AttrCache)
+        kind = cache.kinds.get(cls)
+        if kind is None:
+            kind = cache.miss(cls, name)
+        else:
+            cache.hits += 1
+        if type(kind) is Function:
+            stack[-1] = kind
+            stack.append(obj)
+            return
+        if type(kind) is tuple and name not in obj.__dict__:
+            # The method isn't shadowed by the instance.
+            stack[-1] = kind[0]
+            stack.append(obj)
+            return
+        stack[-1] = getattr(obj, name)
+        stack.insert(-1, NULL)
+
+    def byte_CALL_INLINED(self, inlined):
+        # Runs an inlined call's body on the stack, after checking the
+        # callee is the one inlined.  The callee's parameters are the
+        # values from `base` on.
+        frame = self.frame
+        stack = frame.stack
+        base = len(stack) - inlined.argc
+        func = stack[base - 1]
+        if func is not inlined.func or func.func_code is not inlined.code:
+            index = frame.f_lasti - 1
+            deoptimize(frame.program, index, inlined)
+            site = inline_cache(frame.program, index, CallSite)
+            site.inlining = 'deoptimized'
+            self.record_inlining(index, inlined.func, site.inlining)
+            why = self.handlers[inlined.opcode](*inlined.arguments)
+            return why or 'reload'
+        handlers = self.handlers
+        for op, arguments in inlined.body:
+            if op is None:
+                stack.append(stack[base + arguments])
+            else:
+                handlers[op](*arguments)
+        result = stack[-1]
+        if inlined.opcode == CALL_METHOD and stack[base - 2] is NULL:
+            # The callee is an attribute LOAD_METHOD pushed NULL below,
+            # which CALL_METHOD would have dropped.
+            base -= 1
+        stack[base - 1] = result
+        del stack[base:]
+
+    def byte_CALL_METHOD(self, argc):
+        stack = self.frame.stack
+        if stack[-argc - 2] is NULL:
+            del stack[-argc - 2]
+            return self.call_function(argc)
+        return self.call_function(argc + 1)
 
     def byte_STORE_ATTR(self, name):
-        val, obj = self.popn(2)
-        setattr(obj, name, val)
+        stack = self.frame.stack
+        obj = stack.pop()
+        setattr(obj, name, stack.pop())
+        if isinstance(obj, type):
+            classes_changed()
 
     def byte_DELETE_ATTR(self, name):
         obj = self.pop()
         delattr(obj, name)
+        if isinstance(obj, type):
+            classes_changed()
 
     def byte_STORE_SUBSCR(self):
-        val, obj, subscr = self.popn(3)
-        obj[subscr] = val
+        stack = self.frame.stack
+        subscr = stack.pop()
+        obj = stack.pop()
+        obj[subscr] = stack.pop()
 
     def byte_DELETE_SUBSCR(self):
         obj, subscr = self.popn(2)
@@ -707,10 +1304,12 @@ class VirtualMachine(object):
         # count values are consumed from the stack.
         # The top element contains tuple of keys
         # added in version 3.6
-        keys = self.pop()
-        values = self.popn(count)
-        kvs = dict(zip(keys, values))
-        self.push(kvs)
+        stack = self.frame.stack
+        keys = stack.pop()
+        base = len(stack) - count
+        kvs = dict(zip(keys, stack[base:]))
+        del stack[base:]
+        stack.append(kvs)
 
     def byte_BUILD_MAP(self, count):
         # Pushes a new dictionary on to stack.
@@ -720,11 +1319,13 @@ class VirtualMachine(object):
         # Pop 2*count items so that
         # dictionary holds count entries: {..., TOS3: TOS2, TOS1:TOS}
         # updated in version 3.5
+        stack = self.frame.stack
+        base = len(stack) - 2 * count
         kvs = {}
-        for i in range(0, count):
-            key, val = self.popn(2)
-            kvs[key] = val
-        self.push(kvs)
+        for i in range(base, len(stack), 2):
+            kvs[stack[i]] = stack[i+1]
+        del stack[base:]
+        stack.append(kvs)
 
     def byte_STORE_MAP(self):
         the_map, val, key = self.popn(3)
@@ -732,9 +1333,20 @@ class VirtualMachine(object):
         self.push(the_map)
 
     def byte_UNPACK_SEQUENCE(self, count):
-        seq = self.pop()
-        for x in reversed(list(seq)):
-            self.push(x)
+        stack = self.frame.stack
+        seq = stack.pop()
+        stack.extend(reversed(list(seq)))
+
+    def byte_REVERSE_N(self, count):
+        # Reverses the top `count` values in place, as BUILD_TUPLE and
+        # UNPACK_SEQUENCE would, without the tuple or the list.
+        stack = self.frame.stack
+        i = len(stack) - count
+        j = len(stack) - 1
+        while i < j:
+            stack[i], stack[j] = stack[j], stack[i]
+            i += 1
+            j -= 1
 
     def byte_BUILD_SLICE(self, count):
         if count == 2:
@@ -822,14 +1434,14 @@ class VirtualMachine(object):
                 self.jump(jump)
 
     def byte_POP_JUMP_IF_TRUE(self, jump):
-        val = self.pop()
-        if val:
-            self.jump(jump)
+        frame = self.frame
+        if frame.stack.pop():
+            frame.f_lasti = jump
 
     def byte_POP_JUMP_IF_FALSE(self, jump):
-        val = self.pop()
-        if not val:
-            self.jump(jump)
+        frame = self.frame
+        if not frame.stack.pop():
+            frame.f_lasti = jump
 
     def byte_JUMP_IF_TRUE_OR_POP(self, jump):
         val = self.top()
@@ -851,7 +1463,8 @@ class VirtualMachine(object):
         self.push_block('loop', dest)
 
     def byte_GET_ITER(self):
-        self.push(iter(self.pop()))
+        stack = self.frame.stack
+        stack[-1] = iter(stack[-1])
 
     def byte_GET_YIELD_FROM_ITER(self):
         tos = self.top()
@@ -861,13 +1474,13 @@ class VirtualMachine(object):
         self.push(iter(tos))
 
     def byte_FOR_ITER(self, jump):
-        iterobj = self.top()
+        frame = self.frame
+        stack = frame.stack
         try:
-            v = next(iterobj)
-            self.push(v)
+            stack.append(next(stack[-1]))
         except StopIteration:
-            self.pop()
-            self.jump(jump)
+            stack.pop()
+            frame.f_lasti = jump
 
     def byte_BREAK_LOOP(self):
         return 'break'
@@ -1131,10 +1744,41 @@ class VirtualMachine(object):
         #Var-positional and var-keyword arguments are packed by
         #BUILD_TUPLE_UNPACK_WITH_CALL and BUILD_MAP_UNPACK_WITH_CALL.
         # new in 3.6
-        varkw = self.pop() if (arg & 0x1) else {}
+        varkw = self.pop() if (arg & 0x1) else None
         varpos = self.pop()
         return self.call_function(0, varpos, varkw)
 
+    # The peephole optimizer puts these in place of BUILD_TUPLE,
+    # BUILD_TUPLE_UNPACK_WITH_CALL, CALL_FUNCTION_EX and
+    # BUILD_MAP_UNPACK_WITH_CALL where they pass arguments to a call.
+    # Rather than building a tuple, and then another tuple or dict joining
+    # it to the next argument, they build the list of positional arguments
+    # the call keeps, and merge keyword arguments into the dict BUILD_MAP
+    # has just made.
+
+    def byte_BUILD_ARGS(self, count):
+        self.push(self.popn(count))
+
+    def byte_EXTEND_ARGS(self, count):
+        stack = self.frame.stack
+        base = len(stack) - count
+        args = stack[base - 1]
+        for i in range(base, len(stack)):
+            args.extend(stack[i])
+        del stack[base:]
+
+    def byte_CALL_FUNCTION_ARGS(self, arg):
+        varkw = self.pop() if (arg & 0x1) else None
+        return self.call_function(0, (), varkw, self.pop())
+
+    def byte_MERGE_KWARGS(self, count):
+        stack = self.frame.stack
+        base = len(stack) - count
+        kwargs = stack[base - 1]
+        for i in range(base, len(stack)):
+            kwargs.update(stack[i])
+        del stack[base:]
+
     def byte_CALL_FUNCTION(self, arg):
         # Calls a function. argc indicates the number of positional arguments.
         # The positional arguments are on the stack, with the right-most
@@ -1142,48 +1786,80 @@ class VirtualMachine(object):
         # on the stack. Pops all function arguments, and the function itself
         # off the stack, and pushes the return value.
         # 3.6: Only used for calls with positional args
-        return self.call_function(arg, [], {})
+        return self.call_function(arg)
 
     def byte_CALL_FUNCTION_VAR(self, arg):
         args = self.pop()
-        return self.call_function(arg, args, {})
+        return self.call_function(arg, args)
 
     def byte_CALL_FUNCTION_KW(self, argc):
         if not(six.PY3 and sys.version_info.minor >= 6):
             kwargs = self.pop()
-            return self.call_function(arg, [], kwargs)
+            return self.call_function(argc, (), kwargs)
         # changed in 3.6: keyword arguments are packed in a tuple instead
         # of a dict. argc indicates total number of args.
         kwargnames = self.pop()
         lkwargs = len(kwargnames)
         kwargs = self.popn(lkwargs)
         arg = argc - lkwargs
-        return self.call_function(arg, [], dict(zip(kwargnames, kwargs)))
+        return self.call_function(arg, (), dict(zip(kwargnames, kwargs)))
 
     def byte_CALL_FUNCTION_VAR_KW(self, arg):
         args, kwargs = self.popn(2)
         return self.call_function(arg, args, kwargs)
 
-    def call_function(self, arg, args, kwargs):
+    def call_function(self, arg, args=(), kwargs=None, popped=None):
+        """Call the function on the stack below `arg` arguments.
+
+        `args` and `kwargs` are extra positional and keyword arguments, from
+        `*args` and `**kwargs` in the call.  `popped`, if given, is a list of
+        positional arguments already popped off the stack, which the call
+        may keep.
+
+        """
         lenKw, lenPos = divmod(arg, 256)
-        namedargs = {}
-        for i in range(lenKw):
-            key, val = self.popn(2)
-            namedargs[key] = val
-        namedargs.update(kwargs)
-        posargs = self.popn(lenPos)
-        posargs.extend(args)
+        if lenKw:
+            # Py2 passes keyword arguments as pairs on the stack.
+            namedargs = {}
+            for i in range(lenKw):
+                key, val = self.popn(2)
+                namedargs[key] = val
+            if kwargs:
+                namedargs.update(kwargs)
+        else:
+            # The mapping is only ever unpacked into the call, so it's
+            # safe to pass on as it is.
+            namedargs = kwargs or {}
+        if popped is None:
+            posargs = self.popn(lenPos)
+            if args:
+                posargs.extend(args)
+        else:
+            posargs = popped
 
         func = self.pop()
-        if hasattr(func, '__name__'):
-            if func.__name__ == 'getattr' and type(posargs[0]) is Function and posargs[1] == '__qualname__':
-                # https://bugs.python.org/issue19073
-                retval = posargs[0].__qname__
-                self.push(retval)
-                return
-
         frame = self.frame
-        if hasattr(func, 'im_func'):
+        caches = frame.program.caches
+        site = caches.get(frame.f_lasti - 1) if caches else None
+        if site is None:
+            site = inline_cache(frame.program, frame.f_lasti - 1, CallSite)
+        kind = site.kinds.get(type(func))
+        if kind is None:
+            kind = site.miss(func)
+        else:
+            site.hits += 1
+        reload = False
+        if kind is FUNCTION:
+            byterun_func = func
+            if self.inlining and site.inlining is None \
+                    and not args and not namedargs and popped is None:
+                reload = self.consider_inlining(site, func, lenPos)
+        elif kind is HOST_FUNCTION:
+            if Interpret_Original:
+                byterun_func = self.host_function(func)
+            else:
+                byterun_func = func
+        elif kind is METHOD:
             # Methods get self as an implicit first parameter.
             if func.im_self:
                 posargs.insert(0, func.im_self)
@@ -1198,18 +1874,98 @@ class VirtualMachine(object):
                     )
                 )
             func = func.im_func
-
-        if isinstance(func, types.FunctionType) and Interpret_Original:
-            defaults = func.__defaults__ or ()
-            kwdefaults = func.__kwdefaults__ or ()
-            byterun_func = Function(
-                    func.__name__, func.__code__, func.__globals__,
-                    defaults, kwdefaults, func.__closure__, self)
+            if isinstance(func, types.FunctionType) and Interpret_Original:
+                byterun_func = self.host_function(func)
+            else:
+                byterun_func = func
         else:
+            if func is locals and not posargs and not namedargs:
+                # The host's locals() would see call_function's variables.
+                self.push(frame.f_locals)
+                return
+            if func is globals and not posargs and not namedargs:
+                # And its globals() would see this module's.
+                self.push(frame.f_globals)
+                return
+            if (func is setattr or func is delattr or func is TYPE_SETATTR
+                    or func is TYPE_DELATTR) and posargs \
+                    and isinstance(posargs[0], type):
+                # Changing a class, as STORE_ATTR and DELETE_ATTR can.
+                func(*posargs, **namedargs)
+                classes_changed()
+                self.push(None)
+                return
+            if (func is getattr and len(posargs) == 2
+                    and type(posargs[0]) is Function
+                    and posargs[1] == '__qualname__'):
+                # https://bugs.python.org/issue19073
+                self.push(posargs[0].__qname__)
+                return
             byterun_func = func
 
+        if self.stackless and type(byterun_func) is Function \
+                and byterun_func._binder.kind is PLAIN:
+            self.push_frame(byterun_func.make_frame(posargs, namedargs))
+            return 'call'
         retval = byterun_func(*posargs, **namedargs)
         self.push(retval)
+        if reload:
+            return 'reload'
+
+    def consider_inlining(self, site, func, argc):
+        """Count a call of `func` from `site`, inlining it if it's hot.
+
+        It is hot at once if a profile says it was inlined in an earlier run.
+
+        The call is being made by the current instruction, with `argc`
+        positional arguments.  Returns whether the program was patched.
+
+        """
+        profiled = site.profiled
+        if profiled is not None:
+            # Only the first call can take up the profile's hint.
+            site.profiled = None
+        if profiled is None or profiled != code_hash(func.func_code):
+            if site.target is not func:
+                site.target = func
+                site.streak = 1
+                return False
+            site.streak += 1
+            if site.streak < self.inline_threshold:
+                return False
+        frame = self.frame
+        index = frame.f_lasti - 1
+        site.inlining = inline_call(frame.program, index, func, argc)
+        site.target = None
+        self.record_inlining(index, func, site.inlining)
+        return site.inlining == 'inlined'
+
+    def record_inlining(self, index, func, outcome):
+        """Record what the inliner did at the current frame's `index`."""
+        frame = self.frame
+        self.inlining_decisions.append(Decision(
+            frame.f_code.co_filename, frame.program.line_number(index + 1),
+            func.__name__, outcome,
+        ))
+
+    def host_function(self, func):
+        """Get the Function that interprets the host function `func`.
+
+        The Function is made once, and made again only if the host
+        function's code or defaults have been replaced since.
+
+        """
+        wrapper = self.host_functions.get(func)
+        if (
+            wrapper is None
+            or wrapper.func_code is not func.__code__
+            or wrapper.func_defaults is not func.__defaults__
+            or wrapper.func_kwdefaults is not func.__kwdefaults__
+        ):
+            wrapper = self.host_functions[func] = Function(
+                func.__name__, func.__code__, func.__globals__,
+                func.__defaults__, func.__kwdefaults__, func.__closure__, self)
+        return wrapper
 
     def import_module(self, name, fromList, level):
         f = self.frame
@@ -1351,6 +2107,227 @@ class VirtualMachine(object):
         mod = self.top()
         self.push(getattr(mod, name))
 
+    ## Superinstructions
+
+    # Each runs a pair of instructions that the decoded program has fused.
+    # The first instruction is at f_lasti - 1, so before running the second
+    # f_lasti must step over it, for jumps and tracebacks to be right.
+
+    def byte_LOAD_FAST__LOAD_FAST(self, index1, index2):
+        self.byte_LOAD_FAST(index1)
+        self.frame.f_lasti += 1
+        self.byte_LOAD_FAST(index2)
+
+    def byte_LOAD_FAST__LOAD_CONST(self, index, const):
+        self.byte_LOAD_FAST(index)
+        self.frame.f_lasti += 1
+        self.frame.stack.append(const)
+
+    def byte_STORE_FAST__LOAD_FAST(self, index1, index2):
+        frame = self.frame
+        frame.fast_locals[index1] = frame.stack.pop()
+        frame.f_lasti += 1
+        self.byte_LOAD_FAST(index2)
+
+    def byte_COMPARE_OP__POP_JUMP_IF_FALSE(self, opnum, jump):
+        frame = self.frame
+        stack = frame.stack
+        y = stack.pop()
+        x = stack.pop()
+        if self.COMPARE_OPERATORS[opnum](x, y):
+            frame.f_lasti += 1
+        else:
+            frame.f_lasti = jump
+
+    def byte_LOAD_GLOBAL__CALL_FUNCTION(self, name, arg):
+        self.byte_LOAD_GLOBAL(name)
+        self.frame.f_lasti += 1
+        return self.call_function(arg)
+
+    ## Quickened runs
+
+    # Each applies an operator to the operands its run loads, without
+    # pushing them, and stores or jumps on the result if its run goes on
+    # to.  Like a superinstruction, each first steps f_lasti over the
+    # instructions of its run before the one it's doing the work of.  If a
+    # local is unbound, only the run's first instruction is run, so the
+    # rest raise the error as they would have.  Adding a string to the
+    # local the result replaces concatenates as ADD_STORE_FAST does.
+
+    def byte_OPERATOR_FAST_FAST(self, a, b, op):
+        frame = self.frame
+        fast_locals = frame.fast_locals
+        x = fast_locals[a]
+        y = fast_locals[b]
+        if x is UNBOUND or y is UNBOUND:
+            return self.byte_LOAD_FAST(a)
+        frame.f_lasti += 2
+        frame.stack.append(self._operator_functions[op](x, y))
+
+    def byte_OPERATOR_FAST_CONST(self, a, y, op):
+        frame = self.frame
+        x = frame.fast_locals[a]
+        if x is UNBOUND:
+            return self.byte_LOAD_FAST(a)
+        frame.f_lasti += 2
+        frame.stack.append(self._operator_functions[op](x, y))
+
+    def byte_OPERATOR_CONST(self, y, op):
+        frame = self.frame
+        stack = frame.stack
+        frame.f_lasti += 1
+        stack[-1] = self._operator_functions[op](stack[-1], y)
+
+    def byte_OPERATOR_FAST_FAST_STORE(self, a, b, op, c):
+        frame = self.frame
+        fast_locals = frame.fast_locals
+        x = fast_locals[a]
+        y = fast_locals[b]
+        if x is UNBOUND or y is UNBOUND:
+            return self.byte_LOAD_FAST(a)
+        frame.f_lasti += 2
+        if type(x) is str and type(y) is str and a == c and op in ADDS:
+            fast_locals[c] = UNBOUND
+            x += y
+        else:
+            x = self._operator_functions[op](x, y)
+        frame.f_lasti += 1
+        fast_locals[c] = x
+
+    def byte_OPERATOR_FAST_CONST_STORE(self, a, y, op, c):
+        frame = self.frame
+        fast_locals = frame.fast_locals
+        x = fast_locals[a]
+        if x is UNBOUND:
+            return self.byte_LOAD_FAST(a)
+        frame.f_lasti += 2
+        x = self._operator_functions[op](x, y)
+        frame.f_lasti += 1
+        fast_locals[c] = x
+
+    def byte_OPERATOR_CONST_STORE(self, y, op, c):
+        frame = self.frame
+        frame.f_lasti += 1
+        x = self._operator_functions[op](frame.stack.pop(), y)
+        frame.f_lasti += 1
+        frame.fast_locals[c] = x
+
+    def byte_COMPARE_FAST_FAST_JUMP_IF_FALSE(self, a, b, opnum, jump):
+        frame = self.frame
+        fast_locals = frame.fast_locals
+        x = fast_locals[a]
+        y = fast_locals[b]
+        if x is UNBOUND or y is UNBOUND:
+            return self.byte_LOAD_FAST(a)
+        frame.f_lasti += 2
+        if self.COMPARE_OPERATORS[opnum](x, y):
+            frame.f_lasti += 1
+        else:
+            frame.f_lasti = jump
+
+    def byte_COMPARE_FAST_CONST_JUMP_IF_FALSE(self, a, y, opnum, jump):
+        frame = self.frame
+        x = frame.fast_locals[a]
+        if x is UNBOUND:
+            return self.byte_LOAD_FAST(a)
+        frame.f_lasti += 2
+        if self.COMPARE_OPERATORS[opnum](x, y):
+            frame.f_lasti += 1
+        else:
+            frame.f_lasti = jump
+
+    def byte_COMPARE_CONST_JUMP_IF_FALSE(self, y, opnum, jump):
+        frame = self.frame
+        frame.f_lasti += 1
+        if self.COMPARE_OPERATORS[opnum](frame.stack.pop(), y):
+            frame.f_lasti += 1
+        else:
+            frame.f_lasti = jump
+
+    ## Specialized loops
+
+    # A loop over a range keeps a counter on the stack in place of an
+    # iterator: a list of the next value, the value it ends before, and the
+    # step, so stepping it is plain integer arithmetic.  Whatever else the
+    # loop is over, say because `range` has been rebound, is stepped by
+    # its iterator, as by FOR_ITER.
+
+    def byte_GET_RANGE_ITER(self):
+        stack = self.frame.stack
+        iterable = stack[-1]
+        if type(iterable) is RANGE:
+            start = iterable.start
+            step = iterable.step
+            end = iterable[-1] + step if iterable else start
+            stack[-1] = [start, end, step]
+        else:
+            stack[-1] = iter(iterable)
+
+    def byte_FOR_ITER_STORE(self, jump, index, body):
+        frame = self.frame
+        iterator = frame.stack[-1]
+        if type(iterator) is list:
+            value = iterator[0]
+            if value != iterator[1]:
+                iterator[0] = value + iterator[2]
+                frame.fast_locals[index] = value
+                frame.f_lasti = body
+                return
+        else:
+            # Point at the loop's head, for a traceback if next() fails.
+            frame.f_lasti = body - 1
+            value = next(iterator, NULL)
+            if value is not NULL:
+                frame.fast_locals[index] = value
+                frame.f_lasti = body
+                return
+        frame.stack.pop()
+        frame.f_lasti = jump
+
+    # At the end of the loop's body, the loop steps without jumping back to
+    # its head first.
+    byte_JUMP_FOR_ITER_STORE = byte_FOR_ITER_STORE
+
+    ## Adds followed by stores
+
+    # CPython appends to a string in place when nothing else refers to it,
+    # and for `s += t` first drops the reference of the variable the result
+    # goes to.  The VM does the same: having popped the strings, it drops
+    # the variable's reference, then adds them with `x += y` on a local of
+    # its own, where the host's trick applies in turn, as nothing else
+    # refers to the string.
+
+    def byte_ADD_STORE_FAST(self, op, index):
+        frame = self.frame
+        stack = frame.stack
+        y = stack.pop()
+        x = stack.pop()
+        fast_locals = frame.fast_locals
+        if type(x) is str and type(y) is str:
+            if fast_locals[index] is x:
+                fast_locals[index] = UNBOUND
+            x += y
+        else:
+            x = self._operator_functions[op](x, y)
+        frame.f_lasti += 1
+        fast_locals[index] = x
+
+    def byte_ADD_STORE_NAME(self, op, name):
+        frame = self.frame
+        stack = frame.stack
+        y = stack.pop()
+        x = stack.pop()
+        f_locals = frame._locals
+        if type(x) is str and type(y) is str:
+            # Only a plain dict can be changed without anyone seeing.
+            if type(f_locals) is dict and f_locals.get(name) is x:
+                f_locals[name] = None
+            x += y
+        else:
+            x = self._operator_functions[op](x, y)
+        frame.f_lasti += 1
+        f_locals[name] = x
+
     ## And the rest...
 
     def byte_EXEC_STMT(self):
@@ -82,6 +82,37 @@ class TestIt(vmtest.VmTestCase):
             assert x == 0xA6
             """)
 
+    def test_operators_on_fast_locals(self):
+        self.assert_ok("""\
+            def f(x, y, items):
+                s = x + y
+                d = x - 1
+                p = s * 2.5
+                q = items[x]
+                x += y
+                y **= 2
+                n = 0
+                while n < x:
+                    n = n + 1
+                    if n % 2 == 0:
+                        items = items + [n]
+                    if items[0] != 'a':
+                        break
+                try:
+                    r = y // 0
+                except ZeroDivisionError as e:
+                    r = str(e)
+                return s, d, p, q, x, y, n, items, r
+            print(f(1, 2, ['a', 'b']))
+            print(f(0, 2.5, ['a']))
+            """)
+        self.assert_ok("""\
+            def f():
+                y = x + 1
+                x = 2
+            f()
+            """, raises=UnboundLocalError)
+
     if PY2:
         def test_inplace_division(self):
             self.assert_ok("""\
@@ -184,6 +215,19 @@ class TestIt(vmtest.VmTestCase):
         self.assert_ok("""\
             print({1:1+1, 2:2+2, 3:3+3})
             """)
+        self.assert_ok("""\
+            k = 'b'
+            print({'a': 1, k: 2, 'c': 3}, {'a': k, 'b': 4})
+            """)
+
+    def test_chained_comparisons(self):
+        self.assert_ok("""\
+            x, y = 3, 5
+            print(1 < x < y, 1 < y < x, x < y > 4 != 5)
+            a, b, c = 1, 2, 3
+            a, b, c = c, a, b
+            print(a, b, c)
+            """)
 
     def test_subscripting(self):
         self.assert_ok("""\
@@ -296,6 +340,81 @@ class TestIt(vmtest.VmTestCase):
             f()
             """, raises=NameError)
 
+    def test_shadowing_builtins(self):
+        self.assert_ok("""\
+            try:
+                import builtins
+            except ImportError:
+                import __builtin__ as builtins
+            def f():
+                return len([1, 2])
+            for _ in range(3):
+                print(f(), len([1]))
+                len = lambda x: 42
+                print(f(), len([1]))
+                globals()['len'] = lambda x: 17
+                print(f(), len([1]))
+                del len
+                print(f(), len([1]))
+            def g():
+                return fooey
+            builtins.fooey = 1
+            print(g(), fooey)
+            globals()['fooey'] = 2
+            print(g(), fooey)
+            del globals()['fooey']
+            del builtins.fooey
+            g()
+            """, raises=NameError)
+
+    def test_rebinding_globals(self):
+        self.assert_ok("""\
+            value = 1
+            def f():
+                return value
+            def rebind(new):
+                global value
+                value = new
+            def unbind():
+                global value
+                del value
+            for _ in range(3):
+                print(f())
+                rebind(2)
+                print(f())
+                globals().update(value=3)
+                print(f())
+                exec("value = 4", globals())
+                print(f())
+                globals().pop('value')
+                try:
+                    f()
+                except NameError:
+                    print('unbound')
+                value = 5
+                print(f())
+                unbind()
+                try:
+                    f()
+                except NameError:
+                    print('unbound')
+                value = 1
+            """)
+
+    def test_rebinding_module_attributes(self):
+        self.assert_ok("""\
+            import sys
+            module = type(sys)('module')
+            module.value = 1
+            exec('def get():\\n    return value', module.__dict__)
+            for value in range(2, 6):
+                print(module.get())
+                if value % 2:
+                    module.value = value
+                else:
+                    vars(module).update(value=value)
+            """)
+
     def test_import(self):
         self.assert_ok("""\
             import math
@@ -467,6 +586,45 @@ class TestIt(vmtest.VmTestCase):
             m(1815)
             """)
 
+    def test_method_calls(self):
+        self.assert_ok("""\
+            class Thing(object):
+                def meth(self, x):
+                    return x + 1
+                @staticmethod
+                def static(x):
+                    return x * 2
+                @classmethod
+                def klass(cls, x):
+                    return cls.__name__, x
+            class Sub(Thing):
+                def meth(self, x):
+                    return Thing.meth(self, x) * 10
+            t, s = Thing(), Sub()
+            print(t.meth(1), s.meth(2), t.static(3), s.klass(4))
+            print(t.meth(t.meth(1) if t else 0), Thing.meth(t, 5))
+            l = []
+            l.append(t.meth(6))
+            print(l, "a,b".split(","))
+            t.meth = lambda x: x - 1
+            print(t.meth(1), Thing().meth(1))
+            Sub.meth = None
+            try:
+                s.meth(1)
+            except TypeError as e:
+                print(e)
+            """)
+
+    def test_method_calls_with_getattribute(self):
+        self.assert_ok("""\
+            class Thing(object):
+                def meth(self):
+                    return "meth"
+                def __getattribute__(self, name):
+                    return lambda: "intercepted " + name
+            print(Thing().meth())
+            """)
+
     def test_callback(self):
         self.assert_ok("""\
             def lcase(s):
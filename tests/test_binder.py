@@ -0,0 +1,63 @@
+"""Tests of binding call arguments for Bytevm."""
+
+from __future__ import print_function
+
+import gc
+import types
+import unittest
+
+import six
+
+from bytevm.binder import (
+    ASYNC_GENERATOR, COROUTINE, GENERATOR, PLAIN, UNBOUND, _binders,
+    get_binder,
+)
+
+
+def function_code(source):
+    """Compile `source`, and get the code of the function it defines."""
+    for const in compile(source, "<binder>", "exec").co_consts:
+        if isinstance(const, types.CodeType):
+            return const
+
+
+class TestBinder(unittest.TestCase):
+    def test_binder_is_shared(self):
+        code = function_code("def fn(a): pass")
+        self.assertIs(get_binder(code), get_binder(code))
+
+    def test_binder_is_evicted_with_its_code(self):
+        code = function_code("def fn(a): pass")
+        get_binder(code)
+        key = id(code)
+        self.assertIn(key, _binders)
+        del code
+        gc.collect()
+        self.assertNotIn(key, _binders)
+
+    def test_fast_locals_layout(self):
+        code = function_code("def fn(a, b=2, *args, **kwargs): c = 1")
+        fast = get_binder(code).bind((1, 2, 3), {'d': 4}, (2,), None)
+        self.assertEqual(fast[:4], [1, 2, (3,), {'d': 4}])
+        self.assertIs(fast[4], UNBOUND)
+        self.assertEqual(len(fast), code.co_nlocals)
+
+    def test_defaults(self):
+        code = function_code("def fn(a, b=2, c=3): pass")
+        self.assertEqual(get_binder(code).bind((1,), {'c': 5}, (2, 3), None), [1, 2, 5])
+
+    def test_frame_kinds(self):
+        self.assertEqual(get_binder(function_code("def fn(): pass")).kind, PLAIN)
+        self.assertEqual(get_binder(function_code("def fn(): yield")).kind, GENERATOR)
+
+    if six.PY3:
+        def test_keyword_only_defaults(self):
+            code = function_code("def fn(a, *, b, c=3): pass")
+            self.assertEqual(get_binder(code).bind((1,), {'b': 2}, None, {'c': 3}), [1, 2, 3])
+
+        def test_coroutine_kinds(self):
+            self.assertEqual(get_binder(function_code("async def fn(): pass")).kind, COROUTINE)
+            self.assertEqual(
+                get_binder(function_code("async def fn(): yield")).kind,
+                ASYNC_GENERATOR,
+            )
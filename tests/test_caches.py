@@ -0,0 +1,219 @@
+"""Tests of inline caches for Bytevm."""
+
+from __future__ import print_function
+
+import unittest
+
+from bytevm.caches import (
+    FUNCTION, METHOD, NATIVE, SLOT, TYPE, AttrCache,
+    CallSite, cache_stats, classes_changed,
+)
+from bytevm.program import get_program, opmap
+from bytevm.pyvm2 import VirtualMachine
+
+
+class CacheTestCase(unittest.TestCase):
+    def run_source(self, source, superinstructions=False):
+        """Run `source`, and return the program of its function `fn`."""
+        vm = VirtualMachine(superinstructions=superinstructions)
+        f_globals = self.f_globals = {'__builtins__': __builtins__}
+        vm.run_code(compile(source, "<test>", "exec"), f_globals=f_globals)
+        return get_program(f_globals['fn'].func_code, superinstructions)
+
+
+class TestCallSites(CacheTestCase):
+    def test_monomorphic_sites(self):
+        for superinstructions in [False, True]:
+            program = self.run_source("""\
+class C(object):
+    def method(self):
+        return self
+def helper(x):
+    return x
+def fn():
+    method = C().method
+    for i in range(10):
+        helper(i)
+        len("abc")
+        method()
+for _ in range(3):
+    fn()
+""", superinstructions)
+            sites = [site for _, site in cache_stats(program, CallSite)]
+            kinds = [list(site.kinds.values()) for site in sites]
+            self.assertIn([FUNCTION], kinds)
+            self.assertIn([METHOD], kinds)
+            self.assertIn([NATIVE], kinds)
+            for site in sites:
+                self.assertEqual(site.misses, 1)
+                self.assertFalse(site.megamorphic)
+            loop_sites = [site for site in sites if site.hits + site.misses == 30]
+            self.assertEqual(len(loop_sites), 3)
+
+    def test_megamorphic_site(self):
+        program = self.run_source("""\
+class A(object):
+    def __call__(self):
+        pass
+class B(A): pass
+class D(A): pass
+def f(): pass
+def fn(callables):
+    for c in callables:
+        c()
+fn([f, list, A(), B(), D()] * 2)
+""")
+        # Five types are called, and the site only learns the first four.
+        [(_, site)] = cache_stats(program, CallSite)
+        self.assertTrue(site.megamorphic)
+        self.assertEqual(len(site.kinds), CallSite.limit)
+        self.assertEqual(site.misses, 4 + 2)
+        self.assertEqual(site.hits, 4)
+
+
+@unittest.skipUnless('LOAD_METHOD' in opmap, "no LOAD_METHOD to cache")
+class TestAttrCaches(CacheTestCase):
+    def method_caches(self, program):
+        """Get the AttrCaches of `program`'s LOAD_METHODs, in order."""
+        return [cache for _, cache in cache_stats(program, AttrCache)]
+
+    def test_polymorphic_methods(self):
+        program = self.run_source("""\
+class A(object):
+    def get(self):
+        return 1
+class B(A):
+    pass
+class S(object):
+    __slots__ = ['get']
+class K(object):
+    @classmethod
+    def get(cls):
+        return 4
+def fn(objs):
+    total = 0
+    for obj in objs:
+        total += obj.get()
+    return total
+s = S()
+s.get = lambda: 2
+shadowed = B()
+shadowed.get = lambda: 3
+result = fn([A(), B(), s, shadowed, K])
+""")
+        [cache] = self.method_caches(program)
+        kinds = dict(
+            (cls.__name__, kind) for cls, kind in cache.kinds.items()
+        )
+        # Instances of A have a __dict__, which might shadow the method.
+        self.assertEqual(kinds['A'], kinds['B'])
+        [method] = kinds['A']
+        self.assertEqual(method.__name__, 'get')
+        self.assertEqual(kinds['S'], SLOT)
+        self.assertEqual(kinds['type'], TYPE)
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+        self.assertFalse(cache.megamorphic)
+        self.assertEqual(self.f_globals['result'], 1 + 1 + 2 + 3 + 4)
+
+    def test_methods_of_slotted_objects(self):
+        program = self.run_source("""\
+class S(object):
+    __slots__ = ['value']
+    def __init__(self):
+        self.value = 1
+    def get(self):
+        return self.value
+    def __getattr__(self, name):
+        looked_up.append(name)
+        raise AttributeError(name)
+looked_up = []
+def fn(obj):
+    total = 0
+    for i in range(3):
+        total += obj.get()
+    return total
+result = fn(S())
+""")
+        # With no __dict__ to shadow it, the method is used without looking
+        # further, and __getattr__ isn't asked for a __dict__.
+        [cache] = self.method_caches(program)
+        [kind] = cache.kinds.values()
+        self.assertEqual(kind.__name__, 'get')
+        self.assertEqual(self.f_globals['result'], 3)
+        self.assertEqual(self.f_globals['looked_up'], [])
+
+    def test_caches_are_made_when_methods_load(self):
+        program = self.run_source("""\
+def fn(obj, loaded):
+    if loaded:
+        return obj.get()
+    return obj.put()
+class A(object):
+    def get(self):
+        return 1
+result = fn(A(), True)
+""")
+        [(index, cache)] = cache_stats(program, AttrCache)
+        self.assertEqual(program.instruction(index), ('LOAD_METHOD', ('get',)))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_megamorphic_method_load(self):
+        program = self.run_source("""\
+class A(object):
+    def get(self):
+        return 'A'
+class B(A): pass
+class C(A): pass
+class D(A): pass
+class E(A): pass
+def fn(objs):
+    names = ''
+    for obj in objs:
+        names += obj.get()
+    return names
+result = fn([A(), B(), C(), D(), E(), A()])
+""")
+        # Five types are seen, and the cache only learns the first four.
+        [cache] = self.method_caches(program)
+        self.assertTrue(cache.megamorphic)
+        self.assertEqual(len(cache.kinds), AttrCache.limit)
+        self.assertEqual((cache.hits, cache.misses), (1, 5))
+        self.assertEqual(self.f_globals['result'], 'AAAAAA')
+
+    def test_changing_classes(self):
+        f_globals = {'__builtins__': __builtins__}
+        vm = VirtualMachine()
+        vm.run_code(compile("""\
+class A(object):
+    def get(self):
+        return 'A.get'
+class B(A):
+    pass
+def fn(obj):
+    return obj.get()
+results = [fn(B())]
+B.get = lambda self: 'B.get'
+results.append(fn(B()))
+del B.get
+results.append(fn(B()))
+setattr(A, 'get', lambda self: 'lambda')
+results.append(fn(B()))
+type.__setattr__(B, 'get', lambda self: 'type.__setattr__')
+results.append(fn(B()))
+type.__delattr__(B, 'get')
+results.append(fn(B()))
+""", "<test>", "exec"), f_globals=f_globals)
+        self.assertEqual(f_globals['results'], [
+            'A.get', 'B.get', 'A.get', 'lambda', 'type.__setattr__', 'lambda',
+        ])
+
+        # Host code changing a class must say so.
+        def get(self):
+            return 'host'
+        f_globals['A'].get = get
+        classes_changed()
+        self.assertEqual(f_globals['fn'](f_globals['B']()), 'host')
+
+        program = get_program(f_globals['fn'].func_code)
+        [cache] = self.method_caches(program)
+        self.assertEqual(cache.misses, 7)
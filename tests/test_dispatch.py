@@ -0,0 +1,63 @@
+"""Tests of opcode dispatch for Bytevm."""
+
+from __future__ import print_function
+
+import unittest
+
+from bytevm.program import opname
+from bytevm.pyvm2 import VirtualMachine
+
+
+class CountingVM(VirtualMachine):
+    loads = 0
+
+    def byte_LOAD_CONST(self, const):
+        CountingVM.loads += 1
+        super(CountingVM, self).byte_LOAD_CONST(const)
+
+
+class TestDispatchTable(unittest.TestCase):
+    def test_table_is_built_once_per_class(self):
+        self.assertIs(
+            VirtualMachine.dispatch_table(), VirtualMachine.dispatch_table()
+        )
+        self.assertEqual(len(VirtualMachine.dispatch_table()), len(opname))
+
+    def test_subclass_overrides_are_dispatched(self):
+        self.assertIsNot(
+            CountingVM.dispatch_table(), VirtualMachine.dispatch_table()
+        )
+        CountingVM.loads = 0
+        code = compile("x = 1\ny = 2\n", "<test>", "exec")
+        CountingVM().run_code(code)
+        # Two assignments, and the implicit `return None`.
+        self.assertEqual(CountingVM.loads, 3)
+
+    def test_operator_families_are_dispatched(self):
+        code = compile("x = -(3 + 4)\nx *= 2\n", "<test>", "exec")
+        f_globals = {'__builtins__': __builtins__}
+        VirtualMachine().run_code(code, f_globals=f_globals)
+        self.assertEqual(f_globals['x'], -14)
+
+
+class TestRunLoops(unittest.TestCase):
+    SOURCE = "x = 0\nfor i in range(3):\n    x += i\n"
+
+    def run_source(self, **kwargs):
+        f_globals = {'__builtins__': __builtins__}
+        code = compile(self.SOURCE, "<test>", "exec")
+        VirtualMachine(**kwargs).run_code(code, f_globals=f_globals)
+        return f_globals['x']
+
+    def test_lean_loop_keeps_no_books(self):
+        steps = VirtualMachine.steps
+        self.assertEqual(self.run_source(), 3)
+        self.assertEqual(VirtualMachine.steps, steps)
+
+    def test_tracing_loop_counts_and_logs(self):
+        steps = VirtualMachine.steps
+        with self.assertLogs('bytevm.pyvm2', level='INFO') as logs:
+            self.assertEqual(self.run_source(trace=True), 3)
+        self.assertGreater(VirtualMachine.steps, steps)
+        self.assertTrue(any('make_frame' in line for line in logs.output))
+        self.assertTrue(any('INPLACE_ADD' in line for line in logs.output))
@@ -0,0 +1,191 @@
+"""Tests of frames for Bytevm."""
+
+from __future__ import print_function
+
+import sys
+import types
+import unittest
+
+from bytevm import pyobj
+from bytevm.pyvm2 import VirtualMachine
+
+
+class TestFramePool(unittest.TestCase):
+    def run_source(self, source, vm=None):
+        vm = vm or VirtualMachine()
+        f_globals = {'__builtins__': __builtins__}
+        vm.run_code(compile(source, "<test>", "exec"), f_globals=f_globals)
+        return vm, f_globals
+
+    def test_retired_frames_are_reused(self):
+        vm, f_globals = self.run_source(
+            "def fib(n):\n"
+            "    return n if n < 2 else fib(n-1) + fib(n-2)\n"
+            "result = fib(10)\n"
+        )
+        self.assertEqual(f_globals['result'], 55)
+        code = f_globals['fib'].func_code
+        pool = vm.frame_pool[id(code)]
+        # Only as many frames as the deepest recursion were ever needed.
+        self.assertEqual(len(pool), 10)
+        for frame in pool:
+            self.assertIsNone(frame.fast_locals)
+            self.assertIsNone(frame.f_back)
+            self.assertEqual(frame.stack, [])
+
+    def test_pool_is_bounded(self):
+        vm = VirtualMachine()
+        vm.max_pooled_frames = 3
+        vm, f_globals = self.run_source(
+            "def down(n):\n"
+            "    return n and down(n-1)\n"
+            "down(10)\n",
+            vm,
+        )
+        self.assertEqual(len(vm.frame_pool[id(f_globals['down'].func_code)]), 3)
+
+    def test_generator_frames_are_not_reused(self):
+        vm, f_globals = self.run_source(
+            "def gen():\n"
+            "    yield 1\n"
+            "result = list(gen())\n"
+        )
+        self.assertEqual(f_globals['result'], [1])
+        self.assertNotIn(id(f_globals['gen'].func_code), vm.frame_pool)
+
+    def test_callbacks_reuse_one_frame(self):
+        vm, f_globals = self.run_source(
+            "def key(x):\n"
+            "    return -x\n"
+            "result = sorted(range(100), key=key)\n"
+        )
+        self.assertEqual(f_globals['result'], list(range(99, -1, -1)))
+        self.assertEqual(len(vm.frame_pool[id(f_globals['key'].func_code)]), 1)
+
+    def test_frames_in_tracebacks_are_not_reused(self):
+        vm, f_globals = self.run_source(
+            "def fail():\n"
+            "    raise ValueError('x')\n"
+            "def catch():\n"
+            "    try:\n"
+            "        fail()\n"
+            "    except ValueError:\n"
+            "        return 1\n"
+            "catch()\n"
+        )
+        self.assertNotIn(id(f_globals['fail'].func_code), vm.frame_pool)
+        # The caller is reachable from the traceback through f_back.
+        self.assertNotIn(id(f_globals['catch'].func_code), vm.frame_pool)
+
+
+class TestRuntimeObjects(unittest.TestCase):
+    def test_objects_have_no_dict(self):
+        vm = VirtualMachine()
+        f_globals = {'__builtins__': __builtins__}
+        code = compile("def fn(a):\n    return a\n", "<test>", "exec")
+        vm.run_code(code, f_globals=f_globals)
+        fn_code = f_globals['fn'].func_code
+        frame = vm.make_frame(fn_code, {'a': 1}, f_globals, {})
+        tb = pyobj.traceback(frame, 3)
+        objects = [
+            frame, tb, pyobj.Cell(1), pyobj.Block('loop', 4, 0),
+            pyobj.Method(None, object, f_globals['fn']),
+            pyobj.Generator(frame, vm),
+        ]
+        for obj in objects:
+            self.assertFalse(hasattr(obj, '__dict__'), obj)
+        self.assertIs(frame.f_code, fn_code)
+        self.assertEqual(frame.f_lasti, 0)
+        self.assertEqual(frame.f_locals, {'a': 1})
+        self.assertIs(tb.tb_frame, frame)
+        self.assertEqual(tb.tb_lasti, 3)
+
+    def test_host_function_is_made_lazily(self):
+        vm = VirtualMachine()
+        f_globals = {'__builtins__': __builtins__}
+        code = compile(
+            "def outer(x):\n"
+            "    def inner(y=2):\n"
+            "        return x + y\n"
+            "    return inner\n"
+            "inner = outer(1)\n",
+            "<test>", "exec",
+        )
+        vm.run_code(code, f_globals=f_globals)
+        inner = f_globals['inner']
+        self.assertIsNone(inner._host_func)
+        self.assertEqual(inner.__name__, 'inner')
+        self.assertIsNone(inner._host_func)
+        func = inner._func
+        self.assertIsInstance(func, types.FunctionType)
+        self.assertIs(func.__code__, inner.func_code)
+        self.assertEqual(func.__defaults__, (2,))
+        self.assertEqual(len(func.__closure__), 1)
+        self.assertIs(inner._func, func)
+
+
+class TestStackless(unittest.TestCase):
+    DEPTH = """\
+def depth(n):
+    if n == 0:
+        return 0
+    return depth(n - 1) + 1
+"""
+
+    def run_source(self, source, **kwargs):
+        vm = VirtualMachine(**kwargs)
+        f_globals = {'__builtins__': __builtins__}
+        vm.run_code(compile(source, "<test>", "exec"), f_globals=f_globals)
+        return f_globals
+
+    def test_recursion_deeper_than_the_host(self):
+        depth = 3 * sys.getrecursionlimit()
+        f_globals = self.run_source(
+            self.DEPTH + "result = depth(%d)\n" % depth,
+            stackless=True, recursion_limit=depth + 10,
+        )
+        self.assertEqual(f_globals['result'], depth)
+
+    def test_recursion_limit(self):
+        for stackless in [False, True]:
+            f_globals = self.run_source(
+                self.DEPTH +
+                "try:\n"
+                "    depth(100)\n"
+                "except RecursionError as e:\n"
+                "    error = str(e)\n"
+                "result = depth(40)\n",
+                stackless=stackless, recursion_limit=50,
+            )
+            self.assertEqual(f_globals['error'], "maximum recursion depth exceeded")
+            self.assertEqual(f_globals['result'], 40)
+
+    def test_calls_do_not_nest_run_instructions(self):
+        source = self.DEPTH + "result = depth(20)\n"
+        for stackless, expected in [(False, 22), (True, 1)]:
+            vm = VirtualMachine(stackless=stackless)
+            depths = [0]
+            running = []
+            run_instructions = vm.run_instructions
+            def counting_run_instructions(frame):
+                running.append(frame)
+                depths.append(len(running))
+                try:
+                    return run_instructions(frame)
+                finally:
+                    running.pop()
+            vm.run_instructions = counting_run_instructions
+            vm.run_code(compile(source, "<test>", "exec"))
+            self.assertEqual(max(depths), expected)
+            self.assertEqual(vm.frames, [])
+
+    def test_native_callbacks_reenter(self):
+        f_globals = self.run_source(
+            "def key(x):\n"
+            "    return -x\n"
+            "def sort(items):\n"
+            "    return sorted(items, key=key)\n"
+            "result = sort([2, 3, 1])\n",
+            stackless=True,
+        )
+        self.assertEqual(f_globals['result'], [3, 2, 1])
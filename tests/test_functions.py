@@ -1,9 +1,14 @@
 """Test functions etc, for Bytevm."""
 
 from __future__ import print_function
+import gc
+import unittest
+
 from . import vmtest
 import six
 
+from bytevm.pyvm2 import VirtualMachine
+
 PY3 = six.PY3
 
 
@@ -139,6 +144,163 @@ class TestFunctions(vmtest.VmTestCase):
             assert example() == 17
             """)
 
+    def test_locals(self):
+        self.assert_ok("""\
+            def fn(a, b=17):
+                c = a + b
+                del a
+                return sorted(locals().items())
+            print(fn(1))
+            """)
+
+    def test_deleted_local(self):
+        self.assert_ok("""\
+            def fn():
+                x = 1
+                del x
+                return x
+            fn()
+            """, raises=UnboundLocalError)
+
+    def test_argument_in_closure(self):
+        self.assert_ok("""\
+            def fn(a, b=2):
+                def inner():
+                    return a + b
+                return inner
+            print(fn(1)(), fn(b=5, a=3)())
+            """)
+
+    def test_native_callbacks(self):
+        self.assert_ok("""\
+            import functools
+            def key(x):
+                return -x
+            def add(a, b, c=0):
+                return a + b + c
+            def fussy(x):
+                if x == 3:
+                    raise ValueError(x)
+                return x
+            print(sorted(range(10), key=key))
+            print(list(map(add, [1, 2], [3, 4])))
+            print(list(map(add, [1, 2], [3, 4], [5, 6])))
+            print(functools.reduce(add, range(10)))
+            print(functools.partial(add, c=7)(1, 2))
+            try:
+                list(map(fussy, range(5)))
+            except ValueError as e:
+                print("error", e)
+            print(list(map(fussy, range(3))))
+            try:
+                list(map(key, [1], [2]))
+            except TypeError as e:
+                print(e)
+            """)
+
+    if PY3:
+        def test_qualname(self):
+            self.assert_ok("""\
+                def outer():
+                    def inner():
+                        pass
+                    return inner
+                print(getattr(outer, '__qualname__'))
+                print(getattr(outer(), '__qualname__'))
+                """)
+
+        def test_keyword_only_arguments(self):
+            self.assert_ok("""\
+                def fn(a, *args, b, c=3, **kwargs):
+                    print(a, args, b, c, sorted(kwargs.items()))
+                fn(1, b=2)
+                fn(1, 2, 3, b=4, c=5, d=6)
+                fn(b=1, a=2, e=7)
+                """)
+
+        def test_bad_calls(self):
+            self.assert_ok("""\
+                def none(): pass
+                def one(a): pass
+                def three(a, b, c): pass
+                def dflt(a, b=2, c=3): pass
+                def kwonly(a, *, b, c, d=4): pass
+                def star(a, *args, b): pass
+                calls = [
+                    lambda: none(1),
+                    lambda: one(),
+                    lambda: one(1, 2),
+                    lambda: three(),
+                    lambda: three(1),
+                    lambda: three(1, 2, 3, 4),
+                    lambda: three(1, a=1),
+                    lambda: three(1, 2, 3, d=4),
+                    lambda: dflt(),
+                    lambda: dflt(1, 2, 3, 4),
+                    lambda: kwonly(1),
+                    lambda: kwonly(1, 2),
+                    lambda: kwonly(1, 2, b=1),
+                    lambda: kwonly(1, 2, b=1, c=2),
+                    lambda: kwonly(b=1, c=2),
+                    lambda: star(1, 2),
+                    lambda: three(x=1, y=2),
+                ]
+                for call in calls:
+                    try:
+                        call()
+                    except TypeError as e:
+                        print(e)
+                """)
+
+
+def host_add(a, b=1):
+    return a + b
+
+
+def host_sub(a, b=1):
+    return a - b
+
+
+class TestHostFunctions(unittest.TestCase):
+    def run_calls(self, vm, func):
+        f_globals = {'__builtins__': __builtins__, 'func': func}
+        source = "results = [func(i) for i in range(3)]\n"
+        vm.run_code(compile(source, "<test>", "exec"), f_globals=f_globals)
+        return f_globals['results']
+
+    def test_wrapper_is_reused(self):
+        vm = VirtualMachine()
+        self.assertEqual(self.run_calls(vm, host_add), [1, 2, 3])
+        wrapper = vm.host_function(host_add)
+        self.assertIs(wrapper.func_code, host_add.__code__)
+        self.assertEqual(self.run_calls(vm, host_add), [1, 2, 3])
+        self.assertIs(vm.host_function(host_add), wrapper)
+
+    def test_wrapper_follows_changes(self):
+        def func(a, b=1):
+            return a + b
+        vm = VirtualMachine()
+        self.assertEqual(self.run_calls(vm, func), [1, 2, 3])
+        func.__defaults__ = (10,)
+        self.assertEqual(self.run_calls(vm, func), [10, 11, 12])
+        func.__code__ = host_sub.__code__
+        self.assertEqual(self.run_calls(vm, func), [-10, -9, -8])
+        if PY3:
+            func.__kwdefaults__ = {}
+            self.assertEqual(self.run_calls(vm, func), [-10, -9, -8])
+            wrapper = vm.host_function(func)
+            self.assertIs(wrapper.func_kwdefaults, func.__kwdefaults__)
+
+    def test_wrapper_dies_with_its_function(self):
+        def func(a):
+            return a
+        vm = VirtualMachine()
+        self.run_calls(vm, func)
+        self.assertEqual(len(vm.host_functions), 1)
+        del func
+        gc.collect()
+        self.assertEqual(len(vm.host_functions), 0)
+
 
 class TestClosures(vmtest.VmTestCase):
     def test_closures(self):
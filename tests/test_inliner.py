@@ -0,0 +1,230 @@
+"""Tests of inlining calls in Bytevm."""
+
+from __future__ import print_function
+
+import unittest
+
+from bytevm.inliner import inline_body
+from bytevm.program import get_program, opmap
+from bytevm.pyvm2 import VirtualMachine
+
+from . import vmtest
+
+
+class InliningTestCase(unittest.TestCase):
+    def run_source(self, source, superinstructions=False):
+        """Run `source` inlining calls, and return the VM and its globals."""
+        vm = VirtualMachine(superinstructions=superinstructions, inlining=True)
+        f_globals = {'__builtins__': __builtins__}
+        vm.run_code(compile(source, "<test>", "exec"), f_globals=f_globals)
+        return vm, f_globals
+
+    def outcomes(self, vm):
+        return [(d.callee, d.outcome) for d in vm.inlining_decisions]
+
+
+class TestInlining(InliningTestCase):
+    def test_hot_call_is_inlined(self):
+        for superinstructions in [False, True]:
+            vm, f_globals = self.run_source("""\
+def add(a, b):
+    return a + b
+def fn(n):
+    total = 0
+    for i in range(n):
+        total = add(total, i)
+    return total
+result = fn(100)
+""", superinstructions)
+            self.assertEqual(f_globals['result'], sum(range(100)))
+            self.assertEqual(self.outcomes(vm), [('add', 'inlined')])
+            self.assertEqual(vm.inlining_decisions[0].line, 6)
+            program = get_program(f_globals['fn'].func_code, superinstructions)
+            self.assertIn(opmap['CALL_INLINED'], program.opcodes)
+
+    def test_parameters_used_out_of_order(self):
+        vm, f_globals = self.run_source("""\
+def norm(x, y):
+    return y * y - x
+def fn(n):
+    return [norm(i, 2 * i) for i in range(n)]
+result = fn(50)
+""")
+        self.assertEqual(f_globals['result'], [4 * i * i - i for i in range(50)])
+        self.assertEqual(self.outcomes(vm), [('norm', 'inlined')])
+
+    def test_methods_are_inlined(self):
+        vm, f_globals = self.run_source("""\
+class Point(object):
+    def __init__(self, x):
+        self.x = x
+    def get_x(self):
+        return self.x
+def fn(points):
+    return [p.get_x() for p in points]
+result = fn([Point(i) for i in range(50)])
+""")
+        self.assertEqual(f_globals['result'], list(range(50)))
+        self.assertIn(('get_x', 'inlined'), self.outcomes(vm))
+
+    def test_functions_found_as_attributes_are_inlined(self):
+        # LOAD_METHOD pushes NULL below a Function that isn't a method of
+        # its object, which the inlined call has to drop.
+        source = """\
+import types
+class K(object):
+    def st(x):
+        return x * 3
+module = types.ModuleType('module')
+module.st = K.st
+obj = K()
+obj.st = K.st
+def fn(n):
+    total = 0
+    for i in range(n):
+        total += K.st(i) + module.st(i) + obj.st(i)
+    return total
+result = fn(50)
+"""
+        for superinstructions in [False, True]:
+            vm, f_globals = self.run_source(source, superinstructions)
+            self.assertEqual(f_globals['result'], 3 * 3675)
+            self.assertEqual(self.outcomes(vm), [('st', 'inlined')] * 3)
+
+    def test_rebinding_the_global_deoptimizes(self):
+        vm, f_globals = self.run_source("""\
+def double(x):
+    return x * 2
+def fn(n):
+    global double
+    results = []
+    for i in range(n):
+        if i == 30:
+            def double(x):
+                return x * 3
+        results.append(double(i))
+    return results
+result = fn(40)
+""")
+        self.assertEqual(
+            f_globals['result'],
+            [i * 2 for i in range(30)] + [i * 3 for i in range(30, 40)],
+        )
+        self.assertEqual(
+            self.outcomes(vm), [('double', 'inlined'), ('double', 'deoptimized')]
+        )
+        program = get_program(f_globals['fn'].func_code)
+        self.assertNotIn(opmap['CALL_INLINED'], program.opcodes)
+
+    def test_replacing_the_code_deoptimizes(self):
+        vm, f_globals = self.run_source("""\
+def inc(x):
+    return x + 1
+def dec(x):
+    return x - 1
+def fn(n):
+    results = []
+    for i in range(n):
+        if i == 20:
+            inc.func_code = dec.func_code
+        results.append(inc(i))
+    return results
+result = fn(30)
+""")
+        self.assertEqual(
+            f_globals['result'],
+            [i + 1 for i in range(20)] + [i - 1 for i in range(20, 30)],
+        )
+        self.assertEqual(
+            self.outcomes(vm), [('inc', 'inlined'), ('inc', 'deoptimized')]
+        )
+
+    def test_exceptions_in_inlined_calls(self):
+        vm, f_globals = self.run_source("""\
+def inverse(x):
+    return 1 / x
+def fn(n):
+    results = []
+    for i in range(n, -n, -1):
+        try:
+            results.append(inverse(i))
+        except ZeroDivisionError:
+            results.append(None)
+    return results
+result = fn(20)
+""")
+        expected = [1 / i if i else None for i in range(20, -20, -1)]
+        self.assertEqual(f_globals['result'], expected)
+        self.assertEqual(self.outcomes(vm), [('inverse', 'inlined')])
+
+    def test_cold_and_unstable_calls_are_not_inlined(self):
+        vm, f_globals = self.run_source("""\
+def f(x):
+    return x
+def g(x):
+    return x
+def fn(n):
+    for i in range(n):
+        (f if i % 2 else g)(i)
+    for i in range(5):
+        f(i)
+fn(100)
+""")
+        self.assertEqual(self.outcomes(vm), [])
+
+
+class TestInlineBody(unittest.TestCase):
+    def body_of(self, source):
+        """Compile `source`, and get the inline body of its function `fn`."""
+        f_globals = {}
+        exec(compile(source, "<test>", "exec"), f_globals)
+        return inline_body(f_globals['fn'].__code__)
+
+    def test_rejected_functions(self):
+        for source, reason in [
+            ("def fn(x):\n    return g(x)\n", "uses LOAD_GLOBAL"),
+            ("def fn(x):\n    y = x\n    return y\n", "uses STORE_FAST"),
+            ("def fn(x):\n    yield x\n", "generator"),
+            ("def fn(*args):\n    return args\n",
+             "not only positional parameters"),
+            ("def fn(x):\n    return lambda: x\n", "closure"),
+            ("def fn(x):\n    return x.a + x.b + x.c + x.d + x.e\n",
+             "too long"),
+            ("def fn(x):\n    return 1 if x else 2\n", "uses POP_JUMP_IF_FALSE"),
+        ]:
+            self.assertEqual(self.body_of(source), (None, reason))
+
+    def test_body(self):
+        body, reason = self.body_of("def fn(x, y):\n    return y - x\n")
+        self.assertIsNone(reason)
+        self.assertEqual(body, ((None, 1), (None, 0), (opmap['BINARY_SUBTRACT'], ())))
+
+
+class TestInlinedBehaviour(vmtest.VmTestCase):
+    def test_inlined_calls_behave(self):
+        self.assert_ok("""\
+            class Box(object):
+                def __init__(self, value):
+                    self.value = value
+                def get(self):
+                    return self.value
+            def twice(x):
+                return x * 2
+            boxes = [Box(i) for i in range(40)]
+            total = 0
+            for i, box in enumerate(boxes):
+                if i == 25:
+                    twice = lambda x: x * 4
+                    Box.get = lambda self: -self.value
+                total += twice(box.get())
+            print(total)
+            """)
+
+    def test_inlined_call_raising(self):
+        self.assert_ok("""\
+            def index(seq, i):
+                return seq[i]
+            seq = list(range(20))
+            for i in range(30):
+                print(index(seq, i))
+            """, raises=IndexError)
@@ -0,0 +1,230 @@
+"""Tests of the peephole optimizer in Bytevm."""
+
+from __future__ import print_function
+
+import dis
+import unittest
+
+from bytevm.peephole import JUMPS, UNCONDITIONAL_JUMPS, format_report, report
+from bytevm.program import get_program
+from bytevm.pyvm2 import VirtualMachine
+
+from . import vmtest
+
+
+def function_code(source, name='f'):
+    """Compile `source`, and get the code of the function `name` in it."""
+    code = compile(source, "<test>", "exec")
+    for const in code.co_consts:
+        if getattr(const, 'co_name', None) == name:
+            return const
+
+
+class TestPeephole(unittest.TestCase):
+    def optimize(self, source, name='f'):
+        """Get the plain and the optimized programs of function `name`."""
+        code = function_code(source, name)
+        return get_program(code), get_program(code, peephole=True)
+
+    def names(self, program):
+        return [program.instruction(i)[0] for i in range(len(program))]
+
+    def test_long_sequences_are_folded(self):
+        plain, optimized = self.optimize("""\
+def f():
+    return '-' * 60
+""")
+        self.assertEqual(self.names(optimized), ['LOAD_CONST', 'RETURN_VALUE'])
+        self.assertEqual(optimized.instruction(0)[1], ('-' * 60,))
+        self.assertEqual(optimized.optimizations.folded, 2)
+        self.assertEqual(list(optimized.lines), list(plain.lines)[-2:])
+
+    def test_failing_and_huge_folds_are_left(self):
+        plain, optimized = self.optimize("""\
+def f():
+    return 1 / 0, 2 ** 1000, 'x' * 10000, '%5s' % 'x'
+""")
+        self.assertEqual(self.names(optimized), self.names(plain))
+        self.assertEqual(optimized.optimizations.folded, 0)
+
+    def test_constant_conditions_drop_dead_branches(self):
+        plain, optimized = self.optimize("""\
+def f(a):
+    if not 1 > 2:
+        return a
+    return -a
+""")
+        self.assertEqual(
+            self.names(optimized), ['LOAD_FAST', 'RETURN_VALUE'],
+        )
+        self.assertEqual(optimized.optimizations.folded, 4)
+        self.assertEqual(optimized.optimizations.unreachable, 3)
+
+    def test_jumps_are_threaded(self):
+        plain, optimized = self.optimize("""\
+def f(a, b):
+    for x in a:
+        if x:
+            if b:
+                continue
+        else:
+            pass
+    return x
+""")
+        self.assertGreater(optimized.optimizations.threaded, 0)
+        self.assertLess(len(optimized), len(plain))
+        for i in range(len(optimized)):
+            op = optimized.opcodes[i]
+            if op in JUMPS and op != dis.opmap['SETUP_LOOP']:
+                target = optimized.arguments[optimized.operands[i]][0]
+                self.assertNotIn(optimized.opcodes[target], UNCONDITIONAL_JUMPS)
+
+    def test_stores_only_returned_are_collapsed(self):
+        plain, optimized = self.optimize("""\
+def f(a):
+    x = a + 1
+    return x
+""")
+        self.assertNotIn('STORE_FAST', self.names(optimized))
+        self.assertEqual(optimized.optimizations.redundant, 2)
+
+        # A finally clause could see the local, so it stays.
+        plain, optimized = self.optimize("""\
+def f(a):
+    try:
+        x = a + 1
+        return x
+    finally:
+        print(x)
+""")
+        self.assertEqual(self.names(optimized), self.names(plain))
+
+    def test_packing_and_unpacking_is_a_permutation(self):
+        plain, optimized = self.optimize("""\
+def f(a, b, c, d):
+    a, b, c, d = d, c, b, a
+    return a, b, c, d
+""")
+        names = self.names(optimized)
+        self.assertNotIn('UNPACK_SEQUENCE', names)
+        self.assertEqual(names.count('REVERSE_N'), 1)
+        self.assertEqual(optimized.optimizations.containers, 1)
+
+    def test_call_arguments_are_passed_directly(self):
+        plain, optimized = self.optimize("""\
+def f(g, x, a, k):
+    g(x, *a, **k)
+    g(x, y=1, **k)
+    g(*a, **k)
+""")
+        names = self.names(optimized)
+        for name in ['BUILD_TUPLE', 'BUILD_TUPLE_UNPACK_WITH_CALL',
+                     'BUILD_MAP_UNPACK_WITH_CALL']:
+            self.assertNotIn(name, names)
+        self.assertEqual(names.count('CALL_FUNCTION_ARGS'), 2)
+        self.assertEqual(names.count('CALL_FUNCTION_EX'), 1)
+        self.assertEqual(optimized.optimizations.containers, 4)
+
+    def test_arguments_across_jumps_are_left(self):
+        plain, optimized = self.optimize("""\
+def f(g, x, a, k):
+    return g(x, *(a if x else k))
+""")
+        self.assertEqual(self.names(optimized), self.names(plain))
+
+    def test_report(self):
+        code = compile("""\
+def f():
+    return '=' * 40
+def g():
+    return 1
+f()
+""", "<test>", "exec")
+        VirtualMachine(peephole=True).run_code(code)
+        reports = report(code)
+        self.assertEqual(
+            [(r.name, r.before - r.after) for r in reports],
+            [('<module>', 0), ('f', 2)],
+        )
+        lines = format_report(reports)
+        self.assertEqual(
+            lines[1], "<test>:1 f: 2 removed of 4 (folded 2, unreachable 0, "
+            "redundant 0), 0 jumps threaded, 0 containers elided",
+        )
+
+
+class TestPeepholeBehaviour(vmtest.VmTestCase):
+    def test_folded_code(self):
+        self.assert_ok("""\
+            def f(a):
+                line = '-' * 30
+                if not 1 > 2:
+                    a += 1
+                else:
+                    a -= 1
+                return line, a, 3 < 4, 'b' in 'abc'
+            print(f(2))
+            """)
+
+    def test_exceptions_in_loops(self):
+        self.assert_ok("""\
+            def f(items):
+                total = 0
+                for item in items:
+                    try:
+                        total += 10 // item
+                    except ZeroDivisionError:
+                        continue
+                    finally:
+                        total += 1
+                    if item > 3:
+                        break
+                else:
+                    return -1
+                return total
+            print(f([1, 0, 2, 5, 7]), f([0, 1]))
+            """)
+
+    def test_swaps(self):
+        self.assert_ok("""\
+            def f(a, b, c, d, e):
+                a, b, c, d, e = e, d, c, b, a
+                [a, b, c, d] = [b, c, d, a]
+                (a,) = (b,)
+                return a, b, c, d, e
+            print(f(1, 2, 3, 4, 5))
+            """)
+
+    def test_calls_with_unpacking(self):
+        self.assert_ok("""\
+            def show(*args, **kwargs):
+                return args, sorted(kwargs.items())
+            class Thing(object):
+                def show(self, *args, **kwargs):
+                    return show(self is not None, *args, **kwargs)
+            def f(x, a, k):
+                t = Thing()
+                return [
+                    show(x, *a),
+                    show(**k),
+                    show(x, **k),
+                    show(x, *a, **k),
+                    show(x, y=1, **k),
+                    show(x, *a, *(i * 2 for i in a), z=1, **k, **{'w': 2}),
+                    t.show(x, *a, **k),
+                    Thing.show(t, *a, y=3),
+                ]
+            for row in f(0, [1, 2], {'k': 3}):
+                print(row)
+            """)
+
+    def test_failing_constant_operations(self):
+        self.assert_ok("""\
+            def f():
+                return 1 / 0
+            f()
+            """, raises=ZeroDivisionError)
+
+
+if __name__ == '__main__':
+    unittest.main()
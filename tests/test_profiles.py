@@ -0,0 +1,147 @@
+"""Tests of specialization profiles in Bytevm."""
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bytevm.execfile import ExecFile
+from bytevm.profiles import Profile, code_hash
+from bytevm.pyvm2 import VirtualMachine
+from bytevm.sys import pseudosys
+
+HOT_SOURCE = """\
+def add(a, b):
+    return a + b
+def fn(n):
+    total = 0
+    for i in range(n):
+        total = add(total, i)
+    return len(str(total))
+result = fn(N)
+"""
+
+
+def fn_code(code):
+    """Get the code of fn() in HOT_SOURCE compiled to `code`."""
+    return [c for c in code.co_consts if hasattr(c, 'co_code')][1]
+
+
+class ProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'profile.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_source(self, source, n, profile=None):
+        """Run `source` with `N` set to `n`, inlining calls.
+
+        The source is compiled afresh, so its programs are new.  If
+        `profile` is given, it specializes them first, and records them
+        after.  Returns the VM and the code run.
+
+        """
+        code = compile(source, "<test>", "exec")
+        if profile is not None:
+            profile.apply(code)
+        vm = VirtualMachine(inlining=True)
+        f_globals = {'__builtins__': __builtins__, 'N': n}
+        vm.run_code(code, f_globals=f_globals)
+        if profile is not None:
+            profile.record(code)
+        return vm, code
+
+    def outcomes(self, vm):
+        return [(d.callee, d.outcome) for d in vm.inlining_decisions]
+
+
+class TestProfiles(ProfileTestCase):
+    def test_warm_start_inlines_at_once(self):
+        # Cold, a single call isn't enough to inline.
+        vm, code = self.run_source(HOT_SOURCE, 1)
+        self.assertEqual(self.outcomes(vm), [])
+
+        profile = Profile(self.path)
+        vm, code = self.run_source(HOT_SOURCE, 100, profile)
+        self.assertEqual(self.outcomes(vm), [('add', 'inlined')])
+        profile.save()
+
+        # Warm, it is, in a fresh copy of the code.
+        profile = Profile.load(self.path)
+        vm, code = self.run_source(HOT_SOURCE, 1, profile)
+        self.assertEqual(self.outcomes(vm), [('add', 'inlined')])
+        self.assertIn('inlined', profile.entries[code_hash(fn_code(code))])
+
+    def test_changed_caller_is_not_specialized(self):
+        profile = Profile(self.path)
+        self.run_source(HOT_SOURCE, 100, profile)
+
+        changed = HOT_SOURCE.replace("total = 0", "total = -0")
+        code = compile(changed, "<test>", "exec")
+        self.assertEqual(profile.apply(code), 0)
+        vm, code = self.run_source(changed, 1, profile)
+        self.assertEqual(self.outcomes(vm), [])
+
+    def test_changed_callee_is_not_inlined_at_once(self):
+        profile = Profile(self.path)
+        self.run_source(HOT_SOURCE, 100, profile)
+
+        # The caller is the same, but the function it calls isn't.
+        changed = HOT_SOURCE.replace("a + b", "b + a")
+        vm, code = self.run_source(changed, 1, profile)
+        self.assertEqual(self.outcomes(vm), [])
+        # Nor is it inlined later than usual.
+        vm, code = self.run_source(changed, 100, profile)
+        self.assertEqual(self.outcomes(vm), [('add', 'inlined')])
+
+    def test_unusable_files_give_empty_profiles(self):
+        self.assertEqual(Profile.load(self.path).entries, {})
+        with open(self.path, 'w') as f:
+            f.write("{not json")
+        self.assertEqual(Profile.load(self.path).entries, {})
+        with open(self.path, 'w') as f:
+            json.dump({'version': 0, 'host': '', 'codes': {'x': {}}}, f)
+        self.assertEqual(Profile.load(self.path).entries, {})
+
+    def test_malformed_entries_are_skipped(self):
+        code = compile(HOT_SOURCE, "<test>", "exec")
+        profile = Profile(self.path)
+        profile.entries[code_hash(fn_code(code))] = {'inlined': []}
+        self.assertEqual(profile.apply(code), 0)
+        vm, code = self.run_source(HOT_SOURCE, 1)
+        self.assertEqual(self.outcomes(vm), [])
+
+
+class TestExecFile(ProfileTestCase):
+    def run_file(self, n):
+        filename = os.path.join(self.dir, 'hot.py')
+        with open(filename, 'w') as f:
+            f.write(HOT_SOURCE.replace("N", str(n)))
+        argv, path = pseudosys.argv, pseudosys.path[0]
+        try:
+            ExecFile(inlining=True, profile=self.path).run_python_file(
+                filename, [filename],
+            )
+        finally:
+            pseudosys.argv, pseudosys.path[0] = argv, path
+
+    def test_run_python_file_keeps_the_profile(self):
+        self.run_file(100)
+        entries = Profile.load(self.path).entries
+        inlined = [key for key, entry in entries.items() if 'inlined' in entry]
+        self.assertEqual(len(inlined), 1)
+
+        # A run too short to inline cold keeps the hint for the next one.
+        self.run_file(1)
+        self.assertEqual(
+            Profile.load(self.path).entries[inlined[0]], entries[inlined[0]],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
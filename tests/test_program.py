@@ -0,0 +1,578 @@
+"""Tests of decoded programs for Bytevm."""
+
+from __future__ import print_function
+
+import gc
+import unittest
+
+from bytevm import pyobj
+from bytevm.program import EXTRA_OPCODES, get_program, opmap, _programs
+from bytevm.pyvm2 import VirtualMachine
+
+from . import vmtest
+
+
+SOURCE = """\
+def helper(x):
+    y = x + 1
+    return y
+"""
+
+
+class TestProgramCache(unittest.TestCase):
+    def compile_helper(self):
+        return compile(SOURCE, "<helper>", "exec").co_consts[0]
+
+    def test_program_is_shared(self):
+        code = self.compile_helper()
+        self.assertIs(get_program(code), get_program(code))
+
+    def test_equal_code_objects_get_their_own_program(self):
+        code1 = self.compile_helper()
+        code2 = self.compile_helper()
+        self.assertEqual(code1, code2)
+        self.assertIsNot(get_program(code1), get_program(code2))
+
+    def test_program_is_evicted_with_its_code(self):
+        code = self.compile_helper()
+        get_program(code)
+        key = id(code)
+        self.assertIn(key, _programs)
+        del code
+        gc.collect()
+        self.assertNotIn(key, _programs)
+
+    def test_frames_share_the_program(self):
+        code = self.compile_helper()
+        vm = VirtualMachine()
+        frame1 = vm.make_frame(code, {'x': 1}, {'__builtins__': __builtins__})
+        frame2 = vm.make_frame(code, {'x': 2}, {'__builtins__': __builtins__})
+        self.assertIs(frame1.program, frame2.program)
+
+    def test_equal_constants_are_kept_apart(self):
+        code = compile("a = 1\nb = 1.0\nc = True\nd = 1\n", "<consts>", "exec")
+        program = get_program(code)
+        consts = [
+            program.instruction(i)[1][0] for i in range(len(program))
+            if program.instruction(i)[0] == 'LOAD_CONST'
+        ]
+        self.assertEqual([type(c) for c in consts], [int, float, bool, int, type(None)])
+        # The two loads of 1 share their operands.
+        self.assertEqual(program.operands[0], program.operands[6])
+
+    def test_operands_are_shared_between_programs(self):
+        program1 = get_program(self.compile_helper())
+        program2 = get_program(self.compile_helper())
+        self.assertIs(program1.instruction(0)[1], program2.instruction(0)[1])
+
+    def test_line_numbers(self):
+        program = get_program(self.compile_helper())
+        self.assertEqual(program.line_number(0), 1)
+        self.assertEqual(program.lines[0], 2)
+        self.assertEqual(program.lines[-1], 3)
+
+
+LOOP_SOURCE = """\
+def count(n):
+    i = 0
+    while i < n:
+        i = i + 1
+    return i
+"""
+
+# Operands that aren't all fast locals or constants leave pairs to fuse.
+PAIRS_SOURCE = """\
+def count(items):
+    i = 0
+    while len(items) > i:
+        i = max(i, 1) + items[i]
+    return i
+"""
+
+
+class TestSuperinstructions(unittest.TestCase):
+    def compile_count(self, source=LOOP_SOURCE):
+        return compile(source, "<count>", "exec").co_consts[0]
+
+    def test_fused_program_is_cached_separately(self):
+        code = self.compile_count()
+        plain = get_program(code)
+        fused = get_program(code, superinstructions=True)
+        self.assertIsNot(plain, fused)
+        self.assertIs(fused, get_program(code, superinstructions=True))
+        self.assertIs(plain, get_program(code))
+
+    def test_fusion_keeps_indices_and_lines(self):
+        code = self.compile_count(PAIRS_SOURCE)
+        plain = get_program(code)
+        fused = get_program(code, superinstructions=True)
+        self.assertEqual(len(plain), len(fused))
+        self.assertEqual(plain.lines, fused.lines)
+        names = [fused.instruction(i)[0] for i in range(len(fused))]
+        self.assertIn('COMPARE_OP__POP_JUMP_IF_FALSE', names)
+        self.assertIn('LOAD_FAST__LOAD_CONST', names)
+        for i, name in enumerate(names):
+            if '__' in name:
+                # The second half is still there for jumps to land on.
+                self.assertEqual(fused.instruction(i+1), plain.instruction(i+1))
+                self.assertEqual(
+                    fused.instruction(i)[1],
+                    plain.instruction(i)[1] + plain.instruction(i+1)[1],
+                )
+
+    def test_quickened_runs(self):
+        code = self.compile_count()
+        plain = get_program(code)
+        fused = get_program(code, superinstructions=True)
+        self.assertEqual(len(plain), len(fused))
+        self.assertEqual(plain.lines, fused.lines)
+        names = [fused.instruction(i)[0] for i in range(len(fused))]
+        self.assertIn('COMPARE_FAST_FAST_JUMP_IF_FALSE', names)
+        self.assertIn('OPERATOR_FAST_CONST_STORE', names)
+        for i, name in enumerate(names):
+            if name in ('COMPARE_FAST_FAST_JUMP_IF_FALSE',
+                        'OPERATOR_FAST_CONST_STORE'):
+                # The rest of the run is still there for jumps to land on.
+                run = [plain.instruction(j) for j in range(i, i + 4)]
+                self.assertEqual(fused.instruction(i + 1), run[1])
+                self.assertEqual(fused.instruction(i + 3), run[3])
+        i = names.index('OPERATOR_FAST_CONST_STORE')
+        self.assertEqual(fused.instruction(i)[1], (1, 1, opmap['BINARY_ADD'], 1))
+
+    def test_overridden_parts_of_runs(self):
+        # A VM class that overrides an instruction a run is made of runs
+        # the run's instructions one by one.
+        class CountingVM(VirtualMachine):
+            operations = 0
+
+            def binaryOperator(self, op):
+                CountingVM.operations += 1
+                return super(CountingVM, self).binaryOperator(op)
+
+        code = compile(LOOP_SOURCE + "result = count(10)\n", "<count>", "exec")
+        f_globals = {'__builtins__': __builtins__}
+        CountingVM(superinstructions=True).run_code(code, f_globals=f_globals)
+        self.assertEqual(f_globals['result'], 10)
+        self.assertEqual(CountingVM.operations, 10)
+
+    def test_fused_and_plain_agree(self):
+        code = compile(LOOP_SOURCE + "result = count(10)\n", "<count>", "exec")
+        results = []
+        for superinstructions in [False, True]:
+            f_globals = {'__builtins__': __builtins__}
+            vm = VirtualMachine(superinstructions=superinstructions)
+            vm.run_code(code, f_globals=f_globals)
+            results.append(f_globals['result'])
+        self.assertEqual(results, [10, 10])
+
+
+class TestQuickening(unittest.TestCase):
+    def test_quickened_program_is_cached_separately(self):
+        code = compile(LOOP_SOURCE, "<count>", "exec").co_consts[0]
+        quickened = get_program(code, quicken=True)
+        self.assertIsNot(quickened, get_program(code))
+        self.assertIsNot(quickened, get_program(code, superinstructions=True))
+        self.assertIs(quickened, get_program(code, quicken=True))
+        # Superinstructions imply quickening.
+        self.assertIs(
+            get_program(code, superinstructions=True, quicken=True),
+            get_program(code, superinstructions=True),
+        )
+
+    def test_runs_are_quickened_without_superinstructions(self):
+        code = compile(PAIRS_SOURCE, "<count>", "exec").co_consts[0]
+        plain = get_program(code)
+        quickened = get_program(code, quicken=True)
+        fused = get_program(code, superinstructions=True)
+        self.assertEqual(len(plain), len(quickened))
+        self.assertEqual(plain.lines, quickened.lines)
+        names = [quickened.instruction(i)[0] for i in range(len(quickened))]
+        self.assertIn('OPERATOR_FAST_FAST', names)
+        self.assertIn('ADD_STORE_FAST', names)
+        self.assertIn('COMPARE_OP', names)
+        # Everything a fused program has but superinstructions.
+        for i in range(len(quickened)):
+            if '__' in fused.instruction(i)[0]:
+                self.assertEqual(quickened.instruction(i), plain.instruction(i))
+            else:
+                self.assertEqual(quickened.instruction(i), fused.instruction(i))
+
+    def test_quickened_runs_run(self):
+        code = compile(LOOP_SOURCE + "result = count(10)\n", "<count>", "exec")
+        f_globals = {'__builtins__': __builtins__}
+        VirtualMachine(quicken=True).run_code(code, f_globals=f_globals)
+        self.assertEqual(f_globals['result'], 10)
+        program = get_program(f_globals['count'].func_code, quicken=True)
+        names = [program.instruction(i)[0] for i in range(len(program))]
+        self.assertIn('OPERATOR_FAST_CONST_STORE', names)
+
+
+METHODS = """\
+def fn(obj, other):
+    obj.a.b(other.c(1), other.d)
+    obj.e(x=1)
+    f(obj.g)
+    obj.h(1 if other else 2)
+"""
+
+
+@unittest.skipUnless(
+    'LOAD_METHOD' in EXTRA_OPCODES, "the host has its own LOAD_METHOD"
+)
+class TestMethodCalls(unittest.TestCase):
+    def test_method_calls_are_found(self):
+        code = compile(METHODS, "<methods>", "exec").co_consts[0]
+        program = get_program(code)
+        loads = [
+            (name, args[0]) for name, args in map(program.instruction, range(len(program)))
+            if name in ('LOAD_ATTR', 'LOAD_METHOD')
+        ]
+        self.assertEqual(loads, [
+            ('LOAD_ATTR', 'a'), ('LOAD_METHOD', 'b'), ('LOAD_METHOD', 'c'),
+            ('LOAD_ATTR', 'd'), ('LOAD_ATTR', 'e'), ('LOAD_ATTR', 'g'),
+            ('LOAD_ATTR', 'h'),
+        ])
+        calls = [
+            name for name, _ in map(program.instruction, range(len(program)))
+            if name.startswith('CALL_')
+        ]
+        self.assertEqual(calls, [
+            'CALL_METHOD', 'CALL_METHOD', 'CALL_FUNCTION_KW',
+            'CALL_FUNCTION', 'CALL_FUNCTION',
+        ])
+
+    def test_method_calls_make_no_bound_methods(self):
+        made = []
+
+        class CountingMethod(pyobj.Method):
+            __slots__ = []
+
+            def __init__(self, *args):
+                made.append(self)
+                super(CountingMethod, self).__init__(*args)
+
+        source = """\
+class Counter(object):
+    def __init__(self):
+        self.n = 0
+    def bump(self, by):
+        self.n += by
+        return self
+c = Counter()
+for i in range(10):
+    c.bump(1).bump(2)
+bump = c.bump
+"""
+        f_globals = {'__builtins__': __builtins__}
+        Method, pyobj.Method = pyobj.Method, CountingMethod
+        try:
+            VirtualMachine().run_code(
+                compile(source, "<methods>", "exec"), f_globals=f_globals,
+            )
+        finally:
+            pyobj.Method = Method
+        self.assertEqual(f_globals['c'].n, 30)
+        # Only __init__, which the host calls, and the method that isn't
+        # called straight away are bound.
+        self.assertEqual(len(made), 2)
+
+
+RANGE_SOURCE = """\
+def total(n, step):
+    t = 0
+    for i in range(0, n, step):
+        if i % 3:
+            continue
+        t += i
+    for x, y in zip(range(n), range(n)):
+        t += x
+    return t
+"""
+
+
+class CountingRange(object):
+    """A stand-in for range() making lists, which counts its calls."""
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return list(range(*args))
+
+
+class TestCountingLoops(unittest.TestCase):
+    def test_loops_are_specialized(self):
+        code = compile(RANGE_SOURCE, "<range>", "exec").co_consts[0]
+        plain = get_program(code)
+        fused = get_program(code, superinstructions=True)
+        self.assertEqual(len(plain), len(fused))
+        self.assertEqual(plain.lines, fused.lines)
+        names = [fused.instruction(i)[0] for i in range(len(fused))]
+        # Only the loop storing its values straight into a local.
+        self.assertEqual(names.count('GET_RANGE_ITER'), 1)
+        self.assertEqual(names.count('FOR_ITER_STORE'), 1)
+        self.assertEqual(names.count('GET_ITER'), 1)
+        # The `continue`, and the end of the loop's body.
+        self.assertEqual(names.count('JUMP_FOR_ITER_STORE'), 2)
+        i = names.index('FOR_ITER_STORE')
+        self.assertEqual(names[i - 1], 'GET_RANGE_ITER')
+        self.assertEqual(fused.instruction(i + 1), plain.instruction(i + 1))
+        self.assertEqual(
+            fused.instruction(i)[1],
+            plain.instruction(i)[1] + plain.instruction(i + 1)[1] + (i + 2,),
+        )
+        for j, name in enumerate(names):
+            if name == 'JUMP_FOR_ITER_STORE':
+                self.assertEqual(plain.instruction(j), ('JUMP_ABSOLUTE', (i,)))
+                self.assertEqual(fused.instruction(j)[1], fused.instruction(i)[1])
+
+    def run_total(self, vm_class, **f_globals):
+        code = compile(RANGE_SOURCE + "result = total(20, 2)\n", "<range>", "exec")
+        f_globals['__builtins__'] = __builtins__
+        vm_class(superinstructions=True).run_code(code, f_globals=f_globals)
+        return f_globals['result']
+
+    def test_rebound_range_falls_back(self):
+        expected = self.run_total(VirtualMachine)
+        self.assertEqual(expected, 0 + 6 + 12 + 18 + sum(range(20)))
+        ranges = CountingRange()
+        self.assertEqual(self.run_total(VirtualMachine, range=ranges), expected)
+        self.assertEqual(ranges.calls, 3)
+
+    def test_overridden_parts_of_loops(self):
+        # A VM class that overrides an instruction a loop is made of runs
+        # the loop's instructions one by one.
+        class CountingVM(VirtualMachine):
+            steps = 0
+
+            def byte_FOR_ITER(self, jump):
+                CountingVM.steps += 1
+                return super(CountingVM, self).byte_FOR_ITER(jump)
+
+        self.assertEqual(self.run_total(CountingVM), self.run_total(VirtualMachine))
+        # Ten steps and the end of each loop.
+        self.assertEqual(CountingVM.steps, 11 + 21)
+
+
+class TestCountingLoopBehaviour(vmtest.VmTestCase):
+    def test_ranges(self):
+        self.assert_ok("""\
+            out = []
+            for args in [(5,), (2, 7), (0, 10, 3), (10, 0, -3), (5, 5),
+                         (5, 0), (0, 5, -1), (-3, 3, 2), (2**70, 2**70 + 3),
+                         (3, -2**70, -2**69)]:
+                values = []
+                for i in range(*args):
+                    values.append(i)
+                else:
+                    values.append('done')
+                out.append(values)
+            print(out)
+            """)
+
+    def test_breaks_and_nested_loops(self):
+        self.assert_ok("""\
+            def f(n):
+                pairs = []
+                for i in range(n):
+                    if i == 4:
+                        break
+                    for j in range(i):
+                        if j == 2:
+                            continue
+                        pairs.append((i, j))
+                else:
+                    return None
+                return pairs, i
+            print(f(10), f(3))
+            """)
+
+    def test_other_iterables(self):
+        self.assert_ok("""\
+            class R(object):
+                def __iter__(self):
+                    return iter([3, 2, 1])
+            def f(items):
+                out = []
+                for item in items:
+                    out.append(item)
+                return out
+            print(f([1, 2]), f('ab'), f(R()), f(iter(range(3))),
+                  f(x * 2 for x in range(3)), f({}))
+            """)
+
+    def test_rebound_range(self):
+        self.assert_ok("""\
+            def range(n):
+                return ['a', 'b'][:n]
+            def f():
+                out = []
+                for x in range(2):
+                    out.append(x)
+                return out
+            print(f())
+            """)
+
+    def test_loops_in_generators(self):
+        self.assert_ok("""\
+            def gen(n):
+                for i in range(n):
+                    yield i * i
+            print(list(gen(5)), sum(gen(100)))
+            """)
+
+    def test_failing_iterators(self):
+        self.assert_ok("""\
+            def bad():
+                yield 1
+                raise ValueError("bad")
+            def f():
+                total = 0
+                for i in bad():
+                    total += i
+                return total
+            f()
+            """, raises=ValueError)
+
+
+CONCAT_SOURCE = """\
+def build(pieces, sep):
+    s = ''
+    n = 0
+    for piece in pieces:
+        s += piece
+        s = s + ','
+        s += str(len(piece)) + sep
+        n += 1
+    return s, n
+"""
+
+
+class TestConcatenation(unittest.TestCase):
+    def test_adds_and_stores_are_specialized(self):
+        code = compile(CONCAT_SOURCE, "<concat>", "exec").co_consts[0]
+        plain = get_program(code)
+        fused = get_program(code, superinstructions=True)
+        self.assertEqual(len(plain), len(fused))
+        names = [fused.instruction(i)[0] for i in range(len(fused))]
+        # Adding a local may still be quickened, but adding a string
+        # constant is left to ADD_STORE_FAST, unlike adding a number.
+        self.assertEqual(names.count('OPERATOR_FAST_FAST_STORE'), 1)
+        self.assertEqual(names.count('ADD_STORE_FAST'), 2)
+        self.assertEqual(names.count('OPERATOR_FAST_CONST_STORE'), 1)
+        i = names.index('ADD_STORE_FAST')
+        self.assertEqual(plain.instruction(i)[0], 'BINARY_ADD')
+        self.assertEqual(
+            fused.instruction(i)[1],
+            (opmap['BINARY_ADD'],) + plain.instruction(i + 1)[1],
+        )
+
+    def test_names_are_specialized(self):
+        code = compile("s = ''\ns += 'x'\n", "<concat>", "exec")
+        fused = get_program(code, superinstructions=True)
+        names = [fused.instruction(i)[0] for i in range(len(fused))]
+        self.assertIn('ADD_STORE_NAME', names)
+
+
+class TestConcatenationBehaviour(vmtest.VmTestCase):
+    def test_building_strings(self):
+        self.assert_ok("""\
+            def build(pieces, sep):
+                s = ''
+                n = 0
+                for piece in pieces:
+                    s += piece
+                    s = s + ','
+                    s += str(len(piece)) + sep
+                    n += 1
+                return s, n
+            print(build(['ab', 'c', ''], ';'))
+            t = ''
+            for i in range(5):
+                t += str(i)
+                t = t + '-'
+            print(t)
+            """)
+
+    def test_shared_strings_are_left_alone(self):
+        self.assert_ok("""\
+            def f():
+                s = 'ab' * 3
+                t = s
+                s += 'x'
+                s = s + s
+                d = {'k': s}
+                s += 'y'
+                return s, t, d
+            print(f())
+            class C(object):
+                name = 'c'
+                alias = name
+                name += 'd'
+            print(C.name, C.alias)
+            """)
+
+    def test_other_types(self):
+        self.assert_ok("""\
+            class S(str):
+                pass
+            def f(a, b):
+                a += b
+                a = a + b
+                return a
+            print(f(1, 2), f([1], [2]), f(S('a'), 'b'), f(b'a', b'b'),
+                  f('a', S('b')), type(f(S('a'), 'b')))
+            """)
+
+    def test_appending_keeps_the_string(self):
+        # The strings are short enough for the host to grow them without
+        # moving them, as long as nothing else holds them.  The first
+        # append is ADD_STORE_NAME's, the second ADD_STORE_FAST's.
+        source = """\
+s = ''.join(['a', 'b'])
+start = id(s)
+s += 'c'
+same = id(s) == start
+def f():
+    t = ''.join(['d', 'e'])
+    start = id(t)
+    t += 'f'
+    return t, id(t) == start
+result = f()
+"""
+        code = compile(source, "<concat>", "exec")
+        fused = get_program(code, superinstructions=True)
+        self.assertIn('ADD_STORE_NAME', [
+            fused.instruction(i)[0] for i in range(len(fused))
+        ])
+        function = [c for c in code.co_consts if hasattr(c, 'co_code')][0]
+        fused = get_program(function, superinstructions=True)
+        self.assertIn('ADD_STORE_FAST', [
+            fused.instruction(i)[0] for i in range(len(fused))
+        ])
+        for superinstructions in [False, True]:
+            f_globals = {'__builtins__': __builtins__}
+            vm = VirtualMachine(superinstructions=superinstructions)
+            vm.run_code(code, f_globals=f_globals)
+            self.assertEqual(f_globals['s'], 'abc')
+            self.assertTrue(f_globals['same'])
+            self.assertEqual(f_globals['result'], ('def', True))
+
+    def test_failing_adds_keep_the_variable(self):
+        self.assert_ok("""\
+            def join(a, b, c):
+                return a + b + c
+            def f():
+                s = 'abc'
+                for i in range(40):
+                    try:
+                        s = join(s, 'd', '' if i < 20 else 1)
+                    except TypeError:
+                        pass
+                    try:
+                        s += 1
+                    except TypeError:
+                        pass
+                return s
+            print(f())
+            """)
@@ -40,19 +40,31 @@ class VmTestCase(unittest.TestCase):
         # Print the disassembly so we'll see it if the test fails.
         dis_code(code)
 
-        # Run the code through our VM and the real Python interpreter, for comparison.
-        vm_value, vm_exc, vm_stdout = self.run_in_bytevm(code)
+        # Run the code through our VM and the real Python interpreter, for
+        # comparison.  The VM runs it with and without superinstructions,
+        # quickening without them, in stackless mode, inlining calls, and
+        # with the peephole optimizer.
         py_value, py_exc, py_stdout = self.run_in_real_python(code)
-
-        self.assert_same_exception(vm_exc, py_exc)
-        self.assertEqual(vm_stdout.getvalue(), py_stdout.getvalue())
-        self.assertEqual(vm_value, py_value)
-        if raises:
-            self.assertIsInstance(vm_exc, raises)
-        else:
-            self.assertIsNone(vm_exc)
-
-    def run_in_bytevm(self, code):
+        for options in [
+            {'superinstructions': False},
+            {'superinstructions': True},
+            {'quicken': True},
+            {'stackless': True},
+            {'superinstructions': True, 'inlining': True},
+            {'peephole': True},
+            {'superinstructions': True, 'peephole': True},
+        ]:
+            vm_value, vm_exc, vm_stdout = self.run_in_bytevm(code, **options)
+
+            self.assert_same_exception(vm_exc, py_exc)
+            self.assertEqual(vm_stdout.getvalue(), py_stdout.getvalue())
+            self.assertEqual(vm_value, py_value)
+            if raises:
+                self.assertIsInstance(vm_exc, raises)
+            else:
+                self.assertIsNone(vm_exc)
+
+    def run_in_bytevm(self, code, **options):
         real_stdout = sys.stdout
 
         # Run the code through our VM.
@@ -60,7 +72,7 @@ class VmTestCase(unittest.TestCase):
         vm_stdout = six.StringIO()
         if CAPTURE_STDOUT:              # pragma: no branch
             sys.stdout = vm_stdout
-        vm = VirtualMachine()
+        vm = VirtualMachine(**options)
 
         vm_value = vm_exc = None
         try: